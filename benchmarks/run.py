@@ -0,0 +1,259 @@
+"""
+Benchmark suite of the serving and training hot paths.
+
+Usage (from the project root):
+    python -m benchmarks.run                                  # all scenarios
+    python -m benchmarks.run --scenarios tick predict         # some scenarios
+    python -m benchmarks.run --scenarios fleet --machines 10000  # generated fleet, not in the default run
+    python -m benchmarks.run --compare benchmarks/results/old.json --tolerance 0.2
+
+Results are saved as JSON in benchmarks/results, --compare exits with code 1 if any
+timing of this run is slower than the old run by more than the tolerance.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import warnings
+import numpy as np
+import pandas as pd
+warnings.filterwarnings("ignore")
+
+from data_synthetic.generate_data import HealthyData, FaultyData
+
+
+RESULTS_FOLDER = "./benchmarks/results"
+
+
+def measure(function, repeats):
+    """
+    Call the function repeats times and return the latency statistics in milliseconds
+    """
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings = np.array(timings)
+    return dict(
+        repeats=repeats,
+        mean_ms=float(timings.mean()),
+        median_ms=float(np.median(timings)),
+        p95_ms=float(np.percentile(timings, 95)),
+        min_ms=float(timings.min()),
+    )
+
+
+def make_dataset(segments=4, healthy_size=3000, faulty_size=1500):
+    """
+    Labeled dataset like PROCESSED_DATA built from data_synthetic/healthy.csv and faulty.csv.
+    Healthy and faulty segments are alternated and a 10 second timestamp index is added.
+    """
+    healthy = HealthyData().data
+    faulty = FaultyData().data
+    parts = []
+    for segment in range(segments):
+        start = segment * healthy_size % (healthy.shape[0] - healthy_size)
+        parts.append(healthy.iloc[start : start+healthy_size].assign(status=0))
+        start = segment * faulty_size % (faulty.shape[0] - faulty_size)
+        parts.append(faulty.iloc[start : start+faulty_size].assign(status=1))
+    data = pd.concat(parts, ignore_index=True)
+    data.index = pd.date_range("2020-04-01", periods=data.shape[0], freq="10s", name="timestamp")
+    return data
+
+
+def bench_tick(windows, repeats):
+    """
+    Per tick latency of update_data_queue and update_figure for every DATA_WINDOW size, with a full data queue
+    """
+    import main
+    from serving.session import SessionStore
+
+    results = {}
+    for window in windows:
+        main.DATA_WINDOW = window
+        main.sessions = SessionStore(window, main.healthy_data.get_column_names())
+
+        session = f"bench-{window}"
+        state = dict(cursor=0)
+
+        def tick(model_used="clustering", n_interval=1):
+            state["cursor"] = main.update_data_queue(n_interval, session, 2, model_used)
+
+        tick(n_interval=None)
+        for _ in range(window):
+            tick() # Fill the queue
+
+        results[str(window)] = dict(
+            update_data_queue=measure(tick, repeats),
+            update_figure=measure(lambda: main.update_figure(state["cursor"], "TP2", session), repeats),
+        )
+    return results
+
+
+def bench_predict(window, repeats):
+    """
+    Latency of predict of every saved model on a data queue of window rows
+    """
+    from main import clustering_model, isolation_model, profile_model
+
+    queue = HealthyData().data.iloc[:window]
+    results = {}
+    for name, model in [("clustering", clustering_model), ("isolation", isolation_model), ("profile", profile_model)]:
+        model.predict(queue) # Load the model and warm up
+        results[name] = measure(lambda: model.predict(queue), repeats)
+    return results
+
+
+def bench_fleet(n_machines, window, repeats):
+    """
+    Per tick latency of a generated fleet (FleetGenerator) - generating one reading of every machine and
+    scoring them with the FleetService, with full windows
+    """
+    from main import clustering_model
+    from serving.api import FleetService
+    from data_synthetic.generate_data import FleetGenerator
+
+    service = FleetService({"clustering": clustering_model}, n_machines, window)
+    generator = FleetGenerator(n_machines, seed=0, features=service.get_scorer("clustering").buffer.features)
+    for _ in range(window):
+        values, _, _ = generator.step()
+        service.buffer.update(values) # Fill the windows without scoring
+
+    state = {}
+
+    def generate():
+        state["batch"] = generator.generate(1)
+
+    def ingest():
+        machines, values, _, _ = state["batch"]
+        service.ingest(machines, values, "clustering")
+
+    generate()
+    ingest() # Load the model
+    return dict(generate=measure(generate, repeats), ingest=measure(ingest, repeats))
+
+
+def bench_grid(max_workers):
+    """
+    Wall time of the train_isolation grid (3 windows x 2 methods x 4 contamination x 3 max_features) on the synthetic dataset
+    """
+    from training.isolation_forest import Isolation
+    from training.grid_search import grid_search
+
+    data = make_dataset()
+    models = [Isolation(rolling_window, method, 0.5, contamination, max_feature)
+              for rolling_window in [100,150,200]
+              for method in ["ewm", "sma"]
+              for contamination in [0.05, 0.07, 0.09, 0.1]
+              for max_feature in [0.5,0.7,0.9]]
+
+    start = time.perf_counter()
+    grid_search(data, models, max_workers=max_workers)
+    wall = time.perf_counter() - start
+    return dict(rows=int(data.shape[0]), models=len(models), wall_s=wall)
+
+
+def bench_cutoffs():
+    """
+    Throughput of MatrixProfiling.find_cutoffs in query subsequences per second on the synthetic dataset
+    """
+    from training.matrix_profile import MatrixProfiling
+
+    data = make_dataset(segments=2)
+    model = MatrixProfiling()
+    model.find_cutoffs(data[data['status']==1].iloc[:4*model.window]) # Compile stumpy (numba) outside the timing
+
+    model = MatrixProfiling()
+    start = time.perf_counter()
+    model.find_cutoffs(data)
+    wall = time.perf_counter() - start
+
+    faulty_rows = int(data['status'].sum())
+    subsequences = (faulty_rows // 2 - model.window + 1) * (data.shape[1] - 1)
+    return dict(faulty_rows=faulty_rows, wall_s=wall, subsequences_per_s=subsequences / wall)
+
+
+def timings(results, prefix=""):
+    """
+    Flatten the results to {name: time} for all the timing values (lower is better)
+    """
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(timings(value, name + "."))
+        elif key in ("median_ms", "wall_s"):
+            flat[name] = value
+    return flat
+
+
+def compare(results, baseline_path, tolerance):
+    """
+    Print the ratio of every timing to the baseline and return the list of regressions
+    """
+    with open(baseline_path) as f:
+        baseline = timings(json.load(f)["results"])
+
+    regressions = []
+    for name, value in timings(results).items():
+        if name in baseline and baseline[name] > 0:
+            ratio = value / baseline[name]
+            print(f"{name:60s} {baseline[name]:12.3f} -> {value:12.3f}  x{ratio:0.2f}")
+            if ratio > 1 + tolerance:
+                regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks of serving and training hot paths")
+    parser.add_argument("--scenarios", nargs="+", default=["tick", "predict", "grid", "cutoffs"], choices=["tick", "predict", "grid", "cutoffs", "fleet"])
+    parser.add_argument("--windows", nargs="+", type=int, default=[500, 2000, 8000], help="DATA_WINDOW sizes for the tick scenario")
+    parser.add_argument("--machines", type=int, default=10000, help="No. of machines for the fleet scenario")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="No. of processes for the grid scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None)
+    parser.add_argument("--compare", default=None, help="JSON of an old run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed slow down before a timing is a regression")
+    args = parser.parse_args()
+
+    np.random.seed(args.seed)
+
+    results = {}
+    if "tick" in args.scenarios:
+        results["tick"] = bench_tick(args.windows, args.repeats)
+    if "predict" in args.scenarios:
+        results["predict"] = bench_predict(2000, args.repeats)
+    if "grid" in args.scenarios:
+        results["grid"] = bench_grid(args.workers)
+    if "cutoffs" in args.scenarios:
+        results["cutoffs"] = bench_cutoffs()
+    if "fleet" in args.scenarios:
+        results["fleet"] = bench_fleet(args.machines, 2000, min(args.repeats, 10))
+
+    report = dict(
+        created=time.strftime("%Y-%m-%d %H:%M:%S"),
+        environment=dict(python=platform.python_version(), platform=platform.platform(), cpus=os.cpu_count(),
+                         numpy=np.__version__, pandas=pd.__version__),
+        arguments=vars(args),
+        results=results,
+    )
+
+    output = args.output or os.path.join(RESULTS_FOLDER, time.strftime("bench_%Y%m%d_%H%M%S.json"))
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results saved in {output}")
+
+    if args.compare is not None:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,26 @@
 import numpy as np
 import pandas as pd
 
+
+# Datasets already read in this process - path -> pd dataframe
+DATASETS = {}
+
+
+def read_dataset(path):
+    """
+    Parameter: path(str) - csv of the synthetic data (all columns are numeric)
+    Description:
+    1. Read the csv only once per process, later calls get the same dataframe
+    2. All columns are read as float64 so the values are one contiguous NumPy block - it is never written,
+       so under gunicorn --preload the workers share its pages with the master (copy-on-write) instead of
+       parsing the csv again
+    """
+    if path not in DATASETS:
+        data = pd.read_csv(path, dtype=np.float64)
+        DATASETS[path] = data
+    return DATASETS[path]
+
+
 class HealthyData:
     """
     This class will generate healthy data for trending
@@ -11,7 +31,7 @@ class HealthyData:
         
         """
         try:
-            self.data = pd.read_csv("./data_synthetic/healthy.csv")
+            self.data = read_dataset("./data_synthetic/healthy.csv")
         except Exception as e:
             raise Exception(f"Healthy data cannot be read - {e}")
         
@@ -49,7 +69,7 @@ class FaultyData:
         
         """
         try:
-            self.data = pd.read_csv("./data_synthetic/faulty.csv")
+            self.data = read_dataset("./data_synthetic/faulty.csv")
         except Exception as e:
             raise Exception(f"faulty data cannot be read - {e}")
         
@@ -67,3 +87,96 @@ class FaultyData:
     
     
     
+class FleetGenerator:
+    """
+    Vectorized synthetic readings of many machines for load tests.
+
+    1. Every machine replays healthy.csv from its own random start row (phase offset), all machines
+       are advanced together with one NumPy fancy index per step
+    2. Gaussian noise with a per-machine scale is added to the analog features, digital (0/1) features are not changed
+    3. Air leak episodes - a healthy machine starts one with probability fault_rate per reading,
+       for fault_duration readings it replays faulty.csv from a random row and its ground truth label is 1
+    4. Readings are timed at rate per second from start, so with the same seed and start the stream is the same
+    """
+    def __init__(self, n_machines, rate=1.0, seed=0, noise=0.02, fault_rate=1e-4, fault_duration=(300, 1800),
+                 start=None, features=None):
+        """
+        Parameters:
+        n_machines(int) - no. of machines, machine ids are 0 .. n_machines-1
+        rate(float) - readings per second of every machine
+        seed(int) - seed of the random generator
+        noise(float) - std of the noise as a fraction of the std of the feature (per-machine scale is 0.5x to 1.5x of it)
+        fault_rate(float) - probability that a healthy machine starts an air leak at a reading
+        fault_duration(tuple) - (min, max) no. of readings of an air leak episode
+        start - timestamp of the first reading, default is 2020-01-01
+        features(list) - order of the features in the output, default is the columns of healthy.csv
+        """
+        healthy = HealthyData().data
+        features = list(healthy.columns) if features is None else list(features)
+        self.features = features
+        self.healthy = np.ascontiguousarray(healthy[features].values, dtype=np.float64)
+        self.faulty = np.ascontiguousarray(FaultyData().data[features].values, dtype=np.float64)
+
+        self.n_machines = n_machines
+        self.machines = np.arange(n_machines)
+        self.rate = rate
+        self.period = np.timedelta64(int(round(1e9 / rate)), 'ns')
+        self.fault_rate = fault_rate
+        self.fault_duration = fault_duration
+        self.rng = np.random.default_rng(seed)
+
+        analog = np.array([np.unique(self.healthy[:, i]).shape[0] > 2 for i in range(len(features))])
+        scale = noise * self.healthy.std(axis=0) * analog
+        self.noise_scale = self.rng.uniform(0.5, 1.5, size=(n_machines, 1)) * scale # Row of every machine
+        self.analog = np.flatnonzero(analog)
+
+        self.position = self.rng.integers(0, self.healthy.shape[0], size=n_machines) # Phase offset
+        self.fault_position = np.zeros(n_machines, dtype=np.int64)
+        self.fault_left = np.zeros(n_machines, dtype=np.int64) # Readings left in the air leak, 0 if healthy
+        self.time = np.datetime64(pd.Timestamp("2020-01-01") if start is None else pd.Timestamp(start), 'ns')
+
+    def labels(self):
+        """
+        Return ground truth label of every machine at its latest reading (1 - air leak, 0 - healthy)
+        """
+        return (self.fault_left > 0).astype(np.int64)
+
+    def step(self):
+        """
+        Return (values, labels, timestamp) of the next reading of all the machines -
+        2D array (machines x features), 1D array of ground truth labels and the timestamp of the readings
+        """
+        starting = (self.fault_left == 0) & (self.rng.random(self.n_machines) < self.fault_rate)
+        count = int(starting.sum())
+        if count:
+            self.fault_left[starting] = self.rng.integers(self.fault_duration[0], self.fault_duration[1] + 1, size=count)
+            self.fault_position[starting] = self.rng.integers(0, self.faulty.shape[0], size=count)
+
+        faulty = self.fault_left > 0
+        values = self.healthy[self.position % self.healthy.shape[0]]
+        values[faulty] = self.faulty[self.fault_position[faulty] % self.faulty.shape[0]]
+        values[:, self.analog] += self.rng.standard_normal((self.n_machines, self.analog.shape[0])) * self.noise_scale[:, self.analog]
+
+        labels = faulty.astype(np.int64)
+        timestamp = self.time
+        self.position += 1
+        self.fault_position[faulty] += 1
+        self.fault_left[faulty] -= 1
+        self.time = self.time + self.period
+        return values, labels, timestamp
+
+    def generate(self, steps):
+        """
+        Parameter: steps(int) - no. of readings of every machine
+        Description:
+        Return (machines, values, timestamps, labels) of the next steps readings of all the machines,
+        oldest first - the batch format of the ingestion sources with the ground truth labels
+        """
+        machines = np.tile(self.machines, steps)
+        values = np.empty((steps * self.n_machines, len(self.features)))
+        timestamps = np.empty(steps * self.n_machines, dtype='datetime64[ns]')
+        labels = np.empty(steps * self.n_machines, dtype=np.int64)
+        for step in range(steps):
+            rows = slice(step * self.n_machines, (step + 1) * self.n_machines)
+            values[rows], labels[rows], timestamps[rows] = self.step()
+        return machines, values, timestamps, labels
@@ -0,0 +1,42 @@
+import os
+import gc
+
+
+# gunicorn -c gunicorn.conf.py
+# The app is imported once in the master before the workers are forked (preload_app) - datasets and models
+# are read only once and the workers share their pages copy-on-write, so memory does not grow with workers.
+wsgi_app = "wsgi:server"
+bind = os.environ.get("BIND", "0.0.0.0:8050")
+threads = int(os.environ.get("THREADS", 4))
+preload_app = True
+
+# Dashboard sessions live in the worker which created them unless they are in Redis (SESSION_REDIS_URL) -
+# callbacks of a dashboard go to any worker, so more than one worker needs Redis
+workers = int(os.environ.get("WEB_CONCURRENCY", 2 if os.environ.get("SESSION_REDIS_URL") else 1))
+if workers > 1 and not os.environ.get("SESSION_REDIS_URL"):
+    raise RuntimeError("More than one worker needs SESSION_REDIS_URL, else set WEB_CONCURRENCY=1")
+
+# Read by main.py - with many workers the readings of the fleet API are put in shared memory before forking
+os.environ["WEB_WORKERS"] = str(workers)
+
+# Load the models in the master too, else every worker loads them on first use
+os.environ.setdefault("PRELOAD_MODELS", "1")
+
+
+def pre_fork(server, worker):
+    # Objects of the master are moved out of the garbage collector, so a collection in a worker
+    # does not write to their pages and copy them
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Forked processes do not log (log/logging.py), a worker logs into its own files
+    from log.logging import LOGGER
+    LOGGER.start_worker()
+
+
+def child_exit(server, worker):
+    # Remove the metrics of a dead worker when metrics of all the workers are collected
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,228 @@
+import queue
+import threading
+import numpy as np
+from log.logging import LOGGER
+from metrics.metrics import count_predictions, INGESTION_QUEUE_DEPTH, INGESTION_READINGS
+import logging
+
+
+class IngestionPipeline:
+    """
+    Runs the ingestion sources in background threads and feeds their readings to a sink (the scoring engine).
+
+    1. Every source runs in its own thread and puts batches of readings in one bounded queue
+    2. Backpressure when the queue is full -
+       "block" - the source waits till there is space (nothing is lost, slow sources are slowed down)
+       "drop_oldest" - the oldest waiting batch is dropped so that the latest readings are always scored
+       "drop_newest" - the new batch is dropped
+       Dropped readings are counted in self.stats["dropped"]
+    3. One consumer thread drains the queue, joins the waiting batches (up to max_batch readings) and
+       calls sink(machines, values, timestamps) once for them. Readings the sink rejects (e.g. unknown machine
+       ids, reported through sink.on_reject) and bad lines of the sources are counted in self.stats["errors"],
+       readings of a batch the sink fails on are counted in self.stats["failed"]
+    """
+    def __init__(self, sink, sources=None, maxsize=1000, policy="drop_oldest", max_batch=10000):
+        """
+        Parameters:
+        sink - function called with (machines, values, timestamps) of a batch of readings
+        sources(list) - ingestion sources
+        maxsize(int) - max no. of batches waiting in the queue
+        policy(str) - "block", "drop_oldest" or "drop_newest"
+        max_batch(int) - max no. of readings given to the sink in one call
+        """
+        if policy not in ("block", "drop_oldest", "drop_newest"):
+            raise ValueError(f"Unknown backpressure policy - {policy}")
+        self.sink = sink
+        self.sources = list(sources or [])
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.policy = policy
+        self.max_batch = max_batch
+        self.stop_event = threading.Event()
+        self.threads = []
+        self.stats_lock = threading.Lock()
+        self.stats = dict(received=0, dropped=0, processed=0, errors=0, failed=0)
+        self.batch_rejected = 0 # Readings of the current batch rejected by the sink
+        if hasattr(sink, 'on_reject'):
+            sink.on_reject = self.reject
+
+    def add_source(self, source):
+        self.sources.append(source)
+        if self.threads:
+            self.start_source(source)
+
+    def count(self, name, value):
+        with self.stats_lock:
+            self.stats[name] += value
+        INGESTION_READINGS.labels(name).inc(value)
+
+    def reject(self, count):
+        """
+        Called by the sink (in the consumer thread) with the no. of readings of the current batch it rejected
+        """
+        self.batch_rejected += count
+        self.count("errors", count)
+
+    def emit(self, machines, values, timestamps):
+        """
+        Put one batch of readings of a source in the queue as per the backpressure policy
+        """
+        batch = (np.asarray(machines), np.asarray(values, dtype=np.float64), np.asarray(timestamps))
+        size = batch[0].shape[0]
+        self.count("received", size)
+
+        if self.policy == "block":
+            while not self.stop_event.is_set():
+                try:
+                    self.queue.put(batch, timeout=0.5)
+                    return
+                except queue.Full:
+                    continue
+            return
+
+        try:
+            self.queue.put_nowait(batch)
+        except queue.Full:
+            if self.policy == "drop_newest":
+                self.count("dropped", size)
+                return
+            try:
+                dropped = self.queue.get_nowait()
+                self.count("dropped", dropped[0].shape[0])
+            except queue.Empty:
+                pass
+            try:
+                self.queue.put_nowait(batch)
+            except queue.Full:
+                self.count("dropped", size)
+
+    def consume(self):
+        """
+        Job of the consumer thread - drain the queue and feed the sink
+        """
+        while not self.stop_event.is_set() or not self.queue.empty():
+            try:
+                batches = [self.queue.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            size = batches[0][0].shape[0]
+            while size < self.max_batch:
+                try:
+                    batches.append(self.queue.get_nowait())
+                    size += batches[-1][0].shape[0]
+                except queue.Empty:
+                    break
+
+            INGESTION_QUEUE_DEPTH.set(self.queue.qsize())
+
+            machines = np.concatenate([batch[0] for batch in batches])
+            values = np.concatenate([batch[1] for batch in batches])
+            timestamps = np.concatenate([batch[2] for batch in batches])
+            self.batch_rejected = 0
+            try:
+                self.sink(machines, values, timestamps)
+                self.count("processed", machines.shape[0] - self.batch_rejected)
+            except Exception as e:
+                # Rejected readings are already counted in errors, only the rest of the batch failed
+                self.count("failed", machines.shape[0] - self.batch_rejected)
+                LOGGER.log_ingestion(f"Error in scoring {machines.shape[0] - self.batch_rejected} ingested readings - {e}", logging.ERROR)
+
+    def run_source(self, source):
+        try:
+            source.run(self.emit, self.stop_event)
+        except Exception as e:
+            LOGGER.log_ingestion(f"Error in ingestion source {type(source).__name__} - {e}", logging.ERROR)
+
+    def start_source(self, source):
+        source.on_reject = lambda count: self.count("errors", count)
+        thread = threading.Thread(target=self.run_source, args=(source,), daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def start(self):
+        """
+        Start the consumer and one thread per source
+        """
+        self.stop_event.clear()
+        consumer = threading.Thread(target=self.consume, daemon=True)
+        consumer.start()
+        self.threads.append(consumer)
+        for source in self.sources:
+            self.start_source(source)
+        LOGGER.log_ingestion(f"Ingestion started with {len(self.sources)} sources, policy - {self.policy}", logging.INFO)
+
+    def stop(self, timeout=5):
+        """
+        Stop the sources, let the consumer finish the waiting readings and return the stats
+        """
+        self.stop_event.set()
+        for thread in self.threads:
+            thread.join(timeout)
+        self.threads = []
+        LOGGER.log_ingestion(f"Ingestion stopped - {self.get_stats()}", logging.INFO)
+        return self.get_stats()
+
+    def get_stats(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats["queue_depth"] = self.queue.qsize()
+        return stats
+
+
+class FleetSink:
+    """
+    Sink of the ingestion pipeline which feeds the readings to a FleetService and keeps the latest
+    label and score of every machine for the dashboards to read.
+    With a TimeSeriesStore every reading is also recorded - label and score only on the latest reading
+    of every machine in the batch (the only one scored), -1 / nan on the others.
+    """
+    def __init__(self, service, model="clustering", store=None):
+        """
+        Parameters:
+        service - FleetService
+        model(str) - name of the model in service.models
+        store - TimeSeriesStore with the features of the model, None to keep no history
+        """
+        self.service = service
+        self.model = model
+        self.store = store
+        self.labels = np.full(service.n_machines, -1, dtype=np.int64)
+        self.scores = np.full(service.n_machines, np.nan)
+        self.on_reject = None # Set by the pipeline, called with the no. of rejected readings
+
+    def reject(self, count):
+        if count:
+            LOGGER.log_ingestion(f"{count} readings of unknown machines are rejected", logging.WARNING)
+            if self.on_reject is not None:
+                self.on_reject(count)
+
+    def __call__(self, machines, values, timestamps):
+        """
+        Score the readings, readings of unknown machine ids are rejected (see reject)
+        """
+        # Only the latest point of every machine is scored, older readings of the batch just fill the buffer
+        batch_machines = np.asarray(machines, dtype=np.int64)
+        valid = self.service.valid(batch_machines)
+        if not valid.all():
+            self.reject(int((~valid).sum()))
+            batch_machines, values, timestamps = batch_machines[valid], values[valid], timestamps[valid]
+        if batch_machines.shape[0] == 0:
+            return
+        machines, labels, scores = self.service.ingest(batch_machines, values, self.model)
+        self.labels[machines] = labels
+        self.scores[machines] = scores
+        count_predictions(self.model, labels)
+        LOGGER.sample_prediction(self.model, labels, scores, machines)
+        if self.store is not None:
+            self.record(batch_machines, values, timestamps, labels, scores)
+
+    def record(self, machines, values, timestamps, labels, scores):
+        """
+        Append the readings of the batch to the store (labels and scores are of the sorted unique machines)
+        """
+        order = np.argsort(machines, kind='stable')
+        sorted_machines = machines[order]
+        latest = order[np.r_[sorted_machines[1:] != sorted_machines[:-1], True]] # Last reading of every machine
+        row_labels = np.full(machines.shape[0], -1, dtype=np.int64)
+        row_scores = np.full(machines.shape[0], np.nan)
+        row_labels[latest], row_scores[latest] = labels, scores
+        self.store.append_many(machines, timestamps, values, labels=row_labels, scores=row_scores)
@@ -0,0 +1,98 @@
+"""
+Runs the ingestion pipeline without the dashboard.
+
+Usage (from the project root):
+    python -m ingestion.run                                   # 10 healthy + 10 faulty machines at 1 Hz
+    python -m ingestion.run --machines 500 --rate 5 --policy block
+    python -m ingestion.run --tail ./data/live.csv --socket 9009
+    python -m ingestion.run --store                           # also record the readings for the history view
+    python -m ingestion.run --synthetic 10000 --seed 7        # load test - 10k generated machines at 1 Hz
+
+Every machine replays data_synthetic/healthy.csv or faulty.csv, readings are scored by the
+FleetService with the chosen model and the pipeline stats are printed every --report seconds.
+With --synthetic the replayed machines are replaced by a generated fleet (FleetGenerator) with noise,
+phase offsets and air leak episodes, the report also has the no. of machines really in an air leak.
+"""
+import time
+import argparse
+import pandas as pd
+
+from ingestion.pipeline import IngestionPipeline, FleetSink
+from storage.timeseries import TimeSeriesStore
+from ingestion.sources import CsvReplaySource, FileTailSource, SocketSource, SyntheticFleetSource
+from data_synthetic.generate_data import FleetGenerator
+from serving.api import FleetService
+from training.artifacts import LazyModel, load_model
+from path.path import CLUSTERING_MODEL, ISOLATION_MODEL, CLUSTERING_ARTIFACT, ISOLATION_ARTIFACT
+
+
+HEALTHY_CSV = "./data_synthetic/healthy.csv"
+FAULTY_CSV = "./data_synthetic/faulty.csv"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest and score sensor readings of many machines")
+    parser.add_argument("--machines", type=int, default=20, help="No. of replayed machines, half of them faulty")
+    parser.add_argument("--fleet-size", type=int, default=1000, help="Max machine id + 1 accepted from the tail and socket sources")
+    parser.add_argument("--rate", type=float, default=1.0, help="Readings per second of every machine")
+    parser.add_argument("--model", default="clustering", choices=["clustering", "isolation"])
+    parser.add_argument("--window", type=int, default=2000, help="No. of latest readings kept for every machine")
+    parser.add_argument("--queue", type=int, default=1000, help="Max no. of batches waiting to be scored")
+    parser.add_argument("--policy", default="drop_oldest", choices=["block", "drop_oldest", "drop_newest"])
+    parser.add_argument("--tail", default=None, help="Also follow this csv file")
+    parser.add_argument("--socket", type=int, default=None, help="Also listen for readings on this port")
+    parser.add_argument("--duration", type=float, default=None, help="Seconds to run, forever if not given")
+    parser.add_argument("--report", type=float, default=5.0, help="Seconds between two stats reports")
+    parser.add_argument("--synthetic", type=int, default=None, help="No. of generated machines, replaces the replayed machines")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the generated machines")
+    parser.add_argument("--noise", type=float, default=0.02, help="Noise of the generated machines, fraction of the std of the feature")
+    parser.add_argument("--fault-rate", type=float, default=1e-4, help="Probability that a generated machine starts an air leak at a reading")
+    parser.add_argument("--store", action="store_true", help="Record every reading with its label and score in the time-series store")
+    parser.add_argument("--flush-seconds", type=float, default=60.0, help="Max seconds the recorded readings of a machine wait before they are written")
+    args = parser.parse_args()
+
+    models = dict(
+        clustering=LazyModel(lambda: load_model(CLUSTERING_ARTIFACT, CLUSTERING_MODEL), "clustering"),
+        isolation=LazyModel(lambda: load_model(ISOLATION_ARTIFACT, ISOLATION_MODEL), "isolation"),
+    )
+    replayed = 0 if args.synthetic is not None else args.machines
+    n_machines = max(args.fleet_size, replayed + 1, (args.synthetic or 0) + 1)
+    service = FleetService(models, n_machines, args.window)
+    features = service.get_scorer(args.model).buffer.features
+    sink = FleetSink(service, args.model, TimeSeriesStore(features=features, flush_seconds=args.flush_seconds) if args.store else None)
+
+    sources = [
+        CsvReplaySource(FAULTY_CSV if machine % 2 else HEALTHY_CSV, machine, features, rate=args.rate)
+        for machine in range(replayed)
+    ]
+    generator = None
+    if args.synthetic is not None:
+        generator = FleetGenerator(args.synthetic, rate=args.rate, seed=args.seed, noise=args.noise,
+                                   fault_rate=args.fault_rate, start=pd.Timestamp.now(), features=features)
+        sources.append(SyntheticFleetSource(generator))
+    if args.tail is not None:
+        sources.append(FileTailSource(args.tail, features, machine=max(replayed, args.synthetic or 0)))
+    if args.socket is not None:
+        sources.append(SocketSource(features, port=args.socket))
+
+    pipeline = IngestionPipeline(sink, sources, maxsize=args.queue, policy=args.policy)
+    pipeline.start()
+    start = time.monotonic()
+    try:
+        while args.duration is None or time.monotonic() - start < args.duration:
+            time.sleep(min(args.report, args.duration or args.report))
+            stats = pipeline.get_stats()
+            elapsed = time.monotonic() - start
+            print(f"{elapsed:8.1f}s  received {stats['received']}  processed {stats['processed']}  "
+                  f"dropped {stats['dropped']}  errors {stats['errors']}  failed {stats['failed']}  queue {stats['queue_depth']}  "
+                  f"faulty machines {int((sink.labels == 1).sum())}  ({stats['processed'] / elapsed:.0f} readings/s)"
+                  + (f"  air leaks {int(generator.labels().sum())}" if generator is not None else ""))
+    except KeyboardInterrupt:
+        pass
+    print(pipeline.stop())
+    if sink.store is not None:
+        sink.store.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+import os
+import time
+import socket
+import threading
+import numpy as np
+import pandas as pd
+from log.logging import LOGGER
+import logging
+
+
+def parse_rows(lines, n_columns, separator=','):
+    """
+    Parameters:
+    lines - list of text lines (str)
+    n_columns(int) - no. of fields of a good line
+    separator(str) - separator of the fields
+    Description:
+    Return (2D float array of the good lines, no. of bad lines) - lines with a different no. of fields
+    or a field which is not a number are left out
+    """
+    rows = [line.strip().split(separator) for line in lines if line.strip()]
+    rows = [row for row in rows if len(row) == n_columns]
+    if not rows:
+        return np.zeros((0, n_columns)), sum(1 for line in lines if line.strip())
+    values = pd.DataFrame(rows).apply(pd.to_numeric, errors='coerce').values.astype(np.float64)
+    values = values[~np.isnan(values).any(axis=1)]
+    return values, sum(1 for line in lines if line.strip()) - values.shape[0]
+
+
+class Source:
+    """
+    Base class of the ingestion sources.
+    run(emit, stop) must keep calling emit(machines, values, timestamps) with a batch of readings
+    (1D int array, 2D float array in the order of self.features, 1D datetime64 array) till stop is set.
+    Lines which cannot be parsed are left out and counted with reject.
+    """
+    def __init__(self, features):
+        """
+        Parameter: features(list) - order of the features expected by the scoring engine
+        """
+        self.features = list(features)
+        self.on_reject = None # Set by the pipeline, called with the no. of rejected readings
+
+    def run(self, emit, stop):
+        raise NotImplementedError
+
+    def reject(self, count):
+        if count:
+            LOGGER.log_ingestion(f"{count} bad lines of {type(self).__name__} are dropped", logging.WARNING)
+            if self.on_reject is not None:
+                self.on_reject(count)
+
+
+class CsvReplaySource(Source):
+    """
+    Replays the rows of a csv file (e.g. data_synthetic/healthy.csv) as readings of one machine.
+
+    1. The csv is read once and rows are emitted at rate readings per second (wall clock paced)
+    2. At high rates all the rows which are due are emitted together as one batch
+    3. When loop is True the replay starts again from the first row at the end of the file
+    """
+    def __init__(self, path, machine, features, rate=1.0, loop=True):
+        """
+        Parameters:
+        path(str) - path of the csv file
+        machine(int) - machine id of the readings
+        features(list) - order of the features
+        rate(float) - readings per second
+        loop(bool) - start again at the end of the file
+        """
+        super().__init__(features)
+        self.values = pd.read_csv(path)[self.features].values.astype(np.float64)
+        self.machine = machine
+        self.rate = rate
+        self.loop = loop
+
+    def run(self, emit, stop):
+        start = time.monotonic()
+        emitted = 0
+        while not stop.is_set():
+            due = int((time.monotonic() - start) * self.rate) + 1 - emitted
+            if due > 0:
+                if not self.loop and emitted >= self.values.shape[0]:
+                    return
+                rows = np.arange(emitted, emitted + due)
+                if not self.loop:
+                    rows = rows[rows < self.values.shape[0]]
+                now = np.datetime64(pd.Timestamp.now(), 'ns')
+                emit(np.full(rows.shape[0], self.machine), self.values[rows % self.values.shape[0]], np.full(rows.shape[0], now))
+                emitted += due
+            stop.wait(min(0.1, 1 / self.rate))
+
+
+class FileTailSource(Source):
+    """
+    Follows a csv file which is being appended by another process (like tail -f).
+
+    1. First line of the file is the header, columns 'machine' and 'timestamp' are optional
+    2. Only lines added after the source is started are emitted (from_start=True to read the whole file)
+    3. The file is polled every poll_interval seconds when there is no new line
+    """
+    def __init__(self, path, features, machine=0, from_start=False, poll_interval=0.1):
+        super().__init__(features)
+        self.path = path
+        self.machine = machine
+        self.from_start = from_start
+        self.poll_interval = poll_interval
+
+    def parse(self, lines, header):
+        """
+        Return (machines, values, timestamps) of the good lines, None if there are none - bad lines are rejected
+        """
+        rows = [line.strip().split(',') for line in lines if line.strip()]
+        good = [row for row in rows if len(row) == len(header)]
+        if not good:
+            self.reject(len(rows))
+            return
+        table = pd.DataFrame(good, columns=header)
+        numeric = [column for column in header if column != 'timestamp']
+        table[numeric] = table[numeric].apply(pd.to_numeric, errors='coerce')
+        if 'timestamp' in header:
+            table['timestamp'] = pd.to_datetime(table['timestamp'], errors='coerce')
+        table = table.dropna(subset=[column for column in header if column in self.features or column in ('machine', 'timestamp')])
+        self.reject(len(rows) - table.shape[0])
+        if not table.shape[0]:
+            return
+
+        machines = table['machine'].values.astype(np.int64) if 'machine' in header else np.full(table.shape[0], self.machine)
+        timestamps = table['timestamp'].values if 'timestamp' in header else np.full(table.shape[0], np.datetime64(pd.Timestamp.now(), 'ns'))
+        return machines, table[self.features].values.astype(np.float64), timestamps
+
+    def run(self, emit, stop):
+        while not os.path.exists(self.path):
+            if stop.wait(self.poll_interval):
+                return
+
+        with open(self.path) as f:
+            header = f.readline().strip().split(',')
+            if not self.from_start:
+                f.seek(0, os.SEEK_END)
+            partial = ""
+            while not stop.is_set():
+                lines = f.readlines()
+                if not lines:
+                    stop.wait(self.poll_interval)
+                    continue
+                lines[0] = partial + lines[0]
+                partial = "" if lines[-1].endswith('\n') else lines.pop() # Line still being written
+                batch = self.parse(lines, header)
+                if batch is not None:
+                    emit(*batch)
+
+
+class SocketSource(Source):
+    """
+    Local TCP stand-in for a message broker.
+
+    Every client sends text lines "machine,feature_1,...,feature_n" (features in the order of self.features).
+    Each received chunk of complete lines is emitted as one batch, bad lines are rejected.
+    """
+    def __init__(self, features, host="127.0.0.1", port=9009):
+        super().__init__(features)
+        self.host = host
+        self.port = port
+        self.server = None
+
+    def handle(self, connection, emit, stop):
+        try:
+            self.receive(connection, emit, stop)
+        except Exception as e:
+            LOGGER.log_ingestion(f"Error in socket connection - {e}", logging.ERROR)
+
+    def receive(self, connection, emit, stop):
+        partial = b""
+        with connection:
+            connection.settimeout(0.5)
+            while not stop.is_set():
+                try:
+                    chunk = connection.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    return
+                data = partial + chunk
+                end = data.rfind(b'\n') + 1
+                data, partial = data[:end], data[end:]
+                if not data:
+                    continue
+                rows, bad = parse_rows(data.decode(errors='replace').splitlines(), len(self.features) + 1)
+                self.reject(bad)
+                if rows.shape[0]:
+                    now = np.datetime64(pd.Timestamp.now(), 'ns')
+                    emit(rows[:, 0].astype(np.int64), rows[:, 1:], np.full(rows.shape[0], now))
+
+    def run(self, emit, stop):
+        self.server = socket.create_server((self.host, self.port))
+        self.server.settimeout(0.5)
+        with self.server:
+            while not stop.is_set():
+                try:
+                    connection, _ = self.server.accept()
+                except socket.timeout:
+                    continue
+                threading.Thread(target=self.handle, args=(connection, emit, stop), daemon=True).start()
+
+
+class SyntheticFleetSource(Source):
+    """
+    Readings of a whole synthetic fleet (data_synthetic.generate_data.FleetGenerator) for load tests.
+
+    1. Every machine sends generator.rate readings per second (wall clock paced), all the readings which are due
+       are generated and emitted as one batch - a single thread can feed thousands of machines
+    2. Readings are timed by the generator, so the stream is the same for the same seed
+    3. Ground truth label of every machine is in generator.labels()
+    """
+    def __init__(self, generator, max_steps=None):
+        """
+        Parameters:
+        generator - FleetGenerator, its features must be in the order of the scoring engine
+        max_steps(int) - stop after this many readings of every machine, None to run till stopped
+        """
+        super().__init__(generator.features)
+        self.generator = generator
+        self.rate = generator.rate
+        self.max_steps = max_steps
+        self.steps = 0
+
+    def run(self, emit, stop):
+        start = time.monotonic()
+        while not stop.is_set():
+            due = int((time.monotonic() - start) * self.rate) + 1 - self.steps
+            if self.max_steps is not None:
+                due = min(due, self.max_steps - self.steps)
+                if due <= 0 and self.steps >= self.max_steps:
+                    return
+            if due > 0:
+                machines, values, timestamps, _ = self.generator.generate(due)
+                emit(machines, values, timestamps)
+                self.steps += due
+            stop.wait(min(0.1, 1 / self.rate))
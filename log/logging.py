@@ -1,45 +1,240 @@
+import os
+import copy
+import json
+import queue
+import atexit
+import random
 import logging
+import threading
+import numpy as np
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 
 filenames = dict(
-    CLUSTERING_LOGS = "./log/clustering_log.txt",    
+    CLUSTERING_LOGS = "./log/clustering_log.txt",
     PROFILING_LOGS = "./log/profiling_log.txt",
     PREDICTION_LOGS = "./log/prediction_log.txt",
     PREPROCESSING_LOGS = "./log/preprocessing_logs.txt",
     ISOLATION_FOREST_LOGS = "./log/isolation_forest_logs.txt",
-    STARTUP_LOGS = "./log/startup_logs.txt"
-    
+    STARTUP_LOGS = "./log/startup_logs.txt",
+    INGESTION_LOGS = "./log/ingestion_logs.txt",
+    DASHBOARD_LOGS = "./log/dashboard_logs.txt"
+
 )
 
+# Size of a log file after which it is rotated, and no. of old files kept (file.txt.1, file.txt.2, ...)
+MAX_BYTES = 5 * 1024 * 1024
+BACKUP_COUNT = 3
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats every record as one JSON object per line.
+    Non string messages (e.g. dict of cut offs, batch of predictions) are kept as JSON values.
+    """
+    def format(self, record):
+        entry = dict(
+            time=self.formatTime(record),
+            level=record.levelname,
+            logger=record.name,
+        )
+        if isinstance(record.msg, str):
+            entry["message"] = record.getMessage()
+        else:
+            entry["message"] = record.msg
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    QueueHandler which keeps non string messages as they are, the listener formats them as JSON
+    """
+    def prepare(self, record):
+        record = copy.copy(record)
+        if isinstance(record.msg, str):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class NameFilter(logging.Filter):
+    """
+    Passes only the records of one logger, so that every file handler of the listener gets its own records
+    """
+    def filter(self, record):
+        return record.name == self.name
+
+
+class PredictionLog:
+    """
+    Batched and sampled log of predictions for the hot paths.
+
+    1. add(...) keeps a random sample_rate fraction of the predictions (and every fault if keep_faults) in memory
+    2. When batch_size predictions are kept they are written as one record through the logging queue
+    3. flush() writes the kept predictions at once (called at exit)
+    No call waits for the disk.
+    """
+    def __init__(self, logger, sample_rate=0.01, batch_size=100, keep_faults=False):
+        """
+        Parameters:
+        logger - logger of the prediction log
+        sample_rate(float) - fraction of predictions kept
+        batch_size(int) - no. of kept predictions written in one record
+        keep_faults(bool) - keep every fault prediction (class level 1) irrespective of sampling
+        """
+        self.logger = logger
+        self.sample_rate = sample_rate
+        self.batch_size = batch_size
+        self.keep_faults = keep_faults
+        self.rows = []
+        self.lock = threading.Lock()
+        self.rng = np.random.default_rng() # Own generator, sampling does not change the global numpy random state
+
+    def add(self, model, labels, scores=None, machines=None, **fields):
+        """
+        Parameters:
+        model(str) - name of the model
+        labels - class level or array of class levels
+        scores - severity score or array of scores (optional)
+        machines - machine id or array of machine ids (optional)
+        fields - other values saved with every prediction (e.g. session)
+        """
+        labels = np.atleast_1d(np.asarray(labels))
+        keep = self.rng.random(labels.shape[0]) < self.sample_rate
+        if self.keep_faults:
+            keep |= labels == 1
+        kept = np.flatnonzero(keep)
+        if not kept.shape[0]:
+            return
+
+        scores = np.atleast_1d(np.asarray(scores, dtype=float))[kept] if scores is not None else None
+        machines = np.atleast_1d(np.asarray(machines))[kept] if machines is not None else None
+        rows = []
+        for j, i in enumerate(kept.tolist()):
+            row = dict(fields, model=model, label=int(labels[i]))
+            if scores is not None and not np.isnan(scores[j]):
+                row["score"] = float(scores[j])
+            if machines is not None:
+                row["machine"] = int(machines[j])
+            rows.append(row)
+
+        with self.lock:
+            self.rows.extend(rows)
+            if len(self.rows) < self.batch_size:
+                return
+            rows, self.rows = self.rows, []
+        self.logger.info(dict(predictions=rows))
+
+    def flush(self):
+        with self.lock:
+            rows, self.rows = self.rows, []
+        if rows:
+            self.logger.info(dict(predictions=rows))
+
+
+def worker_filename(path, pid):
+    """
+    Return the log file of a server worker - ./log/startup_logs.txt -> ./log/startup_logs.pid<pid>.txt
+    """
+    root, extension = os.path.splitext(path)
+    return f"{root}.pid{pid}{extension}"
 
 
 class AppLogger:
     """
     Description:
-    Simple class to save logs into multiple files
+    Simple class to save logs into multiple files.
+    Every log_* call only puts the record in a queue, one background listener writes the records
+    as JSON lines into rotating files. Handlers are attached once when the logger is created.
+
+    Forked processes -
+    1. A child gets a new queue and its loggers are disabled - records of the parent still in the queue are
+       written only by the parent, and no lock held by a thread of the parent at fork time is used
+    2. Pool workers (grid search, backtest) stay so, they have no listener
+    3. Server workers call start_worker (gunicorn post_fork), they write to their own files (worker_filename)
+       as RotatingFileHandler must have only one process per file
     """
     def __init__(self):
-        formatter = logging.Formatter('[%(asctime)s] %(levelname)s %(message)s]')
-        self.handlers = {}
-
+        self.queue = queue.Queue(-1)
+        self.queue_handler = StructuredQueueHandler(self.queue)
+        self.loggers = {}
         for filename in filenames.keys():
-            self.handlers[filename] = logging.FileHandler(filenames[filename])
-            self.handlers[filename].setFormatter(formatter)
-        
+            logger = logging.getLogger(f"app.{filename}")
+            logger.setLevel(logging.INFO)
+            logger.propagate = False
+            logger.handlers = [self.queue_handler]
+            self.loggers[filename] = logger
+
+        self.predictions = PredictionLog(self.loggers["PREDICTION_LOGS"])
+        self.file_handlers = self.create_handlers(filenames)
+        self.start()
+        atexit.register(self.stop)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.after_fork)
+
+    def create_handlers(self, paths):
+        """
+        Parameter: paths(dict) - logger name -> path of its file
+        Description: Return one rotating JSON file handler per logger
+        """
+        formatter = JsonFormatter()
+        handlers = []
+        for filename, path in paths.items():
+            handler = RotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=BACKUP_COUNT, delay=True)
+            handler.setFormatter(formatter)
+            handler.addFilter(NameFilter(f"app.{filename}"))
+            handlers.append(handler)
+        return handlers
 
+    def start(self):
+        self.listener = QueueListener(self.queue, *self.file_handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def after_fork(self):
+        """
+        Runs in a forked child - new queue and locks, records and predictions of the parent are dropped, logging is off
+        """
+        self.queue = queue.Queue(-1)
+        self.queue_handler.queue = self.queue
+        self.listener = None
+        self.file_handlers = []
+        self.predictions.rows = []
+        self.predictions.lock = threading.Lock()
+        self.predictions.rng = np.random.default_rng() # Workers do not sample the same predictions
+        for logger in self.loggers.values():
+            logger.disabled = True
+
+    def start_worker(self):
+        """
+        Start logging in a server worker (e.g. gunicorn post_fork) into the files of its pid
+        """
+        paths = {filename: worker_filename(path, os.getpid()) for filename, path in filenames.items()}
+        self.file_handlers = self.create_handlers(paths)
+        self.start()
+        for logger in self.loggers.values():
+            logger.disabled = False
+
+    def stop(self):
+        """
+        Write the pending predictions and records, called at exit
+        """
+        self.predictions.flush()
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+        for handler in self.file_handlers:
+            handler.close()
 
     def custom_log(self, filename, level=logging.INFO):
-        custom_logger = logging.getLogger(filenames[filename])
-        custom_logger.setLevel(level)
-        custom_logger.addHandler(self.handlers[filename])
-        return custom_logger
+        return self.loggers[filename]
 
     def write_log(self, logger, message, level):
-        if level == logging.INFO:
-            logger.info(message)
-        elif level == logging.ERROR:
-            logger.error(message)
-    
+        logger.log(level, message)
+
     def log_clustering(self, message, level):
         clustering_logger = self.custom_log("CLUSTERING_LOGS")
         self.write_log(clustering_logger, message, level)
@@ -52,7 +247,13 @@ class AppLogger:
     def log_prediction(self, message, level):
         prediction_loggger = self.custom_log("PREDICTION_LOGS")
         self.write_log(prediction_loggger, message, level)
-    
+
+    def sample_prediction(self, model, labels, scores=None, machines=None, **fields):
+        """
+        Add predictions to the batched and sampled prediction log (see PredictionLog.add)
+        """
+        self.predictions.add(model, labels, scores, machines, **fields)
+
     def log_preprocessing(self, message, level):
         preprocessing_logger = self.custom_log("PREPROCESSING_LOGS")
         self.write_log(preprocessing_logger, message, level)
@@ -60,10 +261,18 @@ class AppLogger:
     def log_isolation(self, message, level):
         isolation_logger = self.custom_log("ISOLATION_FOREST_LOGS")
         self.write_log(isolation_logger, message, level)
-    
+
     def log_startup(self, message, level):
         startup_log = self.custom_log('STARTUP_LOGS')
         self.write_log(startup_log, message, level)
 
+    def log_ingestion(self, message, level):
+        ingestion_log = self.custom_log('INGESTION_LOGS')
+        self.write_log(ingestion_log, message, level)
+
+    def log_dashboard(self, message, level):
+        dashboard_log = self.custom_log('DASHBOARD_LOGS')
+        self.write_log(dashboard_log, message, level)
+
 
 LOGGER = AppLogger()
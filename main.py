@@ -1,4 +1,4 @@
-from dash import Dash, dcc, html, Input, Output, State
+from dash import Dash, dcc, html, Input, Output, State, no_update
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
@@ -7,11 +7,22 @@ from datetime import datetime
 from data_synthetic.generate_data import HealthyData, FaultyData
 import dash_daq as daq
 import dash_bootstrap_components as dbc
-from path.path import CLUSTERING_MODEL, ISOLATION_MODEL
-import pickle
+from path.path import CLUSTERING_MODEL, ISOLATION_MODEL, PROFILE_MODEL, CLUSTERING_ARTIFACT, ISOLATION_ARTIFACT, PROFILE_ARTIFACT
+from training.artifacts import LazyModel, load_model, preload_models
+from serving.session import create_session_store
+from serving.trend import trend_update
+from serving.history import history_figure, recorded_figure, recorded_update, zoom_range
+from storage.timeseries import TimeSeriesStore, FLUSH_RECORDS
+from preprocessing.pyramid import HistoryPyramid
+from serving.api import MicroBatcher, FleetService, register_api
+from training.streaming import StreamingPredictor
+from training.ensemble import Ensemble, EnsemblePredictor
+import uuid
+import os
 import warnings
 warnings.filterwarnings("ignore")
 from log.logging import LOGGER
+from metrics.metrics import register_metrics, count_predictions, CALLBACK_SECONDS, PREDICT_SECONDS
 import logging
 
 
@@ -19,13 +30,17 @@ try:
     healthy_data = HealthyData()
     faulty_data = FaultyData()
 
-    with open(CLUSTERING_MODEL, 'rb') as f:
-        clustering_model = pickle.load(f)
-        f.close()
-        
-    with open(ISOLATION_MODEL, 'rb') as f:
-        isolation_model = pickle.load(f)
-        f.close()
+    # Models are loaded on first use - compact artifact if available, else the pickle
+    clustering_model = LazyModel(lambda: load_model(CLUSTERING_ARTIFACT, CLUSTERING_MODEL), "clustering")
+    isolation_model = LazyModel(lambda: load_model(ISOLATION_ARTIFACT, ISOLATION_MODEL), "isolation")
+    profile_model = LazyModel(lambda: load_model(PROFILE_ARTIFACT, PROFILE_MODEL), "profile")
+
+    # All the models scored together - smoothened features are shared, verdict is the majority vote
+    ensemble = Ensemble({"clustering": clustering_model, "isolation": isolation_model, "profile": profile_model}, voting="majority")
+
+    # Under gunicorn (gunicorn.conf.py) the app is imported once in the master, models are loaded before forking
+    if os.environ.get("PRELOAD_MODELS") == "1":
+        preload_models([clustering_model, isolation_model, profile_model])
     
     app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP,  dbc.icons.FONT_AWESOME])
     app.title = "Predict equipment health"
@@ -42,6 +57,36 @@ except Exception as e:
 INTERVAL = 1000
 DATA_WINDOW = 2000
 
+# No. of server processes (set by gunicorn.conf.py), callbacks of a dashboard may run in any of them
+WORKERS = int(os.environ.get("WEB_WORKERS", 1))
+
+# Every reading shown on a dashboard is recorded with its smoothened features, prediction and severity (machine id is the session id)
+# With many workers every reading is written at once, so the worker drawing the history sees the readings of the others
+readings_store = TimeSeriesStore(features=healthy_data.get_column_names(), flush_records=1 if WORKERS > 1 else FLUSH_RECORDS)
+
+# All the state of every dashboard (data queue, predictor, data indices, prediction) is kept on the server,
+# browser only has the session id and the cursor. Idle sessions are evicted (in-process, or Redis if SESSION_REDIS_URL is set)
+sessions = create_session_store(DATA_WINDOW, healthy_data.get_column_names(),
+                                shared={"clustering": clustering_model, "isolation": isolation_model, "profile": profile_model, "ensemble": ensemble},
+                                on_evict=readings_store.remove) # Readings of a closed dashboard are removed with its session
+
+# Min/max/mean pyramid of the preprocessed data for the history view (memory-mapped on first use)
+history = HistoryPyramid()
+
+# Batch prediction API for machines pushing readings directly (e.g. SCADA gateway).
+# With many workers the readings of the machines are kept in shared memory made here, before the workers are forked
+API_MACHINES = 1000
+api_service = FleetService({"clustering": clustering_model, "isolation": isolation_model}, API_MACHINES, DATA_WINDOW, shared=WORKERS > 1)
+try:
+    if WORKERS > 1:
+        api_service.prepare()
+    register_api(app.server, MicroBatcher(api_service.process), api_service)
+except Exception as e:
+    LOGGER.log_startup(f"Batch prediction API is off - {e}", level=logging.ERROR)
+
+# Prometheus metrics at /metrics
+register_metrics(app.server)
+
 
 # the style arguments for the sidebar. We use position:fixed and a fixed width
 SIDEBAR_STYLE = {
@@ -84,7 +129,9 @@ sidebar = html.Div(
 
                 dcc.Dropdown(id="model_used", options=[
                     {'label':"Clustering Model", "value":"clustering"},
-                    {"label":"Isolation Forest Model", "value": "isolation"}
+                    {"label":"Isolation Forest Model", "value": "isolation"},
+                    {"label":"Matrix Profile Model", "value": "profile"},
+                    {"label":"Ensemble of All Models", "value": "ensemble"}
                 ], value='clustering'),
                 
                 html.A([
@@ -117,7 +164,7 @@ content = html.Div(
         html.H5(children=["Select the machine parameter"]),
 
         # Dropdown Menu
-        dcc.Dropdown(HealthyData().get_column_names(), id="feature-select", value="TP2"),
+        dcc.Dropdown(healthy_data.get_column_names(), id="feature-select", value="TP2"),
 
         # Show graph
         dcc.Graph(id='machine-trend'), 
@@ -126,10 +173,7 @@ content = html.Div(
         dcc.Interval(id='interval', interval=INTERVAL),
 
         # Data Store
-        dcc.Store(id='latest-healthy-data-index', data=-1),
-        dcc.Store(id='latest-fault-data-index', data=-1),
-        dcc.Store(id='data-queue'),
-        dcc.Store(id="prediction", data=-1),
+        dcc.Store(id='data-cursor', data=0),
 
         # Fault simulation button
         # html.Div(
@@ -139,8 +183,17 @@ content = html.Div(
         # Prediction section
         html.H5 (["Machine Health Prediction"], style={'margin-top' : "50px"}),
 
-        dbc.Alert("Machine is running healthy", id='result', color='info')
+        dbc.Alert("Machine is running healthy", id='result', color='info'),
 
+        # History section - zoom the graph to see finer resolution
+        html.H5(["Machine History"], style={'margin-top' : "50px"}),
+        dcc.Dropdown(healthy_data.get_column_names(), id="history-feature", value="TP2"),
+        dcc.Dropdown(id="history-source", options=[
+            {"label": "Training data", "value": "training"},
+            {"label": "This dashboard", "value": "session"}
+        ], value="training", clearable=False),
+        dcc.Graph(id='history-graph'),
+        dcc.Interval(id='history-interval', interval=INTERVAL, disabled=True), # Runs only while the graph follows this dashboard
 
 
     ]
@@ -164,96 +217,188 @@ def simulate_fault(n_clicks):
 # Call back functions
 @app.callback(
     Output("machine-trend", "figure"),
-    Input("data-queue", "data"),
-    State("feature-select", "value")
+    Output("machine-trend", "extendData"),
+    Input("data-cursor", "data"),
+    Input("feature-select", "value"),
+    State("session-id", "data")
 )
-def update_figure(data_queue, feature):
+@CALLBACK_SECONDS.labels("update_figure").time()
+def update_figure(cursor, feature, session_id):
 
-    plot_data = pd.read_json(data_queue) # Create pandas dataframe from JSON data
-    plot_data = plot_data.set_index('timestamp') # Set time index
+    session = sessions.get(session_id, "data_queue", "trend_state")
+    if len(session.data_queue) == 0:
+        return no_update, no_update
 
-    
-    figure = go.Figure(
-        data = go.Scatter(x=plot_data.index, y=plot_data[feature])
-    )
-
-    figure.update_layout(yaxis=dict(range=[0,plot_data[feature].max()+2]),
-                          xaxis_title="Time",
-                          yaxis_title=f"Parameter {feature}",
-                          title="Trend of machine parameters")
-    
-    # figure.update_layout(xaxis=dict(range=[10000, 0]))
+    # Only new points are sent to the graph, full (downsampled if needed) figure only when required
+    figure, extend, session.trend_state = trend_update(session.data_queue, feature, session.trend_state)
+    sessions.save(session_id, session, "trend_state")
 
-    return figure
+    return (no_update if figure is None else figure), (no_update if extend is None else extend)
 
 
 @app.callback(
-    Output("latest-healthy-data-index", "data"),
-    Output("latest-fault-data-index", "data"),
-    Output("data-queue", "data"),
-    Output("prediction", "data"),
+    Output("data-cursor", "data"),
     Input("interval", "n_intervals"),
-    State("latest-healthy-data-index", "data"),
-    State("latest-fault-data-index", "data"),
-    State("data-queue", "data"),
+    State("session-id", "data"),
     State("button-simulation", "n_clicks"),
     State("model_used", "value")
 )
-def update_data_queue(n_interval, healthy_data_idx, fault_data_index, data_queue, n_clicks, model_used):
+@CALLBACK_SECONDS.labels("update_data_queue").time()
+def update_data_queue(n_interval, session_id, n_clicks, model_used):
+
+    session = sessions.get(session_id, "data_queue", "predictor", "healthy_index", "fault_index")
+    if n_interval == None:
+        # Start a new queue for the first time
+        session.reset()
 
     if (n_clicks % 2 != 0): # Get faulty data
-        new_data, fault_data_index = faulty_data.get_data_by_id(fault_data_index+1) # Get a new datapoint and update id
+        new_data, session.fault_index = faulty_data.get_data_by_id(session.fault_index+1) # Get a new datapoint and update id
     else: 
-        new_data, healthy_data_idx = healthy_data.get_data_by_id(healthy_data_idx+1) # Get a new datapoint and update id
+        new_data, session.healthy_index = healthy_data.get_data_by_id(session.healthy_index+1) # Get a new datapoint and update id
 
-    if n_interval == None:
-        # Initialise a new pandas dataframe for the first time
-        columns=healthy_data.get_column_names().append('timestamp')
-        data_queue = pd.DataFrame(columns=columns)
-    else:
-        # As data queue is in JSON format  - get dataframe from it
-        data_queue = pd.read_json(data_queue)
+    data_queue = session.data_queue
     
     # Getting current time stamp
     now = datetime.now()
     now = now.strftime("%Y-%m-%d %H:%M:%S")
-    new_data['timestamp'] = pd.to_datetime(now)
-
-    # add new data to dataframe
-    if data_queue.shape[0] == DATA_WINDOW:
-        # Remove the first data point from queue
-        data_queue = data_queue.drop(index=data_queue.iloc[0].name)
-    
-    # Append new point to data frame
-    data_queue = data_queue.append(new_data, ignore_index=True)
 
-    # Get the prediction from model
-    if model_used == "clustering":
-        prediction = clustering_model.predict(data_queue)
-    elif model_used == "isolation":
-        prediction = isolation_model.predict(data_queue)
-   
-    # Return the jsonified version
-    return healthy_data_idx, fault_data_index, data_queue.to_json(), prediction
+    if model_used == "profile":
+        # Add new point to the ring buffer and match only the last window of the queue with the fault reference
+        cursor = data_queue.append(new_data[data_queue.columns].values, pd.to_datetime(now))
+        _, values, _ = data_queue.since(cursor - profile_model.window)
+        with PREDICT_SECONDS.labels(model_used).time():
+            prediction = profile_model.predict(pd.DataFrame(values, columns=data_queue.columns))
+        session.predictor = None # Streaming predictors do not see these points
+        smoothed, score = None, np.nan
+    else:
+        # Get the prediction from model before the new point is added, a new predictor is warmed up from the queue
+        predictor = get_predictor(session, model_used)
+        with PREDICT_SECONDS.labels(model_used).time():
+            prediction = predictor.update(new_data)
+
+        # Add new point to the ring buffer, oldest point is overwritten when it is full
+        cursor = data_queue.append(new_data[data_queue.columns].values, pd.to_datetime(now))
+        smoothed, score = latest_scores(predictor)
+
+    # Record the reading for the history view
+    smoothed = None if smoothed is None else smoothed.reshape(1, -1)
+    readings_store.append(session_id, [pd.to_datetime(now)], new_data[readings_store.features].values, smoothed, [prediction], [score])
+
+    session.prediction = prediction
+    session.outputs = predictor.outputs if model_used == "ensemble" else None # Class level of every model for the alert
+    sessions.save(session_id, session, "data_queue", "predictor", "healthy_index", "fault_index", "prediction", "outputs")
+
+    count_predictions(model_used, prediction)
+    LOGGER.sample_prediction(model_used, prediction, session=session_id)
+
+    # Return only the cursor of the queue
+    return cursor
+
+
+def get_predictor(session, model_used):
+    """
+    Return the streaming predictor of the session for the selected model.
+    When the model is changed a new predictor is warmed up from the readings already in the data queue.
+    """
+    data_queue = session.data_queue
+    used, predictor = session.predictor or (None, None)
+    if used != model_used:
+        if model_used == "clustering":
+            predictor = StreamingPredictor(clustering_model, history=DATA_WINDOW)
+        elif model_used == "isolation":
+            predictor = StreamingPredictor(isolation_model, history=DATA_WINDOW)
+        elif model_used == "ensemble":
+            predictor = EnsemblePredictor(ensemble, history=DATA_WINDOW, features=data_queue.columns)
+        predictor.warm_up(data_queue.to_frame())
+        session.predictor = (model_used, predictor)
+    return predictor
+
+
+def latest_scores(predictor):
+    """
+    Return (smoothened features in the order of the store, severity) of the latest reading of the predictor,
+    (None, nan) for the ensemble
+    """
+    if not isinstance(predictor, StreamingPredictor):
+        return None, np.nan
+    value, score = predictor.latest()
+    value = pd.Series(value, index=predictor.features)[readings_store.features].values
+    return value, score
 
 
 @app.callback (
     Output("result", "children"),
     Output("result", "color"),
-    Input("prediction", "data")
+    Input("data-cursor", "data"),
+    State("session-id", "data")
 )
-def update_prediction(prediction):
+def update_prediction(cursor, session_id):
+    session = sessions.get(session_id, "prediction", "outputs")
+    prediction, outputs = session.prediction, session.outputs
     if prediction == -1:
-        return "Not enough data to predict machine health, please wait ..", "info"
+        message, color = "Not enough data to predict machine health, please wait ..", "info"
     elif prediction == 0:
-        return "Machine is healthy", "success"
+        message, color = "Machine is healthy", "success"
     elif prediction == 1:
-        return "Air leak suspected", "danger"
+        message, color = "Air leak suspected", "danger"
+
+    if outputs:
+        levels = {-1: "waiting", 0: "healthy", 1: "fault"}
+        message = f"{message} ({', '.join(f'{name}: {levels[label]}' for name, label in outputs.items())})"
+    return message, color
+
+
+
+@app.callback(
+    Output("history-graph", "figure"),
+    Output("history-interval", "disabled"),
+    Input("history-feature", "value"),
+    Input("history-source", "value"),
+    Input("history-graph", "relayoutData"),
+    State("session-id", "data")
+)
+@CALLBACK_SECONDS.labels("update_history").time()
+def update_history(feature, source, relayout, session_id):
+    # Full figure only when the feature, source or zoom is changed - new readings of this dashboard are sent by extend_history
+    following = source == "session"
+    try:
+        start, end = zoom_range(relayout)
+        if not following:
+            return history_figure(history, feature, start, end), True
+        figure, last = recorded_figure(readings_store, session_id, feature, start, end)
+        session = sessions.get(session_id, "history_state")
+        session.history_state = last if start is None else None # A zoomed graph is not extended
+        sessions.save(session_id, session, "history_state")
+        return figure, False
+    except Exception as e:
+        LOGGER.log_dashboard(f"History is not available - {e}", logging.ERROR)
+        return go.Figure(layout=dict(title="History is not available, please run preprocessing first")), True
+
+
+@app.callback(
+    Output("history-graph", "extendData"),
+    Input("history-interval", "n_intervals"),
+    State("history-feature", "value"),
+    State("session-id", "data")
+)
+@CALLBACK_SECONDS.labels("extend_history").time()
+def extend_history(n_intervals, feature, session_id):
+    session = sessions.get(session_id, "history_state")
+    if session.history_state is None:
+        return no_update
+    extend, session.history_state = recorded_update(readings_store, session_id, feature, session.history_state)
+    sessions.save(session_id, session, "history_state")
+    return no_update if extend is None else extend
 
 
+def serve_layout():
+    """
+    Layout is created on every page load so that each dashboard gets its own session id
+    """
+    return html.Div([dcc.Location(id="url"), dcc.Store(id='session-id', data=str(uuid.uuid4())), sidebar, content])
 
 
-app.layout = html.Div([dcc.Location(id="url"), sidebar, content])
+app.layout = serve_layout
 
 
 
@@ -0,0 +1,83 @@
+import os
+import time
+from flask import request, Response, g
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, generate_latest, start_http_server, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+
+# Buckets for the per tick hot paths (0.5 ms to 10 s)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+CALLBACK_SECONDS = Histogram("dashboard_callback_seconds", "Time taken by the dashboard callbacks", ["callback"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("http_request_seconds", "Time taken by HTTP requests including (de)serialization of Dash callbacks", ["endpoint"], buckets=LATENCY_BUCKETS)
+SERIALIZATION_SECONDS = Histogram("serialization_seconds", "Time taken to decode requests and encode responses", ["operation"], buckets=LATENCY_BUCKETS)
+PREDICT_SECONDS = Histogram("model_predict_seconds", "Time taken by one predict call of a model", ["model"], buckets=LATENCY_BUCKETS)
+PREDICTIONS = Counter("predictions", "No. of predictions by class level (-1 not enough data, 0 healthy, 1 fault)", ["model", "label"])
+MODEL_LOAD_SECONDS = Gauge("model_load_seconds", "Time taken to load a model", ["model"], multiprocess_mode="max")
+
+INGESTION_QUEUE_DEPTH = Gauge("ingestion_queue_depth", "No. of batches waiting in the ingestion queue", multiprocess_mode="livesum")
+INGESTION_READINGS = Counter("ingestion_readings", "No. of ingested readings by status (received, dropped, processed, errors, failed)", ["status"])
+
+TRAINING_GRID_MODELS = Gauge("training_grid_models", "No. of models in the training grid", ["model_type"], multiprocess_mode="max")
+TRAINING_GRID_FITTED = Gauge("training_grid_fitted", "No. of models of the training grid fitted so far", ["model_type"], multiprocess_mode="max")
+TRAINING_BEST_SCORE = Gauge("training_best_score", "Best test score of the training grid so far", ["model_type"], multiprocess_mode="max")
+
+
+def count_predictions(model, labels):
+    """
+    Parameters:
+    model(str) - name of the model
+    labels - class level or array of class levels
+    """
+    if hasattr(labels, 'tolist'):
+        labels = labels.tolist()
+    if not isinstance(labels, list):
+        labels = [labels]
+    for label in set(labels):
+        PREDICTIONS.labels(model, str(label)).inc(labels.count(label))
+
+
+def get_registry():
+    """
+    Registry to expose - metrics of all the worker processes when PROMETHEUS_MULTIPROC_DIR is set (gunicorn), else of this process
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ or "prometheus_multiproc_dir" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    from prometheus_client import REGISTRY
+    return REGISTRY
+
+
+def register_metrics(server):
+    """
+    Parameter: server - flask server of the Dash app (app.server)
+    Description:
+    1. Add GET /metrics in the Prometheus text format
+    2. Time every request by endpoint (Dash callbacks are all served by /_dash-update-component)
+    """
+    @server.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def observe_request(response):
+        start = getattr(g, 'metrics_start', None)
+        endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        if start is not None and endpoint != "/metrics":
+            REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - start)
+        return response
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(generate_latest(get_registry()), headers={"Content-Type": CONTENT_TYPE_LATEST})
+
+
+def start_metrics_server():
+    """
+    Expose /metrics of a batch job (e.g. retrain.py) on the port in METRICS_PORT, nothing is done if it is not set
+    """
+    port = os.environ.get("METRICS_PORT")
+    if port:
+        start_http_server(int(port))
@@ -13,3 +13,23 @@ PROFILE_MODEL = './models/profile.pkl'
 # Isolation forest model
 ISOLATION_MODEL = "./models/isolation.pkl"
 
+# Compact inference artifacts of the models
+CLUSTERING_ARTIFACT = "./models/clustering.npz"
+ISOLATION_ARTIFACT = "./models/isolation.npz"
+PROFILE_ARTIFACT = "./models/profile.npz"
+
+
+# Columnar cache of preprocessed data (memory-mapped .npy files)
+PROCESSED_CACHE = "./data/processed_cache"
+
+# Min/max/mean aggregates of the preprocessed data (1 min, 1 h, 1 day) for the history view
+HISTORY_PYRAMID = "./data/history_pyramid"
+
+# Air leak periods from the failure report used to label the data (start, end - end minute is included)
+FAULT_INTERVALS = "./preprocessing/fault_intervals.csv"
+
+# Smoothened features evicted from the in-memory feature store (used only if FEATURE_STORE_SPILL=1)
+FEATURE_STORE_SPILL = "./data/feature_store"
+
+# Append-only store of scored readings of every machine (raw and smoothened features, labels, scores)
+TIMESERIES_STORE = "./data/timeseries"
@@ -0,0 +1,187 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from path.path import PROCESSED_DATA, PROCESSED_CACHE
+
+
+META_FILE = "meta.json"
+
+# Segments are merged into one when there are more than this many (each append adds one)
+MAX_SEGMENTS = 16
+
+
+def segment_file(folder, name, segment):
+    """
+    Path of the .npy file of a column in a segment - first segment is "<name>.npy", later ones "<name>.<segment>.npy"
+    """
+    return os.path.join(folder, f"{name}.npy" if segment == 0 else f"{name}.{segment}.npy")
+
+
+def read_meta(folder=PROCESSED_CACHE):
+    """
+    Return meta of the cache (columns, rows, rows of every segment, last timestamp), None if there is no cache
+    """
+    meta_path = os.path.join(folder, META_FILE)
+    if not os.path.exists(meta_path):
+        return None
+    with open(meta_path) as f:
+        meta = json.load(f)
+    meta.setdefault("segments", [meta["rows"]]) # Cache written before segments were added
+    return meta
+
+
+def write_meta(meta, folder):
+    """
+    Write meta.json through a temporary file so that a half written meta is never read
+    """
+    temp_path = os.path.join(folder, META_FILE + ".tmp")
+    with open(temp_path, 'w') as f:
+        json.dump(meta, f)
+    os.replace(temp_path, os.path.join(folder, META_FILE))
+
+
+def write_segment(data, columns, folder, segment):
+    np.save(segment_file(folder, "timestamp", segment), data.index.values.astype('datetime64[ns]').astype(np.int64))
+    np.save(segment_file(folder, "status", segment), data['status'].values.astype(np.int8))
+    for column in columns:
+        np.save(segment_file(folder, column, segment), data[column].values.astype(np.float32))
+
+
+def write_cache(data, folder=PROCESSED_CACHE):
+    """
+    Parameters:
+    data - preprocessed pd dataframe with timestamp index and 'status' column
+    folder(str) - folder of the cache
+    Description:
+    1. Sort the data on timestamp
+    2. Save timestamp (int64 ns), every sensor column (float32) and status (int8) as separate .npy files
+    3. Save the column names and no. of rows in meta.json - written last so that a half written cache is never read
+    """
+    os.makedirs(folder, exist_ok=True)
+    meta_path = os.path.join(folder, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    data = data.sort_index()
+    columns = [column for column in data.columns if column != 'status']
+    write_segment(data, columns, folder, 0)
+
+    last_timestamp = int(data.index[-1].value) if data.shape[0] else None
+    write_meta({"columns": columns, "rows": int(data.shape[0]), "segments": [int(data.shape[0])], "last_timestamp": last_timestamp}, folder)
+
+
+def append_cache(data, folder=PROCESSED_CACHE, allow_overlap=False):
+    """
+    Parameters:
+    data - new preprocessed rows, all newer than the rows already in the cache unless allow_overlap
+    folder(str) - folder of the cache
+    allow_overlap(bool) - accept rows not newer than the cache, the cache is marked unsorted till compact_cache
+    Description:
+    Save the rows as a new segment of .npy files and add it to meta.json (the cache is created if it is not there).
+    Files of the old segments are never rewritten.
+    """
+    meta = read_meta(folder)
+    if meta is None or meta["rows"] == 0:
+        write_cache(data, folder)
+        return
+    if data.shape[0] == 0:
+        return
+
+    data = data.sort_index()
+    if meta.get("last_timestamp") is not None and data.index[0].value <= meta["last_timestamp"]:
+        if not allow_overlap:
+            raise ValueError("Rows to append must be newer than the last row of the cache")
+        meta["sorted"] = False
+
+    segment = len(meta["segments"])
+    write_segment(data, meta["columns"], folder, segment)
+
+    meta["segments"].append(int(data.shape[0]))
+    meta["rows"] += int(data.shape[0])
+    meta["last_timestamp"] = max(int(data.index[-1].value), meta.get("last_timestamp") or 0)
+    write_meta(meta, folder)
+
+
+def compact_cache(folder=PROCESSED_CACHE, max_segments=MAX_SEGMENTS):
+    """
+    Parameters:
+    folder(str) - folder of the cache
+    max_segments(int) - max no. of segments kept
+    Description:
+    Merge all the segments into one sorted segment if the cache is unsorted (overlapping segments) or has more
+    than max_segments segments. Other keys of meta.json (e.g. raw_offset) are kept.
+    """
+    meta = read_meta(folder)
+    if meta is None or (meta.get("sorted", True) and len(meta["segments"]) <= max_segments):
+        return
+    data = load_processed(folder=folder).sort_index(kind='stable')
+    write_cache(data, folder)
+    for segment in range(1, len(meta["segments"])):
+        for name in meta["columns"] + ["timestamp", "status"]:
+            path = segment_file(folder, name, segment)
+            if os.path.exists(path):
+                os.remove(path)
+
+    merged = read_meta(folder)
+    write_meta({**{key: value for key, value in meta.items() if key != "sorted"}, **merged}, folder)
+
+
+def build_cache_from_csv(folder=PROCESSED_CACHE):
+    """
+    Build the cache from PROCESSED_DATA csv - used once when the cache is not available
+    """
+    data = pd.read_csv(PROCESSED_DATA, index_col='timestamp')
+    data.index = pd.to_datetime(data.index) # Convert index to datetime
+    write_cache(data, folder)
+
+
+def load_timestamps(folder=PROCESSED_CACHE):
+    """
+    Return int64 ns timestamps of all the rows of the cache
+    """
+    meta = read_meta(folder)
+    if meta is None:
+        build_cache_from_csv(folder)
+        meta = read_meta(folder)
+    segments = [np.load(segment_file(folder, "timestamp", segment), mmap_mode='r') for segment in range(len(meta["segments"]))]
+    return segments[0] if len(segments) == 1 else np.concatenate(segments)
+
+
+def load_processed(start_date=None, end_date=None, folder=PROCESSED_CACHE):
+    """
+    Parameters:
+    start_date, end_date - datetime range to load (both inclusive, same as data.loc[start_date : end_date]), None for no limit
+    folder(str) - folder of the cache
+    Description:
+    1. Memory-map the .npy files of the cache (the cache is built from the csv if it is not there)
+    2. Find the rows of the date range by binary search on the sorted timestamps of every segment
+    3. Return pd dataframe of only those rows - rest of the file is never touched
+    """
+    meta = read_meta(folder)
+    if meta is None:
+        build_cache_from_csv(folder)
+        meta = read_meta(folder)
+
+    parts = []
+    for segment in range(len(meta["segments"])):
+        timestamps = np.load(segment_file(folder, "timestamp", segment), mmap_mode='r')
+        start = 0 if start_date is None else np.searchsorted(timestamps, pd.Timestamp(start_date).value, side='left')
+        end = timestamps.shape[0] if end_date is None else np.searchsorted(timestamps, pd.Timestamp(end_date).value, side='right')
+        if end <= start and parts:
+            continue
+
+        columns = {}
+        for column in meta["columns"]:
+            columns[column] = np.load(segment_file(folder, column, segment), mmap_mode='r')[start:end]
+        columns['status'] = np.load(segment_file(folder, "status", segment), mmap_mode='r')[start:end]
+        columns['timestamp'] = timestamps[start:end]
+        parts.append(columns)
+
+    if len(parts) == 1:
+        columns = parts[0]
+    else:
+        columns = {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+    index = pd.DatetimeIndex(np.asarray(columns.pop('timestamp')).astype('datetime64[ns]'), name='timestamp')
+    return pd.DataFrame(columns, index=index)
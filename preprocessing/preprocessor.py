@@ -1,34 +1,186 @@
-from path.path import RAW_DATA, PROCESSED_DATA
+import io
+import os
+import numpy as np
+from path.path import RAW_DATA, PROCESSED_DATA, PROCESSED_CACHE, HISTORY_PYRAMID, FAULT_INTERVALS
+from preprocessing.cache import write_cache, append_cache, compact_cache, read_meta, write_meta, load_processed
+from preprocessing.pyramid import aggregate_rows, build_pyramid, extend_pyramid
+from storage.timeseries import TimeSeriesStore, DATASET_MACHINE
 import pandas as pd
 from log.logging import LOGGER
 import logging
 
+
+# Columns of the raw data which are kept, 'Unnamed: 0', 'LPS', 'Pressure_switch', 'Oil_level', 'Caudal_impulses' are never read
+FEATURES = ['TP2', 'TP3', 'H1', 'DV_pressure', 'Reservoirs', 'Oil_temperature', 'Motor_current', 'COMP', 'DV_eletric', 'Towers', 'MPG']
+DTYPES = {feature: np.float64 for feature in FEATURES}
+
+# No. of raw rows read at a time
+CHUNK_SIZE = 200000
+
+
+def load_intervals(path=FAULT_INTERVALS):
+    """
+    Parameter: path(str) - csv with columns start, end of the fault periods (end minute is included like data.loc[start : end])
+    Description: Return (starts, ends) int64 ns arrays of the merged, sorted periods - ends are exclusive
+    """
+    table = pd.read_csv(path)
+    starts = pd.to_datetime(table['start']).values.astype('datetime64[ns]').astype(np.int64)
+    ends = (pd.to_datetime(table['end']) + pd.Timedelta(minutes=1)).values.astype('datetime64[ns]').astype(np.int64)
+
+    order = np.argsort(starts)
+    starts, ends = starts[order], ends[order]
+    merged_starts, merged_ends = [], []
+    for start, end in zip(starts, ends):
+        if merged_ends and start <= merged_ends[-1]:
+            merged_ends[-1] = max(merged_ends[-1], end) # Overlapping periods
+        else:
+            merged_starts.append(start)
+            merged_ends.append(end)
+    return np.array(merged_starts, dtype=np.int64), np.array(merged_ends, dtype=np.int64)
+
+
+def label(timestamps, starts, ends):
+    """
+    Parameters:
+    timestamps - int64 ns timestamps
+    starts, ends - sorted non overlapping periods from load_intervals
+    Description: Return status (1 inside a fault period, else 0) by binary search of every timestamp in the periods
+    """
+    period = np.searchsorted(starts, timestamps, side='right') - 1
+    inside = (period >= 0) & (timestamps < ends[np.maximum(period, 0)])
+    return inside.astype(np.int64)
+
+
+class RawSlice(io.RawIOBase):
+    """
+    Read only bytes [start, end) of the raw file, so that appended rows are read without scanning the old ones
+    """
+    def __init__(self, f, start, end):
+        self.f = f
+        self.f.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        n = self.f.readinto(memoryview(buffer)[:max(0, min(len(buffer), self.remaining))])
+        self.remaining -= n
+        return n
+
+
 class Preprocessor:
     """
-    1. Read data 
-    2. Drop Unnamed: 0 column
-    3. Set datetime index
-    4. Drop unnecessary columns 'LPS', 'Pressure_switch', 'Oil_level', 'Caudal_impulses'
-    5. Add column status to label the data as healthy(0) and faulty(1)
-    """ 
-    def preprocess(self):
+    1. Read only the needed columns of the raw data in chunks with explicit dtypes
+    2. Set datetime index
+    3. Add column status to label the data as healthy(0) and faulty(1) from the periods in FAULT_INTERVALS
+    4. Save as csv and as memory-mappable columnar cache (one segment per chunk, merged by compact_cache
+       when they overlap or there are too many of them)
+    5. Build the min/max/mean pyramid for the history view from the sorted cache
+    6. Add the rows to the time-series store as machine DATASET_MACHINE (status is the label) for retraining and backtests
+    In append mode only the raw rows after the last processed byte of RAW_DATA (and newer than the last
+    processed timestamp, older ones are dropped and logged) are read, labelled and added - old data is never read or written again.
+    A full run keeps all the rows like the raw data.
+    A change in FAULT_INTERVALS needs a full run to label the old rows again.
+    """
+    def __init__(self, chunk_size=CHUNK_SIZE, intervals_path=FAULT_INTERVALS):
+        self.chunk_size = chunk_size
+        self.intervals_path = intervals_path
+
+    def read_chunks(self, start, end):
+        """
+        Yield preprocessed chunks of the raw rows in bytes [start, end) of RAW_DATA
+        """
+        starts, ends = load_intervals(self.intervals_path)
+        with open(RAW_DATA, 'rb') as f:
+            header = f.readline().decode().strip().split(',')
+            source = io.BufferedReader(RawSlice(f, max(start, f.tell()), end))
+            reader = pd.read_csv(source, names=header, header=None, usecols=['timestamp'] + FEATURES, dtype=DTYPES, chunksize=self.chunk_size)
+            for chunk in reader:
+                chunk['timestamp'] = pd.to_datetime(chunk['timestamp'])
+                chunk = chunk.set_index(['timestamp'])[FEATURES]
+                chunk['status'] = label(chunk.index.values.astype('datetime64[ns]').astype(np.int64), starts, ends)
+                yield chunk
+
+    def raw_end(self):
+        """
+        Return the byte offset after the last complete line of RAW_DATA (a row being written is left for the next run)
+        """
+        with open(RAW_DATA, 'rb') as f:
+            size = f.seek(0, os.SEEK_END)
+            position = size
+            while position > 0:
+                block = min(65536, position)
+                f.seek(position - block)
+                newline = f.read(block).rfind(b'\n')
+                if newline != -1:
+                    return position - block + newline + 1
+                position -= block
+        return 0
+
+    def preprocess(self, append=False):
+        """
+        Parameter: append(bool) - process only the raw rows added after the last run (full run if nothing is processed yet)
+        """
         try:
-            data = pd.read_csv(RAW_DATA)
-            data = data.drop(['Unnamed: 0'], axis=1)
-            data['timestamp'] = pd.to_datetime(data['timestamp'])
-            data = data.set_index(['timestamp'])
-            data = data.drop(['LPS', 'Pressure_switch', 'Oil_level', 'Caudal_impulses'], axis=1)
-        
-            data['status'] = 0
-            data.loc[ '4/18/2020 0:00' : '4/18/2020 23:59' ,'status'] = 1 
-            data.loc[ '5/29/2020 23:30' : '5/30/2020 6:00' ,'status'] = 1
-            data.loc[ '6/5/2020 10:00' : '6/7/2020 14:30' ,'status'] = 1 
-            data.loc[ '7/15/2020 14:30' : '7/15/2020 19:00' ,'status'] = 1 
-        
-            data.to_csv(PROCESSED_DATA)
-
-            LOGGER.log_preprocessing("Raw data preprocessed successfullt", logging.INFO)
-
-        
+            meta = read_meta(PROCESSED_CACHE) if append else None
+            if meta is None or meta.get("raw_offset") is None or not os.path.exists(PROCESSED_DATA):
+                append, meta = False, None
+
+            raw_end = self.raw_end()
+            start = meta["raw_offset"] if append else 0
+            last_timestamp = meta["last_timestamp"] if append else None
+            if append and start > raw_end:
+                raise ValueError("Raw data is smaller than the processed part, run without append")
+
+            store = TimeSeriesStore(features=FEATURES)
+            if not append:
+                store.drop(DATASET_MACHINE) # Old rows are labelled again
+            elif store.last_timestamp(DATASET_MACHINE) is None:
+                old = load_processed() # Rows processed before the store was added
+                store.append(DATASET_MACHINE, old.index.values, old[FEATURES].values, labels=old['status'].values)
+                store.flush(DATASET_MACHINE)
+
+            rows = 0
+            dropped = 0
+            for chunk in self.read_chunks(start, raw_end):
+                if append:
+                    new = chunk.index.values.astype('datetime64[ns]').astype(np.int64) > last_timestamp
+                    dropped += int((~new).sum())
+                    chunk = chunk[new]
+                if chunk.shape[0] == 0:
+                    continue
+
+                first = not append and rows == 0
+                chunk.to_csv(PROCESSED_DATA, mode='w' if first else 'a', header=first)
+                if first:
+                    write_cache(chunk)
+                else:
+                    append_cache(chunk, allow_overlap=True) # Raw rows may be out of order at chunk boundaries
+                store.append(DATASET_MACHINE, chunk.index.values, chunk[FEATURES].values, labels=chunk['status'].values)
+                store.flush(DATASET_MACHINE)
+                rows += chunk.shape[0]
+
+            if dropped:
+                LOGGER.log_preprocessing(f"{dropped} appended raw rows are not newer than the processed data and are dropped", logging.WARNING)
+            compact_cache()
+
+            # Remember the processed part of the raw file for the next append
+            meta = read_meta(PROCESSED_CACHE)
+            if meta is not None:
+                meta["raw_offset"] = raw_end
+                write_meta(meta, PROCESSED_CACHE)
+
+            if rows:
+                # Aggregates for browsing the history, new rows are read back sorted from the cache
+                if append:
+                    new = load_processed(start_date=pd.Timestamp(last_timestamp + 1))
+                    extend_pyramid(aggregate_rows(new, FEATURES), FEATURES, int(new.index[-1].value))
+                else:
+                    build_pyramid(folder=HISTORY_PYRAMID)
+
+            LOGGER.log_preprocessing(f"Raw data preprocessed successfully - {rows} new rows, append - {append}", logging.INFO)
+
+
         except Exception as e:
-           LOGGER.log_preprocessing(f"Error in preprocessing - {e}", logging.ERROR)
\ No newline at end of file
+           LOGGER.log_preprocessing(f"Error in preprocessing - {e}", logging.ERROR)
@@ -0,0 +1,290 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+from path.path import PROCESSED_CACHE, HISTORY_PYRAMID
+from preprocessing.cache import load_processed, load_timestamps
+
+
+META_FILE = "meta.json"
+
+# Levels of the pyramid above the raw data - (name, bucket size in seconds)
+LEVELS = [("1min", 60), ("1h", 3600), ("1d", 86400)]
+
+
+def aggregate(timestamps, columns, status, seconds):
+    """
+    Parameters:
+    timestamps - sorted int64 ns timestamps of the rows
+    columns(dict) - feature -> dict(min, max, sum) arrays (raw rows have min = max = sum = value)
+    status - no. of faulty rows in every row (0/1 for raw rows)
+    seconds(int) - bucket size
+    Description:
+    Return the level dict - start of every bucket, no. of rows, no. of faulty rows and min/max/sum of every feature
+    (count of a raw row is 1, of an aggregated row it is the count of the lower level)
+    """
+    return merge_buckets(timestamps - timestamps % (seconds * 10**9), columns, status, None)
+
+
+def merge_buckets(buckets, columns, status, counts):
+    """
+    Combine the rows having the same bucket (buckets must be sorted)
+    """
+    if buckets.shape[0] == 0:
+        starts = np.zeros(0, dtype=np.int64)
+    else:
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    counts = np.ones(buckets.shape[0], dtype=np.int64) if counts is None else counts
+
+    level = dict(
+        timestamp=buckets[starts].astype(np.int64),
+        count=np.add.reduceat(counts, starts) if starts.shape[0] else counts[:0],
+        status=np.add.reduceat(status.astype(np.int64), starts) if starts.shape[0] else status[:0].astype(np.int64),
+        columns={},
+    )
+    for feature, values in columns.items():
+        if not starts.shape[0]:
+            level["columns"][feature] = {name: np.zeros(0) for name in ("min", "max", "sum")}
+            continue
+        level["columns"][feature] = dict(
+            min=np.minimum.reduceat(values["min"], starts),
+            max=np.maximum.reduceat(values["max"], starts),
+            sum=np.add.reduceat(values["sum"].astype(np.float64), starts),
+        )
+    return level
+
+
+def raw_columns(data, features):
+    return {feature: {name: data[feature].values.astype(np.float64) for name in ("min", "max", "sum")} for feature in features}
+
+
+def next_level(level, seconds):
+    """
+    Build a coarser level from a finer one
+    """
+    buckets = level["timestamp"] - level["timestamp"] % (seconds * 10**9)
+    return merge_buckets(buckets, level["columns"], level["status"], level["count"])
+
+
+def save_array(path, array):
+    """
+    Save through a temporary file so that a reader having the old file memory-mapped is not affected
+    """
+    with open(path + ".tmp", 'wb') as f:
+        np.save(f, array)
+    os.replace(path + ".tmp", path)
+
+
+def save_level(level, folder):
+    os.makedirs(folder, exist_ok=True)
+    save_array(os.path.join(folder, "timestamp.npy"), level["timestamp"])
+    save_array(os.path.join(folder, "count.npy"), level["count"])
+    save_array(os.path.join(folder, "status.npy"), level["status"])
+    for feature, values in level["columns"].items():
+        for name, array in values.items():
+            save_array(os.path.join(folder, f"{feature}_{name}.npy"), array)
+
+
+def load_level(folder, features, mmap_mode='r'):
+    level = dict(
+        timestamp=np.load(os.path.join(folder, "timestamp.npy"), mmap_mode=mmap_mode),
+        count=np.load(os.path.join(folder, "count.npy"), mmap_mode=mmap_mode),
+        status=np.load(os.path.join(folder, "status.npy"), mmap_mode=mmap_mode),
+        columns={},
+    )
+    for feature in features:
+        level["columns"][feature] = {name: np.load(os.path.join(folder, f"{feature}_{name}.npy"), mmap_mode=mmap_mode) for name in ("min", "max", "sum")}
+    return level
+
+
+def write_pyramid(first_level, features, last_timestamp, folder):
+    """
+    Save the finest level and all the coarser levels built from it, meta.json is written last
+    """
+    meta_path = os.path.join(folder, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    level = first_level
+    for index, (name, seconds) in enumerate(LEVELS):
+        if index:
+            level = next_level(level, seconds)
+        save_level(level, os.path.join(folder, name))
+
+    with open(meta_path, 'w') as f:
+        json.dump({"columns": features, "levels": [name for name, _ in LEVELS], "last_timestamp": int(last_timestamp)}, f)
+
+
+def aggregate_rows(data, features):
+    """
+    Parameters:
+    data - preprocessed pd dataframe with timestamp index and 'status' column (sorted)
+    features(list) - feature columns
+    Description: Return the finest level (1 min buckets) of the rows
+    """
+    timestamps = data.index.values.astype('datetime64[ns]').astype(np.int64)
+    return aggregate(timestamps, raw_columns(data, features), data['status'].values, LEVELS[0][1])
+
+
+def concat_levels(levels):
+    """
+    Join finest levels of consecutive blocks of rows (e.g. chunks of the raw data) -
+    bucket on the boundary of two blocks is combined
+    """
+    features = list(levels[0]["columns"].keys())
+    columns = {
+        feature: {name: np.concatenate([level["columns"][feature][name] for level in levels]) for name in ("min", "max", "sum")}
+        for feature in features
+    }
+    return merge_buckets(
+        np.concatenate([level["timestamp"] for level in levels]),
+        columns,
+        np.concatenate([level["status"] for level in levels]),
+        np.concatenate([level["count"] for level in levels]),
+    )
+
+
+def build_pyramid(data=None, folder=HISTORY_PYRAMID):
+    """
+    Parameters:
+    data - preprocessed pd dataframe with timestamp index and 'status' column, None to read the processed cache
+    folder(str) - folder of the pyramid
+    Description:
+    1. Aggregate the rows into 1 min buckets - no. of rows, no. of faulty rows and min/max/sum of every feature
+    2. Aggregate every level into the next coarser one (1 min -> 1 h -> 1 day)
+    3. Save every level as .npy files (one per array) and the features in meta.json
+    """
+    if data is None:
+        data = load_processed()
+    data = data.sort_index()
+    features = [column for column in data.columns if column != 'status']
+    last_timestamp = data.index[-1].value if data.shape[0] else 0
+    write_pyramid(aggregate_rows(data, features), features, last_timestamp, folder)
+
+
+def extend_pyramid(first_level, features, last_timestamp, folder=HISTORY_PYRAMID):
+    """
+    Parameters:
+    first_level - finest level of new rows, all newer than the rows already in the pyramid
+    features(list) - feature columns
+    last_timestamp(int) - ns timestamp of the last new row
+    folder(str) - folder of the pyramid
+    Description:
+    Merge with the saved finest level (last bucket may be partly filled) and build the coarser levels again
+    from the finest level - it is small compared to the raw data. The pyramid is created if it is not there.
+    """
+    if os.path.exists(os.path.join(folder, META_FILE)):
+        old = load_level(os.path.join(folder, LEVELS[0][0]), features, mmap_mode=None)
+        first_level = concat_levels([old, first_level])
+    write_pyramid(first_level, features, last_timestamp, folder)
+
+
+def update_pyramid(data, folder=HISTORY_PYRAMID):
+    """
+    Parameters:
+    data - new preprocessed rows (pd dataframe with timestamp index and 'status' column)
+    folder(str) - folder of the pyramid
+    Description:
+    Add only the rows newer than the last timestamp already in the pyramid.
+    The pyramid is built from scratch if it is not there.
+    """
+    meta_path = os.path.join(folder, META_FILE)
+    if not os.path.exists(meta_path):
+        build_pyramid(data, folder)
+        return
+
+    with open(meta_path) as f:
+        meta = json.load(f)
+
+    data = data.sort_index()
+    data = data[data.index.values.astype('datetime64[ns]').astype(np.int64) > meta["last_timestamp"]]
+    if data.shape[0]:
+        extend_pyramid(aggregate_rows(data, meta["columns"]), meta["columns"], data.index[-1].value, folder)
+
+
+class HistoryPyramid:
+    """
+    Range queries on the min/max/mean pyramid for the history view.
+
+    1. Levels are memory-mapped once, a query only reads the rows of its range (binary search on timestamps)
+    2. The finest level (raw processed data included) having at most max_points rows in the range is used,
+       so any zoom level returns about the same no. of points
+    """
+    def __init__(self, folder=HISTORY_PYRAMID, raw_folder=PROCESSED_CACHE):
+        """
+        Parameters:
+        folder(str) - folder of the pyramid
+        raw_folder(str) - folder of the processed cache (finest level)
+        """
+        self.folder = folder
+        self.raw_folder = raw_folder
+        self.levels = None
+
+    def load(self):
+        if self.levels is None:
+            with open(os.path.join(self.folder, META_FILE)) as f:
+                meta = json.load(f)
+            self.features = meta["columns"]
+            self.levels = [(name, load_level(os.path.join(self.folder, name), self.features)) for name in meta["levels"]]
+            self.raw_timestamps = load_timestamps(self.raw_folder)
+        return self.levels
+
+    def reload(self):
+        """
+        Read the levels again after the pyramid is updated
+        """
+        self.levels = None
+        return self.load()
+
+    def extent(self):
+        """
+        Return (first, last) timestamp of the data
+        """
+        _, level = self.load()[-1]
+        timestamps = self.raw_timestamps if self.raw_timestamps.shape[0] else level["timestamp"]
+        return pd.Timestamp(int(timestamps[0])), pd.Timestamp(int(timestamps[-1]))
+
+    def query(self, feature, start=None, end=None, max_points=2000):
+        """
+        Parameters:
+        feature(str) - name of the feature
+        start, end - datetime range (both inclusive), None for no limit
+        max_points(int) - max no. of rows returned
+        Description:
+        Return (level name, pd dataframe) - timestamp index and columns min, max, mean and fault
+        (fraction of faulty rows) of the finest level having at most max_points rows in the range.
+        Level name is "raw" if the processed data is returned as it is.
+        """
+        levels = self.load()
+        start = None if start is None else pd.Timestamp(start).value
+        end = None if end is None else pd.Timestamp(end).value
+
+        def bounds(timestamps, bucket):
+            left = 0 if start is None else np.searchsorted(timestamps, start - start % bucket, side='left')
+            right = timestamps.shape[0] if end is None else np.searchsorted(timestamps, end, side='right')
+            return left, right
+
+        left, right = bounds(self.raw_timestamps, 1)
+        if right - left <= max_points:
+            raw = load_processed(None if start is None else pd.Timestamp(start), None if end is None else pd.Timestamp(end), self.raw_folder)
+            values = raw[feature].values.astype(np.float64)
+            frame = pd.DataFrame(dict(min=values, max=values, mean=values, fault=raw['status'].values.astype(np.float64)), index=raw.index)
+            return "raw", frame
+
+        for index, (name, level) in enumerate(levels):
+            left, right = bounds(level["timestamp"], LEVELS[index][1] * 10**9)
+            if right - left <= max_points or index == len(levels) - 1:
+                break
+
+        counts = np.asarray(level["count"][left:right])
+        values = level["columns"][feature]
+        frame = pd.DataFrame(
+            dict(
+                min=np.asarray(values["min"][left:right]),
+                max=np.asarray(values["max"][left:right]),
+                mean=np.asarray(values["sum"][left:right]) / counts,
+                fault=np.asarray(level["status"][left:right]) / counts,
+            ),
+            index=pd.DatetimeIndex(np.asarray(level["timestamp"][left:right]).astype('datetime64[ns]'), name='timestamp'),
+        )
+        return name, frame
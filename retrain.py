@@ -1,13 +1,24 @@
+import argparse
 from preprocessing.preprocessor import Preprocessor
-from training.training import train_clustering, do_matrix_profiling, do_sample_prediction_profiling, train_isolation
+from training.training import train_clustering, do_matrix_profiling, do_sample_prediction_profiling, train_isolation, incremental_retrain
 from datetime import datetime
+from metrics.metrics import start_metrics_server
+from storage.timeseries import TimeSeriesStore
+import pandas as pd
 
 if __name__=="__main__":
-     Preprocessor().preprocess()
-     train_clustering()
-     train_isolation()
+     parser = argparse.ArgumentParser(description="Preprocess new raw data and retrain the models")
+     parser.add_argument("--full", action="store_true", help="Run the full grid search instead of updating the saved models")
+     parser.add_argument("--retention-days", type=int, default=30, help="Recorded readings of the machines older than this are dropped")
+     args = parser.parse_args()
+
+     start_metrics_server() # Grid progress at /metrics if METRICS_PORT is set
+     Preprocessor().preprocess(append=True) # Only raw rows added after the last run
+     TimeSeriesStore().compact_all(pd.Timedelta(days=args.retention_days)) # Merge the segments written since the last run
+     if args.full:
+          train_clustering()
+          train_isolation()
+     else:
+          incremental_retrain() # Grid search runs only if drift is detected
      # do_matrix_profiling()
      # do_sample_prediction_profiling(start_date=datetime(2020, 4, 17, 20, 0), end_date=datetime(2020, 4, 19, 5, 0))
-
-
-    
\ No newline at end of file
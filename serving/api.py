@@ -0,0 +1,278 @@
+import time
+import math
+import queue
+import threading
+import multiprocessing
+import numpy as np
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from flask import request, jsonify
+from serving.fleet import FleetBuffer, FleetScorer
+from log.logging import LOGGER
+import logging
+from metrics.metrics import count_predictions, PREDICT_SECONDS, SERIALIZATION_SECONDS
+
+
+ARROW_CONTENT_TYPE = "application/vnd.apache.arrow.stream"
+
+
+class MicroBatcher:
+    """
+    Groups items submitted by concurrent requests into batches for one vectorised call.
+
+    1. submit(item) puts the item in a queue and returns a Future
+    2. A background thread takes the first waiting item and then keeps collecting for max_wait seconds
+       or till max_items are collected
+    3. process(items) is called once for the batch and must return one result per item
+    """
+    def __init__(self, process, max_items=256, max_wait=0.005):
+        """
+        Parameters:
+        process - function called with the list of items of a batch
+        max_items(int) - max no. of items in one batch
+        max_wait(float) - max seconds to wait for more items after the first one
+        """
+        self.process = process
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self.items = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def start(self):
+        """
+        Start the batching thread if it is not running (e.g. first request, or in a forked worker)
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def submit(self, item):
+        self.start()
+        future = Future()
+        self.items.put((item, future))
+        return future
+
+    def run(self):
+        while True:
+            batch = [self.items.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_items:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.items.get(timeout=remaining))
+                except queue.Empty:
+                    break
+
+            items = [item for item, _ in batch]
+            try:
+                results = self.process(items)
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+
+
+class FleetService:
+    """
+    Scores the readings of many machines pushed through the HTTP API.
+
+    1. One FleetBuffer keeps the latest readings of every machine (machine id is the row of the buffer)
+    2. Readings of a batch are applied in rounds - a machine appears at most once in a round, so readings
+       of the same machine are applied in the order they came
+    3. After every round the machines of the round are scored with one FleetScorer.evaluate call per model
+    4. A shared service keeps the buffer in shared memory and locks it across processes, so that every
+       server worker scores the same machines - prepare() must run before the workers are forked
+    """
+    def __init__(self, models, n_machines, window, shared=False):
+        """
+        Parameters:
+        models(dict) - name of model -> trained Clustering or Isolation model (loaded on first use)
+        n_machines(int) - no. of machines, ids must be less than this
+        window(int) - no. of latest readings kept for every machine
+        shared(bool) - share the readings with forked server workers
+        """
+        self.models = models
+        self.n_machines = n_machines
+        self.window = window
+        self.shared = shared
+        self.buffer = None
+        self.scorers = {}
+        self.lock = threading.Lock()
+        # API batcher and ingestion pipeline share the buffer - with a shared buffer so do the workers
+        self.process_lock = multiprocessing.Lock() if shared else threading.Lock()
+
+    def get_scorer(self, name):
+        """
+        Return the FleetScorer of the model, buffer and scorer are created on first use
+        """
+        with self.lock:
+            if name not in self.scorers:
+                model = self.models[name]
+                if self.buffer is None:
+                    self.buffer = FleetBuffer(self.n_machines, self.window, model.feature_names, shared=self.shared)
+                self.scorers[name] = FleetScorer(model, self.buffer)
+            return self.scorers[name]
+
+    def prepare(self):
+        """
+        Make the buffer and the scorers of all the models now instead of on first use (loads the models)
+        """
+        for name in self.models:
+            self.get_scorer(name)
+
+    def process(self, items):
+        """
+        Parameter: items - list of (machines, values, model name) of the requests in a batch
+        Description: Return list of (labels, scores) for every request
+        """
+        with self.process_lock:
+            return self.process_batch(items)
+
+    def valid(self, machines):
+        """
+        Return boolean array - True for the machine ids which have a row in the buffer (0 to n_machines-1)
+        """
+        machines = np.asarray(machines)
+        return (machines >= 0) & (machines < self.n_machines)
+
+    def ingest(self, machines, values, name):
+        """
+        Parameters:
+        machines - array of machine ids of the readings
+        values - 2D array of the readings (features in the order of the model)
+        name(str) - name of the model
+        Description:
+        Apply all the readings and score only the latest point of every machine in the batch.
+        Readings of unknown machine ids (see valid) are left out.
+        Return (machines, labels, scores) with one entry per unique machine.
+        """
+        scorer = self.get_scorer(name)
+        machines = np.asarray(machines, dtype=np.int64)
+        valid = self.valid(machines)
+        if not valid.all():
+            machines, values = machines[valid], np.asarray(values)[valid]
+        with self.process_lock:
+            rounds = self.rounds(machines)
+            for round_no in range(rounds.max() + 1 if rounds.shape[0] else 0):
+                rows = np.flatnonzero(rounds == round_no)
+                self.buffer.update(values[rows], machines[rows])
+            unique = np.unique(machines)
+            with PREDICT_SECONDS.labels(name).time():
+                labels, scores = scorer.evaluate(unique)
+        return unique, labels, scores
+
+    def rounds(self, machines):
+        """
+        Return occurrence no. of every reading of a machine in the batch
+        """
+        order = np.argsort(machines, kind='stable')
+        sorted_machines = machines[order]
+        group_start = np.flatnonzero(np.r_[True, sorted_machines[1:] != sorted_machines[:-1]])
+        group_sizes = np.diff(np.r_[group_start, machines.shape[0]])
+        rounds = np.empty(machines.shape[0], dtype=np.int64)
+        rounds[order] = np.arange(machines.shape[0]) - np.repeat(group_start, group_sizes)
+        return rounds
+
+    def process_batch(self, items):
+        machines = np.concatenate([item[0] for item in items]).astype(np.int64)
+        values = np.concatenate([item[1] for item in items])
+        names = np.concatenate([np.full(item[0].shape[0], item[2]) for item in items])
+        scorers = {name: self.get_scorer(name) for name in np.unique(names)}
+
+        rounds = self.rounds(machines)
+
+        labels = np.full(machines.shape[0], -1, dtype=np.int64)
+        scores = np.full(machines.shape[0], np.nan)
+        for round_no in range(rounds.max() + 1 if rounds.shape[0] else 0):
+            rows = np.flatnonzero(rounds == round_no)
+            self.buffer.update(values[rows], machines[rows])
+            for name, scorer in scorers.items():
+                selected = rows[names[rows] == name]
+                if selected.shape[0]:
+                    with PREDICT_SECONDS.labels(name).time():
+                        labels[selected], scores[selected] = scorer.evaluate(machines[selected])
+
+        results = []
+        start = 0
+        for item in items:
+            end = start + item[0].shape[0]
+            results.append((labels[start:end], scores[start:end]))
+            start = end
+        return results
+
+
+def parse_readings(request, features):
+    """
+    Parameters:
+    request - flask request
+    features(list) - names of the features in the order of the model
+    Description:
+    Return (machines, values) from the body of the request. Two formats are accepted -
+    1. application/octet-stream - header X-Rows: n, body is n little endian uint32 machine ids followed by
+       n x features little endian float32 readings (row major, features in the order of the model)
+    2. application/vnd.apache.arrow.stream - Arrow IPC stream with column 'machine' and one column per feature
+    """
+    body = request.get_data()
+    n_features = len(features)
+
+    if request.content_type is not None and request.content_type.startswith(ARROW_CONTENT_TYPE):
+        import pyarrow as pa
+        table = pa.ipc.open_stream(body).read_all()
+        machines = table.column('machine').to_numpy()
+        values = np.column_stack([table.column(name).to_numpy() for name in features]).astype(np.float64)
+        return machines.astype(np.int64), values
+
+    rows = int(request.headers.get('X-Rows', -1))
+    if rows < 0 or len(body) != rows * 4 * (1 + n_features):
+        raise ValueError("Body size does not match X-Rows")
+    machines = np.frombuffer(body, dtype='<u4', count=rows).astype(np.int64)
+    values = np.frombuffer(body, dtype='<f4', offset=rows * 4).reshape(rows, n_features).astype(np.float64)
+    return machines, values
+
+
+def register_api(server, batcher, service, timeout=10):
+    """
+    Parameters:
+    server - flask server of the Dash app (app.server)
+    batcher - MicroBatcher calling service.process
+    service - FleetService
+    timeout(float) - max seconds to wait for the result of a request
+    Description:
+    Add POST /api/predict?model=clustering|isolation which returns {"labels": [...], "scores": [...]} for the readings,
+    score is null and label is -1 while a machine does not have enough readings.
+    Returns 503 with a Retry-After header if the result is not ready in timeout seconds, 500 if scoring fails
+    """
+    @server.route("/api/predict", methods=["POST"])
+    def predict_batch():
+        model = request.args.get('model', 'clustering')
+        if model not in service.models:
+            return jsonify(error=f"Unknown model - {model}"), 400
+        try:
+            with SERIALIZATION_SECONDS.labels("api_decode").time():
+                machines, values = parse_readings(request, service.get_scorer(model).buffer.features)
+            if machines.shape[0] and (machines.min() < 0 or machines.max() >= service.n_machines):
+                raise ValueError(f"Machine ids must be between 0 and {service.n_machines - 1}")
+        except Exception as e:
+            return jsonify(error=str(e)), 400
+
+        try:
+            labels, scores = batcher.submit((machines, values, model)).result(timeout=timeout)
+        except FutureTimeoutError:
+            # Batcher is behind - the readings are still applied when their batch runs, the client retries for the scores
+            LOGGER.log_prediction(f"Prediction of {machines.shape[0]} readings timed out after {timeout} seconds", logging.WARNING)
+            response = jsonify(error=f"Prediction timed out after {timeout} seconds, retry later")
+            response.headers['Retry-After'] = str(math.ceil(timeout))
+            return response, 503
+        except Exception as e:
+            LOGGER.log_prediction(f"Error in prediction of {machines.shape[0]} readings - {e}", logging.ERROR)
+            return jsonify(error=f"Error in prediction - {e}"), 500
+        count_predictions(model, labels)
+        LOGGER.sample_prediction(model, labels, scores, machines)
+        with SERIALIZATION_SECONDS.labels("api_encode").time():
+            scores = [None if np.isnan(score) else float(score) for score in scores]
+            response = jsonify(labels=labels.tolist(), scores=scores)
+        return response
@@ -0,0 +1,214 @@
+import os
+import mmap
+import numpy as np
+
+
+class FleetBuffer:
+    """
+    Latest readings of many machines in one (machines x window x features) array.
+
+    1. Every machine has its own write position, the oldest reading is overwritten when its window is full
+    2. Smoothened features of the latest point of all machines are found in one batched pass -
+       "sma" reads only the last rolling_window slots of every machine,
+       "ewm" keeps a running weighted sum of the window of every machine which update moves by one reading
+    3. Running sums are made from the window when first asked for and again every time a machine's
+       write position wraps, so that round off errors do not pile up (same as RunningSmoother)
+    4. A shared buffer keeps all its arrays in shared memory - made before the server workers are forked,
+       every worker reads and writes the same readings (callers lock across the processes, see FleetService)
+    """
+    def __init__(self, n_machines, window, features, dtype=np.float64, shared=False):
+        """
+        Parameters:
+        n_machines(int) - no. of machines in the fleet
+        window(int) - no. of latest readings kept for every machine (DATA_WINDOW)
+        features(list) - names of the features in every reading
+        dtype - dtype of the readings array
+        shared(bool) - keep the arrays in shared memory so that forked processes see the same buffer
+        """
+        self.n_machines = n_machines
+        self.window = window
+        self.features = list(features)
+        self.shared = shared
+        self.owner = os.getpid() # Process which made the buffer, new shared arrays can only be made there
+        self.data = self.allocate((n_machines, window, len(self.features)), dtype)
+        self.positions = self.allocate(n_machines, np.int64) # Next slot to write for every machine
+        self.counts = self.allocate(n_machines, np.int64) # No. of readings seen by every machine
+        self.ewm_states = {} # rolling_window -> (decay, totals (machines x features), weights (machines))
+
+    def allocate(self, shape, dtype):
+        """
+        Return zero filled array - in an anonymous shared memory map if the buffer is shared
+        """
+        if not self.shared:
+            return np.zeros(shape, dtype=dtype)
+        if os.getpid() != self.owner:
+            raise RuntimeError("Arrays of a shared fleet buffer must be made before the processes are forked")
+        size = int(np.prod(shape))
+        memory = mmap.mmap(-1, max(1, size * np.dtype(dtype).itemsize)) # Shared with the forked children, zero filled
+        return np.frombuffer(memory, dtype=dtype, count=size).reshape(shape)
+
+    def update(self, values, machines=None):
+        """
+        Parameters:
+        values - 2D array (machines x features) of one new reading per machine
+        machines - index array of the machines the readings belong to (each at most once), None for all machines
+        """
+        if machines is None:
+            machines = np.arange(self.n_machines)
+        machines = np.asarray(machines)
+        values = np.asarray(values, dtype=self.data.dtype) # Running sums see the same values as the window
+
+        if self.ewm_states:
+            full = self.counts[machines] >= self.window
+            leaving = self.data[machines[full], self.positions[machines[full]]] # Readings overwritten by this update
+            for decay, totals, weights in self.ewm_states.values():
+                totals[machines] = decay * totals[machines] + values
+                totals[machines[full]] -= decay ** self.window * leaving
+                weights[machines[~full]] = decay * weights[machines[~full]] + 1
+
+        self.data[machines, self.positions[machines]] = values
+        self.positions[machines] = (self.positions[machines] + 1) % self.window
+        self.counts[machines] += 1
+
+        wrapped = machines[self.positions[machines] == 0]
+        if wrapped.shape[0]:
+            for decay, totals, weights in self.ewm_states.values():
+                self.resync(decay, totals, weights, wrapped)
+
+    def reset(self, machines=None):
+        """
+        Forget the readings of the machines (all machines if None)
+        """
+        if machines is None:
+            machines = np.arange(self.n_machines)
+        self.positions[machines] = 0
+        self.counts[machines] = 0
+        for decay, totals, weights in self.ewm_states.values():
+            totals[machines] = 0.0
+            weights[machines] = 0.0
+
+    def slot_weights(self, age_weights, machines):
+        """
+        Parameters:
+        age_weights - 1D array of the weight of every age (0 for the latest reading)
+        machines - index array of machines
+        Description:
+        Return (machines x window) array of the weight of every slot, indexed by its age.
+        Slot s of a machine at position p has age (p-1-s) % window, which is element window-p+s of the
+        reversed age weights repeated twice, so the row of the machine is a window long slice of it.
+        """
+        doubled = np.tile(age_weights[::-1], 2) # Element k is the weight of age (window-1-k) % window
+        rows = np.lib.stride_tricks.sliding_window_view(doubled, self.window)
+        return rows[self.window - self.positions[machines]]
+
+    def window_sums(self, decay, machines):
+        """
+        Return (totals, weights) - ewm weighted sum of the written slots of every machine and the sum of their weights
+        """
+        age = np.arange(self.window)
+        weights = self.slot_weights(decay ** age, machines)
+
+        # Slots not yet written are left out for the machines which have not filled their window -
+        # till then position is the count, so the written slots are the first count slots
+        filling = np.flatnonzero(self.counts[machines] < self.window)
+        if filling.shape[0]:
+            weights[filling] *= age[np.newaxis, :] < self.counts[machines[filling]][:, np.newaxis]
+        return (weights[:, np.newaxis, :] @ self.data[machines])[:, 0, :], weights.sum(axis=1)
+
+    def resync(self, decay, totals, weights, machines, chunk=1024):
+        """
+        Make the running ewm sums of the machines again from their windows, chunk machines at a time
+        so that the (machines x window) weights stay small
+        """
+        for start in range(0, machines.shape[0], chunk):
+            part = machines[start : start + chunk]
+            totals[part], weights[part] = self.window_sums(decay, part)
+
+    def ewm_state(self, rolling_window):
+        """
+        Return (decay, totals, weights) running ewm state of the rolling window, made from the window on first use
+        """
+        if rolling_window not in self.ewm_states:
+            decay = rolling_window / (rolling_window + 1)
+            totals = self.allocate((self.n_machines, len(self.features)), np.float64)
+            weights = self.allocate(self.n_machines, np.float64)
+            self.resync(decay, totals, weights, np.arange(self.n_machines))
+            self.ewm_states[rolling_window] = (decay, totals, weights)
+        return self.ewm_states[rolling_window]
+
+    def smoothed(self, rolling_window, method, machines=None):
+        """
+        Parameters:
+        rolling_window(int) - no. of lags to smoothen the data
+        method(str) - "sma" for simple moving average and "ewm" for exponential moving average
+        machines - index array of machines, None for all machines
+        Description:
+        Return (machines x features) array of the smoothened latest point of every machine -
+        same as the last row of rolling(...).mean() / ewm(com=...).mean() on its window.
+        Rows are nan for machines which have seen less than rolling_window readings.
+        """
+        if machines is None:
+            machines = np.arange(self.n_machines)
+        machines = np.asarray(machines)
+        if method == "sma":
+            # Only the last rolling_window slots of every machine, O(machines x rolling_window x features)
+            lags = np.arange(min(rolling_window, self.window))
+            slots = (self.positions[machines, np.newaxis] - 1 - lags[np.newaxis, :]) % self.window
+            smoothed = self.data[machines[:, np.newaxis], slots].mean(axis=1, dtype=np.float64)
+        elif method == "ewm":
+            decay, totals, weights = self.ewm_state(rolling_window)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                smoothed = totals[machines] / weights[machines, np.newaxis]
+        else:
+            raise ValueError(f"Unknown smoothing method - {method}")
+        smoothed[self.counts[machines] < rolling_window] = np.nan
+        return smoothed
+
+
+class FleetScorer:
+    """
+    Runs one trained model (Clustering or Isolation) for all machines of a FleetBuffer in one call.
+
+    1. Find smoothened latest point of every machine with the rolling window and method of the model
+    2. Call model.predict_smoothed once on all machines having enough data
+    3. Return one class level per machine (1 - Fault, 0 - Healthy, -1 - Not enough data)
+    """
+    def __init__(self, model, buffer):
+        """
+        Parameters:
+        model - trained Clustering or Isolation model
+        buffer - FleetBuffer holding the readings in the order of model.feature_names
+        """
+        self.model = model
+        self.buffer = buffer
+        if list(model.feature_names) != buffer.features:
+            raise ValueError("Features of the fleet buffer do not match the features of the model")
+        if model.method == "ewm":
+            buffer.ewm_state(model.rolling_window) # Running state is made with the scorer (before forking if shared)
+
+    def predict(self, machines=None):
+        """
+        Parameter: machines - index array of machines, None for all machines
+        Description: Return array of predicted class levels, one per machine
+        """
+        return self.evaluate(machines, with_scores=False)[0]
+
+    def evaluate(self, machines=None, with_scores=True):
+        """
+        Parameters:
+        machines - index array of machines, None for all machines
+        with_scores(bool) - False to skip the severity scores
+        Description:
+        Return (predictions, scores) - one class level and one severity (model.score_smoothed) per machine,
+        smoothened features are found only once for both. Score is nan if not enough data.
+        """
+        smoothed = self.buffer.smoothed(self.model.rolling_window, self.model.method, machines)
+        ready = ~np.isnan(smoothed).any(axis=1)
+
+        predictions = np.full(smoothed.shape[0], -1, dtype=np.int64)
+        scores = np.full(smoothed.shape[0], np.nan) if with_scores else None
+        if ready.any():
+            predictions[ready] = self.model.predict_smoothed(smoothed[ready])
+            if with_scores:
+                scores[ready] = self.model.score_smoothed(smoothed[ready])
+        return predictions, scores
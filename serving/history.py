@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+
+# Max no. of points of the history graph at any zoom level
+HISTORY_POINTS = 2000
+
+
+def zoom_range(relayout):
+    """
+    Parameter: relayout - relayoutData of the history graph
+    Description: Return (start, end) of the zoomed x axis, (None, None) for the full range
+    """
+    if not relayout or relayout.get("xaxis.autorange"):
+        return None, None
+    if "xaxis.range[0]" in relayout:
+        return relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]
+    if "xaxis.range" in relayout:
+        return tuple(relayout["xaxis.range"])
+    return None, None
+
+
+def history_figure(pyramid, feature, start=None, end=None, max_points=HISTORY_POINTS):
+    """
+    Parameters:
+    pyramid - HistoryPyramid
+    feature(str) - name of the feature
+    start, end - zoomed range, None for all the data
+    max_points(int) - max no. of points of the graph
+    Description:
+    Return the history figure - mean line with min/max band and fault periods shaded,
+    from the pyramid level matching the zoom
+    """
+    level, frame = pyramid.query(feature, start, end, max_points)
+    return band_figure(frame, feature, f"History of {feature} ({level} resolution)", "fault fraction", start, end)
+
+
+def bucket_readings(frame, feature, max_points=HISTORY_POINTS):
+    """
+    Parameters:
+    frame - pd dataframe of recorded readings (TimeSeriesStore.query)
+    feature(str) - name of the feature
+    max_points(int) - max no. of rows returned
+    Description:
+    Return pd dataframe with columns min, max, mean and fault (fraction of readings predicted faulty) -
+    consecutive readings are joined in max_points equal buckets when there are more readings
+    """
+    values = frame[feature].values.astype(np.float64)
+    faults = (frame['label'].values == 1).astype(np.float64)
+    if values.shape[0] <= max_points:
+        return pd.DataFrame(dict(min=values, max=values, mean=values, fault=faults), index=frame.index)
+
+    starts = np.unique(np.linspace(0, values.shape[0], max_points, endpoint=False).astype(np.int64))
+    counts = np.diff(np.r_[starts, values.shape[0]])
+    return pd.DataFrame(
+        dict(
+            min=np.minimum.reduceat(values, starts),
+            max=np.maximum.reduceat(values, starts),
+            mean=np.add.reduceat(values, starts) / counts,
+            fault=np.add.reduceat(faults, starts) / counts,
+        ),
+        index=frame.index[starts],
+    )
+
+
+def recorded_figure(store, machine, feature, start=None, end=None, max_points=HISTORY_POINTS):
+    """
+    Parameters:
+    store - TimeSeriesStore
+    machine - machine id (session id of the dashboard)
+    feature(str) - name of the feature
+    start, end - zoomed range, None for all the readings
+    max_points(int) - max no. of points of the graph
+    Description:
+    Return (figure, last) - figure of the recorded readings of the machine with the readings predicted faulty shaded,
+    and the ns timestamp of the last reading in it (-1 if there is none) for recorded_update
+    """
+    readings = store.query(machine, start, end)
+    last = int(readings.index.values[-1].astype(np.int64)) if readings.shape[0] else -1
+    frame = bucket_readings(readings, feature, max_points)
+    return band_figure(frame, feature, f"Recorded readings of {feature}", "predicted faulty", start, end), last
+
+
+def recorded_update(store, machine, feature, last, max_points=HISTORY_POINTS):
+    """
+    Parameters:
+    store - TimeSeriesStore
+    machine - machine id (session id of the dashboard)
+    feature(str) - name of the feature
+    last(int) - ns timestamp of the last reading the graph has
+    max_points(int) - max no. of points kept by the graph
+    Description:
+    Return (extend, last) - extendData of the 4 traces of recorded_figure with only the readings after last
+    (None if there are none) and the new last timestamp
+    """
+    readings = store.query(machine, pd.Timestamp(last + 1))
+    if not readings.shape[0]:
+        return None, last
+    x = list(readings.index)
+    values = readings[feature].tolist()
+    faults = (readings['label'].values == 1).astype(float).tolist()
+    extend = (dict(x=[x, x, x, x], y=[values, values, values, faults]), [0, 1, 2, 3], max_points)
+    return extend, int(readings.index.values[-1].astype(np.int64))
+
+
+def band_figure(frame, feature, title, fault_name, start=None, end=None):
+    """
+    Mean line with min/max band and the fault fraction as bars on the second axis
+    """
+    figure = go.Figure()
+    figure.add_trace(go.Scattergl(x=frame.index, y=frame["max"], mode="lines", line=dict(width=0), name="max", showlegend=False))
+    figure.add_trace(go.Scattergl(x=frame.index, y=frame["min"], mode="lines", line=dict(width=0), fill="tonexty",
+                                  fillcolor="rgba(31, 119, 180, 0.2)", name="min", showlegend=False))
+    figure.add_trace(go.Scattergl(x=frame.index, y=frame["mean"], mode="lines", line=dict(color="rgb(31, 119, 180)"), name="mean"))
+    figure.add_trace(go.Bar(x=frame.index, y=frame["fault"], yaxis="y2", marker=dict(color="rgba(220, 53, 69, 0.4)"),
+                            name=fault_name))
+
+    figure.update_layout(xaxis_title="Time",
+                         yaxis_title=f"Parameter {feature}",
+                         yaxis2=dict(overlaying="y", side="right", range=[0, 1], showgrid=False, title="Fault"),
+                         title=title,
+                         bargap=0,
+                         uirevision=feature) # Keep the zoom when the figure is replaced
+    if start is not None:
+        figure.update_xaxes(range=[start, end])
+    return figure
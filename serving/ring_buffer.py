@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+import pandas as pd
+
+
+class RingBuffer:
+    """
+    Preallocated fixed size queue of sensor readings which lives on the server.
+
+    1. Readings and timestamps are written in place in NumPy arrays, the oldest reading is overwritten when full
+    2. seq is the total no. of readings appended till now, it works as a cursor for the browser
+    3. since(cursor) returns only the readings newer than the cursor (delta)
+    """
+    def __init__(self, capacity, columns):
+        """
+        Parameters:
+        capacity(int) - max no. of readings to keep (DATA_WINDOW)
+        columns(list) - names of the features in every reading
+        """
+        self.capacity = capacity
+        self.columns = list(columns)
+        self.values = np.full((capacity, len(self.columns)), np.nan)
+        self.timestamps = np.zeros(capacity, dtype='datetime64[ns]')
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return min(self.seq, self.capacity)
+
+    def append(self, values, timestamp):
+        """
+        Parameters:
+        values - 1D array of one reading in the order of self.columns
+        timestamp - timestamp of the reading
+        Description: Write the reading over the oldest one and return the new cursor
+        """
+        with self.lock:
+            position = self.seq % self.capacity
+            self.values[position] = values
+            self.timestamps[position] = np.datetime64(timestamp, 'ns')
+            self.seq += 1
+            return self.seq
+
+    def clear(self):
+        """
+        Forget all the readings
+        """
+        with self.lock:
+            self.values[:] = np.nan
+            self.seq = 0
+
+    def since(self, cursor):
+        """
+        Parameter: cursor(int) - seq value already seen by the caller
+        Description: Return (timestamps, values, seq) of the readings appended after the cursor, oldest first
+        """
+        with self.lock:
+            n = min(self.seq - max(cursor, 0), len(self))
+            if n <= 0:
+                return self.timestamps[:0].copy(), self.values[:0].copy(), self.seq
+            positions = np.arange(self.seq - n, self.seq) % self.capacity
+            return self.timestamps[positions], self.values[positions], self.seq
+
+    def latest(self):
+        """
+        Return (timestamps, values) of all the readings in the buffer, oldest first
+        """
+        timestamps, values, _ = self.since(0)
+        return timestamps, values
+
+    def to_frame(self):
+        """
+        Return the readings in the buffer as a pd dataframe with timestamp index
+        """
+        timestamps, values = self.latest()
+        return pd.DataFrame(values, index=pd.DatetimeIndex(timestamps, name='timestamp'), columns=self.columns)
+
@@ -0,0 +1,243 @@
+import io
+import os
+import time
+import pickle
+import threading
+from collections import OrderedDict
+from serving.ring_buffer import RingBuffer
+
+
+# Session not used for this many seconds is removed
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 30 * 60))
+
+# Max no. of sessions kept in memory, least recently used one is removed first
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", 200))
+
+# Fields of a session which are saved separately in Redis
+FIELDS = ("data_queue", "predictor", "healthy_index", "fault_index", "prediction", "outputs", "trend_state", "history_state")
+
+LOCK_TYPE = type(threading.Lock())
+
+
+def dumps(value, shared):
+    """
+    Parameters:
+    value - value of a session field
+    shared(dict) - name -> object of the server (models, ensemble) which is saved only by its name
+    Description: Pickle the value, locks are left out and made again by loads
+    """
+    names = {id(obj): name for name, obj in shared.items()}
+
+    def persistent_id(obj):
+        if isinstance(obj, LOCK_TYPE):
+            return ("lock", None)
+        if id(obj) in names:
+            return ("shared", names[id(obj)])
+        return None
+
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=pickle.HIGHEST_PROTOCOL)
+    pickler.persistent_id = persistent_id
+    pickler.dump(value)
+    return buffer.getvalue()
+
+
+def loads(data, shared):
+    """
+    Unpickle a value saved by dumps, shared objects are taken from this process
+    """
+    def persistent_load(pid):
+        kind, name = pid
+        return threading.Lock() if kind == "lock" else shared[name]
+
+    unpickler = pickle.Unpickler(io.BytesIO(data))
+    unpickler.persistent_load = persistent_load
+    return unpickler.load()
+
+
+class Session:
+    """
+    All the state of one dashboard on the server - browser only has the session id.
+
+    1. data_queue - RingBuffer of the latest readings
+    2. predictor - (model_used, streaming predictor) of the selected model, None till the first prediction
+    3. healthy_index, fault_index - position in the synthetic healthy / faulty data
+    4. prediction, outputs - latest class level and the class level of every model of the ensemble
+    5. trend_state - what the machine-trend graph of the browser is showing
+    6. history_state - ns timestamp of the last recorded reading in the history graph, None if it is not following them
+    """
+    def __init__(self, capacity, columns):
+        self.data_queue = RingBuffer(capacity, columns)
+        self.reset()
+
+    def reset(self):
+        self.data_queue.clear()
+        self.predictor = None
+        self.healthy_index = -1
+        self.fault_index = -1
+        self.prediction = -1
+        self.outputs = None
+        self.trend_state = None
+        self.history_state = None
+
+
+class SessionStore:
+    """
+    In-process session store with TTL and LRU eviction.
+
+    1. get(key) returns the session of the key, a new session is created for a new or expired key
+    2. Sessions not used for ttl seconds are removed, and the least recently used ones when there are more than max_sessions,
+       so memory stays bounded as dashboards are opened and closed
+    3. Sessions are changed in place, save only marks them as used
+    4. on_evict is called with the key of every removed session (e.g. to remove its recorded readings)
+    Sessions are local to the process - with many gunicorn workers use RedisSessionStore.
+    """
+    def __init__(self, capacity, columns, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, on_evict=None):
+        """
+        Parameters:
+        capacity(int) - size of the data queue of every session (DATA_WINDOW)
+        columns(list) - names of the features in every reading
+        ttl(int) - seconds after the last use a session is removed
+        max_sessions(int) - max no. of sessions kept
+        on_evict - function called with the key of a removed session, None for nothing
+        """
+        self.capacity = capacity
+        self.columns = list(columns)
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = OrderedDict() # key -> (session, last used), least recently used first
+        self.on_evict = on_evict
+        self.lock = threading.Lock()
+
+    def evict(self, now):
+        """
+        Remove the expired sessions and the least recently used ones over max_sessions (lock must be held).
+        Return the keys of the removed sessions.
+        """
+        removed = []
+        while self.sessions:
+            key, (_, used) = next(iter(self.sessions.items()))
+            if now - used <= self.ttl and len(self.sessions) <= self.max_sessions:
+                break
+            del self.sessions[key]
+            removed.append(key)
+        return removed
+
+    def notify(self, removed):
+        if self.on_evict is not None:
+            for key in removed:
+                self.on_evict(key)
+
+    def get(self, key, *fields):
+        """
+        Parameters:
+        key(str) - session id
+        fields - names of the fields the caller reads, not needed as the whole session is in memory
+        """
+        now = time.monotonic()
+        with self.lock:
+            session, used = self.sessions.pop(key, (None, now))
+            removed = [key] if session is not None and now - used > self.ttl else []
+            if session is None or removed:
+                session = Session(self.capacity, self.columns)
+            self.sessions[key] = (session, now)
+            removed += self.evict(now)
+        self.notify(removed) # Outside the lock, may write to disk
+        return session
+
+    def save(self, key, session, *fields):
+        """
+        Parameters:
+        key(str) - session id
+        session - Session
+        fields - names of the changed fields, not needed as the session is changed in place
+        """
+        with self.lock:
+            if key in self.sessions:
+                self.sessions[key] = (session, time.monotonic())
+                self.sessions.move_to_end(key)
+
+    def remove(self, key):
+        with self.lock:
+            removed = [key] if self.sessions.pop(key, None) is not None else []
+        self.notify(removed)
+
+    def __len__(self):
+        return len(self.sessions)
+
+
+class RedisSessionStore:
+    """
+    Session store in Redis (or any server speaking the Redis protocol) shared by all the gunicorn workers.
+
+    1. Every session is a Redis hash, every field is pickled separately so that callbacks
+       saving different fields at the same time do not overwrite each other, and get loads only
+       the fields a callback reads (HMGET)
+    2. Every save sets the TTL of the key again, Redis removes the idle sessions (and the least recently
+       used ones with maxmemory-policy allkeys-lru)
+    3. Models referred by the predictors are not saved, only their name in shared
+    """
+    def __init__(self, capacity, columns, url, shared=None, ttl=SESSION_TTL, prefix="session:"):
+        """
+        Parameters:
+        capacity(int) - size of the data queue of every session (DATA_WINDOW)
+        columns(list) - names of the features in every reading
+        url(str) - Redis url e.g. redis://localhost:6379/0
+        shared(dict) - name -> model (or ensemble) of the server used by the predictors
+        ttl(int) - seconds after the last use a session is removed
+        prefix(str) - prefix of the Redis keys
+        """
+        import redis # Optional dependency, needed only for this store
+
+        self.capacity = capacity
+        self.columns = list(columns)
+        self.ttl = ttl
+        self.prefix = prefix
+        self.shared = shared or {}
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key, *fields):
+        """
+        Parameters:
+        key(str) - session id
+        fields - names of the fields to load, all the fields if not given - others keep the values of a new session
+        """
+        fields = fields or FIELDS
+        values = self.client.hmget(self.prefix + key, fields)
+        session = Session(self.capacity, self.columns)
+        for field, value in zip(fields, values):
+            if value is not None:
+                setattr(session, field, loads(value, self.shared))
+        if any(value is not None for value in values):
+            self.client.expire(self.prefix + key, self.ttl)
+        return session
+
+    def save(self, key, session, *fields):
+        """
+        Parameters:
+        key(str) - session id
+        session - Session
+        fields - names of the changed fields, all the fields if not given
+        """
+        fields = fields or FIELDS
+        pipeline = self.client.pipeline()
+        pipeline.hset(self.prefix + key, mapping={field: dumps(getattr(session, field), self.shared) for field in fields})
+        pipeline.expire(self.prefix + key, self.ttl)
+        pipeline.execute()
+
+    def remove(self, key):
+        self.client.delete(self.prefix + key)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*"))
+
+
+def create_session_store(capacity, columns, shared=None, on_evict=None):
+    """
+    Return RedisSessionStore if SESSION_REDIS_URL is set, else the in-process SessionStore.
+    on_evict is used only by SessionStore - Redis expires the sessions itself.
+    """
+    url = os.environ.get("SESSION_REDIS_URL")
+    if url:
+        return RedisSessionStore(capacity, columns, url, shared)
+    return SessionStore(capacity, columns, on_evict=on_evict)
@@ -0,0 +1,116 @@
+import math
+import numpy as np
+import plotly.graph_objects as go
+
+
+# Max no. of points of the machine-trend graph, bigger windows are downsampled to this
+MAX_POINTS = 2000
+
+
+def lttb(x, y, size, previous=None):
+    """
+    Parameters:
+    x - 1D float array of the times of the readings, y - 1D array of the values
+    size(int) - no. of readings in a bucket, only the full buckets at the start of x are used
+    previous - (x, y) of the point drawn before x, None to use the first reading
+    Description:
+    Largest-Triangle-Three-Buckets - return the index of one reading per bucket, the one making the largest
+    triangle with the point chosen for the bucket before and the mean of the bucket after (the last reading
+    of the bucket for the last bucket, whose next bucket has not come yet)
+    """
+    n_buckets = x.shape[0] // size
+    chosen = np.empty(n_buckets, dtype=np.int64)
+    point_x, point_y = (x[0], y[0]) if previous is None else previous
+    for bucket in range(n_buckets):
+        start = bucket * size
+        bx, by = x[start : start + size], y[start : start + size]
+        if bucket + 1 < n_buckets:
+            next_x, next_y = x[start + size : start + 2 * size].mean(), y[start + size : start + 2 * size].mean()
+        else:
+            next_x, next_y = bx[-1], by[-1]
+        area = np.abs((point_x - next_x) * (by - point_y) - (point_x - bx) * (next_y - point_y))
+        best = int(np.argmax(area))
+        chosen[bucket] = start + best
+        point_x, point_y = bx[best], by[best]
+    return chosen
+
+
+def bucket_size(data_queue, max_points=MAX_POINTS):
+    """
+    Readings per point of a downsampled graph - fixed for the queue, so a full window is at most max_points points
+    """
+    return math.ceil(data_queue.capacity / max_points)
+
+
+def trend_figure(timestamps, y, feature):
+    """
+    Parameters:
+    timestamps - 1D datetime64 array of the points, oldest first
+    y - 1D array of the selected feature
+    feature(str) - name of the feature
+    Description: Return the full machine-trend figure of the points
+    """
+    figure = go.Figure(data=go.Scattergl(name=feature, mode="lines", x=timestamps, y=y))
+    figure.update_layout(yaxis=dict(rangemode="tozero", autorange=True),
+                         xaxis_title="Time",
+                         yaxis_title=f"Parameter {feature}",
+                         title="Trend of machine parameters",
+                         uirevision=feature) # Keep zoom of the user while points are appended
+    return figure
+
+
+def trend_update(data_queue, feature, state, max_points=MAX_POINTS):
+    """
+    Parameters:
+    data_queue - RingBuffer of the session
+    feature(str) - selected feature
+    state(dict) - what the browser is showing now - {"feature", "cursor", "size", "last"} or None
+    max_points(int) - max no. of points in the graph
+    Description:
+    Return (figure, extend, state) for the machine-trend graph, one of figure / extend is None -
+    1. figure - full figure when the feature is changed, the session is new, the browser missed readings
+       or the queue has grown over max_points readings (graph is downsampled from then on)
+    2. extend - extendData with only the readings after state["cursor"], the graph keeps the last
+       max_points points so the oldest points are dropped by the browser
+    A downsampled graph (size > 1) shows one point per bucket of size readings chosen by lttb, for the full
+    figure and for the appended points alike. Readings of a bucket which is not full yet are sent when it fills.
+    """
+    seq = data_queue.seq
+    downsample = len(data_queue) > max_points
+    redraw = (
+        state is None
+        or state["feature"] != feature
+        or seq < state["cursor"] # Queue was cleared
+        or seq - state["cursor"] > data_queue.capacity # Browser missed readings which are already overwritten
+        or (state["size"] == 1 and downsample)
+    )
+    column = data_queue.columns.index(feature)
+
+    if redraw:
+        timestamps, values = data_queue.latest()
+        y = np.ascontiguousarray(values[:, column])
+        if not downsample:
+            state = dict(feature=feature, cursor=seq, size=1, last=None)
+            return trend_figure(timestamps, y, feature), None, state
+        # First reading is kept as it is, the rest is drawn bucket by bucket
+        size = bucket_size(data_queue, max_points)
+        x = timestamps.astype(np.int64).astype(float)
+        chosen = np.r_[0, 1 + lttb(x[1:], y[1:], size, previous=(x[0], y[0]))]
+        drawn = (y.shape[0] - 1) // size * size + 1 # Readings of the full buckets
+        state = dict(feature=feature, cursor=seq - (y.shape[0] - drawn), size=size, last=(float(x[chosen[-1]]), float(y[chosen[-1]])))
+        return trend_figure(timestamps[chosen], y[chosen], feature), None, state
+
+    timestamps, values, seq = data_queue.since(state["cursor"])
+    size = state["size"]
+    if values.shape[0] < size:
+        return None, None, state
+    y = values[:, column]
+    if size == 1:
+        extend = [dict(x=[timestamps], y=[y]), [0], min(data_queue.capacity, max_points)]
+        return None, extend, dict(state, cursor=seq)
+
+    x = timestamps.astype(np.int64).astype(float)
+    chosen = lttb(x, y, size, previous=state["last"])
+    drawn = chosen.shape[0] * size
+    extend = [dict(x=[timestamps[chosen]], y=[y[chosen]]), [0], max_points]
+    return None, extend, dict(state, cursor=seq - (values.shape[0] - drawn), last=(float(x[chosen[-1]]), float(y[chosen[-1]])))
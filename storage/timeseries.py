@@ -0,0 +1,495 @@
+import os
+import json
+import time
+import zlib
+import fcntl
+import shutil
+import atexit
+import threading
+from urllib.parse import quote, unquote
+import numpy as np
+import pandas as pd
+from path.path import TIMESERIES_STORE
+from preprocessing.cache import load_processed, load_timestamps
+
+
+META_FILE = "meta.json"
+MANIFEST_FILE = "manifest.json"
+
+# One sparse index entry (timestamp, record no.) per this many records of a segment
+INDEX_EVERY = 1024
+
+# Max no. of records of a segment, a new segment is started after it
+SEGMENT_RECORDS = 1000000
+
+# Pending records of a machine are written (and fsynced) when there are this many of them ...
+FLUSH_RECORDS = 512
+
+# ... or the oldest of them is waiting for this many seconds
+FLUSH_SECONDS = 5.0
+
+# Machine id of the preprocessed training data (labels are the status of the rows)
+DATASET_MACHINE = "dataset"
+
+
+def record_dtype(n_features):
+    """
+    Fixed size binary record of one reading - timestamp (int64 ns), raw and smoothened features (float32),
+    label (int8, status of the dataset or predicted class level, -1 if not known) and score (float32, nan if not known)
+    """
+    return np.dtype([
+        ("timestamp", "<i8"),
+        ("raw", "<f4", (n_features,)),
+        ("smoothed", "<f4", (n_features,)),
+        ("label", "i1"),
+        ("score", "<f4"),
+    ])
+
+
+def to_nanoseconds(timestamps):
+    return pd.to_datetime(np.asarray(timestamps)).values.astype('datetime64[ns]').astype(np.int64)
+
+
+def write_json(data, path):
+    """
+    Write json through a temporary file (fsynced) so that a half written file is never read
+    """
+    with open(path + ".tmp", 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class TimeSeriesStore:
+    """
+    Append-only on-disk store of scored readings keyed by machine and timestamp.
+
+    1. Every machine has a folder of segments - a .bin file of fixed size records (record_dtype), sorted on timestamp,
+       and a .idx file with the timestamp of every INDEX_EVERY-th record (sparse index).
+       manifest.json has the no. of records and first / last timestamp of every segment.
+    2. append only buffers the records in memory, they are written in one batch (one fsync per file) when
+       flush_records are pending or the oldest waited flush_seconds, and by flush / at exit.
+       append_many takes readings of many machines in one call (e.g. a batch of the ingestion pipeline).
+       Writers of different processes are serialised by a file lock on the folder of the machine.
+    3. Range query - segments are selected from the manifest, binary search on the sparse index gives the
+       block of INDEX_EVERY records holding the start and the end, only those blocks are searched.
+       Segments are memory-mapped, rows out of the range are never read.
+    4. Records older than the last record of the machine start a new segment (segments may overlap),
+       compact merges all the segments into sorted full segments and drops the records older than the retention.
+    """
+    def __init__(self, folder=TIMESERIES_STORE, features=None, flush_records=FLUSH_RECORDS, flush_seconds=FLUSH_SECONDS):
+        """
+        Parameters:
+        folder(str) - folder of the store
+        features(list) - names of the features, read from meta.json of an existing store if None
+        flush_records(int), flush_seconds(float) - pending records of a machine are written when there are
+        this many of them or the oldest waited this long (raise flush_seconds for thousands of machines -
+        every machine written is a few fsyncs)
+        """
+        self.folder = folder
+        meta_path = os.path.join(folder, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                stored = json.load(f)["features"]
+            if features is not None and list(features) != stored:
+                raise ValueError("Features do not match the features of the store")
+            features = stored
+        elif features is None:
+            raise ValueError(f"No store in {folder}, features are needed to create it")
+        else:
+            os.makedirs(folder, exist_ok=True)
+            write_json({"features": list(features)}, meta_path)
+
+        self.features = list(features)
+        self.flush_records = flush_records
+        self.flush_seconds = flush_seconds
+        self.dtype = record_dtype(len(self.features))
+        self.pending = {} # machine -> list of record arrays not yet written
+        self.pending_since = {} # machine -> time of the oldest pending record
+        self.pending_count = {} # machine -> no. of pending records
+        self.lock = threading.Lock()
+        atexit.register(self.flush)
+        if hasattr(os, 'register_at_fork'):
+            os.register_at_fork(after_in_child=self.forget_pending) # Records of the parent are written by the parent
+
+    def forget_pending(self):
+        self.pending, self.pending_since, self.pending_count = {}, {}, {}
+        self.lock = threading.Lock()
+
+    def machine_folder(self, machine):
+        return os.path.join(self.folder, quote(str(machine), safe="-_."))
+
+    def machines(self):
+        """
+        Return the ids of all the machines in the store
+        """
+        return sorted(unquote(name) for name in os.listdir(self.folder) if os.path.isdir(os.path.join(self.folder, name)))
+
+    def read_manifest(self, machine):
+        path = os.path.join(self.machine_folder(machine), MANIFEST_FILE)
+        if not os.path.exists(path):
+            return {"segments": [], "next": 0}
+        with open(path) as f:
+            return json.load(f)
+
+    def records(self, timestamps, raw, smoothed=None, labels=None, scores=None):
+        """
+        Return a record array of the readings, missing smoothened features / labels / scores are nan / -1 / nan
+        """
+        records = np.zeros(len(timestamps), dtype=self.dtype)
+        records["timestamp"] = to_nanoseconds(timestamps)
+        records["raw"] = raw
+        records["smoothed"] = np.nan if smoothed is None else smoothed
+        records["label"] = -1 if labels is None else labels
+        records["score"] = np.nan if scores is None else scores
+        return records
+
+    def append(self, machine, timestamps, raw, smoothed=None, labels=None, scores=None):
+        """
+        Parameters:
+        machine - machine id
+        timestamps - array of timestamps of the readings
+        raw - 2D array (readings x features) in the order of self.features
+        smoothed - 2D array of the smoothened features, None if not known
+        labels - array of labels, None if not known
+        scores - array of severity scores, None if not known
+        Description: Buffer the readings, they are written in a batch (see flush_records, flush_seconds)
+        """
+        self.buffer({machine: self.records(timestamps, raw, smoothed, labels, scores)})
+
+    def append_many(self, machines, timestamps, raw, smoothed=None, labels=None, scores=None):
+        """
+        Parameters:
+        machines - array of machine ids, one per reading
+        others - same as append
+        Description: Buffer readings of many machines - records are made once for the batch and split by machine
+        """
+        machines = np.asarray(machines)
+        if machines.shape[0] == 0:
+            return
+        records = self.records(timestamps, raw, smoothed, labels, scores)
+        order = np.argsort(machines, kind='stable')
+        sorted_machines = machines[order]
+        starts = np.flatnonzero(np.r_[True, sorted_machines[1:] != sorted_machines[:-1]])
+        ends = np.r_[starts[1:], machines.shape[0]]
+        self.buffer({sorted_machines[start].item(): records[order[start:end]] for start, end in zip(starts, ends)})
+
+    def deadline(self, machine, since):
+        """
+        Time the pending records of the machine must be written by - the next multiple of flush_seconds
+        after since, shifted by a fixed phase of the machine so that the machines of a fleet started
+        together are written spread over flush_seconds instead of all at once (never later than since + flush_seconds)
+        """
+        phase = zlib.crc32(str(machine).encode()) / 2**32 * self.flush_seconds
+        return since + self.flush_seconds - (since + phase) % self.flush_seconds
+
+    def buffer(self, batches):
+        """
+        Add machine -> record array to the pending records and write the machines which are due
+        """
+        now = time.monotonic()
+        due = []
+        with self.lock:
+            for machine, records in batches.items():
+                parts = self.pending.setdefault(machine, [])
+                parts.append(records)
+                since = self.pending_since.setdefault(machine, now)
+                self.pending_count[machine] = self.pending_count.get(machine, 0) + records.shape[0]
+                if self.pending_count[machine] >= self.flush_records or now >= self.deadline(machine, since):
+                    due.append(machine)
+        for machine in due:
+            self.flush(machine)
+
+    def flush(self, machine=None):
+        """
+        Write the pending records of the machine (all machines if None) and fsync them
+        """
+        with self.lock:
+            machines = list(self.pending) if machine is None else [machine]
+            batches = {key: self.pending.pop(key) for key in machines if key in self.pending}
+            for key in batches:
+                self.pending_since.pop(key, None)
+                self.pending_count.pop(key, None)
+
+        for key, parts in batches.items():
+            records = np.concatenate(parts)
+            self.write(key, records[np.argsort(records["timestamp"], kind='stable')])
+
+    def write(self, machine, records):
+        """
+        Write sorted records at the end of the last segment of the machine, new segments are started when
+        it is full or the records are older than its last record. Manifest is written last.
+        """
+        folder = self.machine_folder(machine)
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self.read_manifest(machine)
+            segments = manifest["segments"]
+
+            while records.shape[0]:
+                last = segments[-1] if segments else None
+                if last is None or last["records"] >= SEGMENT_RECORDS or records["timestamp"][0] < last["last"]:
+                    last = dict(name=f"{manifest['next']:06d}", records=0, first=int(records["timestamp"][0]), last=None)
+                    manifest["next"] += 1
+                    segments.append(last)
+
+                part = records[:SEGMENT_RECORDS - last["records"]]
+                records = records[part.shape[0]:]
+                self.write_segment(folder, last, part)
+
+            write_json(manifest, os.path.join(folder, MANIFEST_FILE))
+
+    def write_segment(self, folder, segment, records):
+        """
+        Append records to the .bin and .idx files of a segment (a torn end of an earlier write is cut off first)
+        """
+        start = segment["records"]
+        with open(os.path.join(folder, segment["name"] + ".bin"), 'ab') as f:
+            f.truncate(start * self.dtype.itemsize)
+            f.write(records.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        positions = np.arange(-start % INDEX_EVERY, records.shape[0], INDEX_EVERY)
+        entries = np.column_stack([records["timestamp"][positions], start + positions]).astype(np.int64)
+        with open(os.path.join(folder, segment["name"] + ".idx"), 'ab') as f:
+            f.truncate(-(-start // INDEX_EVERY) * 16)
+            f.write(entries.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+        segment["records"] = start + records.shape[0]
+        segment["last"] = int(records["timestamp"][-1])
+
+    def open_segment(self, folder, segment):
+        """
+        Return (memory-mapped records, sparse index) of a segment
+        """
+        data = np.memmap(os.path.join(folder, segment["name"] + ".bin"), dtype=self.dtype, mode='r', shape=(segment["records"],))
+        index = np.fromfile(os.path.join(folder, segment["name"] + ".idx"), dtype=np.int64)
+        index = index[: -(-segment["records"] // INDEX_EVERY) * 2].reshape(-1, 2)
+        return data, index
+
+    def locate(self, data, index, timestamp, side):
+        """
+        Return position of timestamp in a segment (like np.searchsorted) - binary search on the sparse index
+        finds the block, then only the block is searched
+        """
+        block = np.searchsorted(index[:, 0], timestamp, side=side)
+        low = 0 if block == 0 else int(index[block - 1, 1])
+        high = data.shape[0] if block == index.shape[0] else int(index[block, 1])
+        return low + int(np.searchsorted(data["timestamp"][low:high], timestamp, side=side))
+
+    def read(self, machine, start=None, end=None, lags=0):
+        """
+        Parameters:
+        machine - machine id
+        start, end - datetime range (both inclusive), None for no limit
+        lags(int) - no. of records before start to read too (e.g. for smoothening)
+        Description: Return sorted record array of the range, pending records of this process included
+        """
+        try:
+            return self.read_range(machine, start, end, lags)
+        except FileNotFoundError:
+            return self.read_range(machine, start, end, lags) # Segments were removed by a compaction after the manifest was read
+
+    def read_range(self, machine, start, end, lags):
+        start = None if start is None else int(pd.Timestamp(start).value)
+        end = None if end is None else int(pd.Timestamp(end).value)
+        folder = self.machine_folder(machine)
+        segments = self.read_manifest(machine)["segments"]
+        sorted_segments = all(segments[i]["first"] >= segments[i-1]["last"] for i in range(1, len(segments)))
+
+        parts = []
+        for number, segment in enumerate(segments):
+            if segment["records"] == 0 or (end is not None and segment["first"] > end):
+                continue
+            if start is not None and segment["last"] < start and not lags:
+                continue
+            data, index = self.open_segment(folder, segment)
+            low = 0 if start is None else self.locate(data, index, start, 'left')
+            high = data.shape[0] if end is None else self.locate(data, index, end, 'right')
+            parts.append((number, data, low, high))
+
+        if lags and start is not None:
+            if sorted_segments:
+                parts = self.with_lags(parts, lags)
+            else:
+                parts = [(number, data, 0, high) for number, data, _, high in parts] # Overlapping segments - lags are cut after sorting
+
+        records = [np.array(data[low:high]) for _, data, low, high in parts if high > low]
+        with self.lock:
+            records += [part for part in self.pending.get(machine, [])]
+        records = np.concatenate(records) if records else np.zeros(0, dtype=self.dtype)
+
+        records = records[np.argsort(records["timestamp"], kind='stable')]
+        first = 0 if start is None else int(np.searchsorted(records["timestamp"], start, side='left'))
+        last = records.shape[0] if end is None else int(np.searchsorted(records["timestamp"], end, side='right'))
+        return records[max(first - lags, 0) : last]
+
+    def with_lags(self, parts, lags):
+        """
+        Move the start of the range back by lags records over sorted segments
+        """
+        moved = []
+        for number, data, low, high in reversed(parts):
+            take = min(lags, low)
+            lags -= take
+            moved.append((number, data, low - take, high))
+        return list(reversed(moved))
+
+    def query(self, machine, start=None, end=None, lags=0):
+        """
+        Parameters: same as read
+        Description:
+        Return pd dataframe with timestamp index - raw features, smoothened features (smoothed_<feature>), label and score
+        """
+        records = self.read(machine, start, end, lags)
+        columns = {feature: records["raw"][:, i] for i, feature in enumerate(self.features)}
+        columns.update({f"smoothed_{feature}": records["smoothed"][:, i] for i, feature in enumerate(self.features)})
+        columns.update(label=records["label"], score=records["score"])
+        index = pd.DatetimeIndex(records["timestamp"].astype('datetime64[ns]'), name='timestamp')
+        return pd.DataFrame(columns, index=index)
+
+    def frame(self, machine, start=None, end=None, lags=0):
+        """
+        Return the raw features and the label as 'status' - same shape as load_processed
+        """
+        records = self.read(machine, start, end, lags)
+        columns = {feature: records["raw"][:, i] for i, feature in enumerate(self.features)}
+        columns["status"] = records["label"]
+        index = pd.DatetimeIndex(records["timestamp"].astype('datetime64[ns]'), name='timestamp')
+        return pd.DataFrame(columns, index=index)
+
+    def last_timestamp(self, machine):
+        """
+        Return the ns timestamp of the newest written record of the machine, None if it has no records
+        """
+        segments = [segment for segment in self.read_manifest(machine)["segments"] if segment["records"]]
+        return max(segment["last"] for segment in segments) if segments else None
+
+    def compact(self, machine, retention=None):
+        """
+        Parameters:
+        machine - machine id
+        retention - records older than this (pd.Timedelta before the newest record) are dropped, None to keep all
+        Description:
+        Merge all the segments into new sorted full segments, manifest is switched to them before
+        the old files are removed (readers having the old files mapped are not affected).
+        Nothing is written if the segments are already sorted and full and no record is out of the retention.
+        """
+        self.flush(machine)
+        folder = self.machine_folder(machine)
+        if not os.path.exists(folder):
+            return
+        with open(os.path.join(folder, "lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self.read_manifest(machine)
+            old = manifest["segments"]
+            if not self.needs_compaction(old, retention):
+                return
+
+            records = [np.array(self.open_segment(folder, segment)[0]) for segment in old if segment["records"]]
+            records = np.concatenate(records) if records else np.zeros(0, dtype=self.dtype)
+            records = records[np.argsort(records["timestamp"], kind='stable')]
+            if retention is not None and records.shape[0]:
+                records = records[records["timestamp"] >= records["timestamp"][-1] - pd.Timedelta(retention).value]
+
+            manifest["segments"] = []
+            for start in range(0, records.shape[0], SEGMENT_RECORDS):
+                part = records[start : start + SEGMENT_RECORDS]
+                segment = dict(name=f"{manifest['next']:06d}", records=0, first=int(part["timestamp"][0]), last=None)
+                manifest["next"] += 1
+                self.write_segment(folder, segment, part)
+                manifest["segments"].append(segment)
+            write_json(manifest, os.path.join(folder, MANIFEST_FILE))
+
+            for segment in old:
+                for extension in (".bin", ".idx"):
+                    path = os.path.join(folder, segment["name"] + extension)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def needs_compaction(self, segments, retention=None):
+        """
+        Return True if the segments are empty, overlapping or not full (except the last one), or the oldest record
+        is out of the retention
+        """
+        if not segments:
+            return False
+        if any(not segment["records"] for segment in segments):
+            return True
+        if any(segment["records"] < SEGMENT_RECORDS for segment in segments[:-1]):
+            return True
+        if any(after["first"] < before["last"] for before, after in zip(segments[:-1], segments[1:])):
+            return True
+        newest = max(segment["last"] for segment in segments)
+        return retention is not None and segments[0]["first"] < newest - pd.Timedelta(retention).value
+
+    def compact_all(self, retention=None):
+        """
+        Compact every machine, retention is not applied to the training data (DATASET_MACHINE).
+        Machines whose newest record is older than the retention (e.g. closed dashboards) are removed.
+        """
+        oldest = pd.Timestamp.now().value - pd.Timedelta(retention).value if retention is not None else None
+        for machine in self.machines():
+            if machine == DATASET_MACHINE:
+                self.compact(machine)
+                continue
+            last = self.last_timestamp(machine)
+            if oldest is not None and (last is None or last < oldest):
+                self.remove(machine)
+            else:
+                self.compact(machine, retention)
+
+    def remove(self, machine):
+        """
+        Remove the machine with its folder (e.g. the session of a closed dashboard)
+        """
+        self.drop(machine)
+        shutil.rmtree(self.machine_folder(machine), ignore_errors=True)
+
+    def drop(self, machine):
+        """
+        Remove all the records of the machine
+        """
+        with self.lock:
+            self.pending.pop(machine, None)
+            self.pending_since.pop(machine, None)
+            self.pending_count.pop(machine, None)
+        folder = self.machine_folder(machine)
+        if not os.path.exists(folder):
+            return
+        with open(os.path.join(folder, "lock"), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self.read_manifest(machine)
+            write_json({"segments": [], "next": manifest["next"]}, os.path.join(folder, MANIFEST_FILE))
+            for segment in manifest["segments"]:
+                for extension in (".bin", ".idx"):
+                    path = os.path.join(folder, segment["name"] + extension)
+                    if os.path.exists(path):
+                        os.remove(path)
+
+
+def load_dataset(start=None, end=None, lags=0, folder=TIMESERIES_STORE):
+    """
+    Parameters:
+    start, end - datetime range (both inclusive), None for no limit
+    lags(int) - no. of rows before start to read too
+    folder(str) - folder of the store
+    Description:
+    Return the preprocessed training data of the range (features and 'status', same as load_processed) from the
+    time-series store. The processed cache is read if the store has no training data yet.
+    """
+    if os.path.exists(os.path.join(folder, META_FILE)):
+        store = TimeSeriesStore(folder)
+        if store.last_timestamp(DATASET_MACHINE) is not None:
+            return store.frame(DATASET_MACHINE, start, end, lags)
+
+    if lags and start is not None:
+        timestamps = load_timestamps()
+        position = int(np.searchsorted(timestamps, pd.Timestamp(start).value, side='left'))
+        start = pd.Timestamp(int(timestamps[max(min(position, timestamps.shape[0] - 1) - lags, 0)])) if timestamps.shape[0] else start
+    return load_processed(start, end)
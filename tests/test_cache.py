@@ -0,0 +1,88 @@
+import os
+import json
+import numpy as np
+import pandas as pd
+import pytest
+from preprocessing.cache import write_cache, append_cache, compact_cache, load_processed, load_timestamps, read_meta
+
+
+def processed(n, start="2024-01-01", seed=0):
+    rng = np.random.default_rng(seed)
+    index = pd.DatetimeIndex(pd.date_range(start, periods=n, freq="min").values.astype("datetime64[ns]"), name="timestamp")
+    data = pd.DataFrame(rng.normal(size=(n, 3)).astype(np.float32), index=index, columns=["a", "b", "c"])
+    data["status"] = (rng.random(n) < 0.1).astype(np.int8)
+    return data
+
+
+def assert_same(loaded, expected):
+    assert list(loaded.columns) == list(expected.columns)
+    assert np.array_equal(loaded.index.values, expected.index.values)
+    assert np.array_equal(loaded.values, expected.values)
+
+
+def test_write_and_load_round_trip(tmp_path):
+    data = processed(500)
+    write_cache(data.sample(frac=1, random_state=0), str(tmp_path)) # Rows are sorted on write
+    assert_same(load_processed(folder=str(tmp_path)), data)
+    assert np.array_equal(load_timestamps(str(tmp_path)), data.index.values.astype(np.int64))
+    assert read_meta(str(tmp_path))["rows"] == 500
+
+
+def test_load_date_range(tmp_path):
+    data = processed(500)
+    write_cache(data, str(tmp_path))
+    start, end = data.index[100], data.index[250]
+    assert_same(load_processed(start, end, folder=str(tmp_path)), data.loc[start:end])
+    assert_same(load_processed(start_date=end, folder=str(tmp_path)), data.loc[end:])
+    assert load_processed("2030-01-01", folder=str(tmp_path)).shape[0] == 0
+
+
+def test_append_adds_segments(tmp_path):
+    data = processed(500)
+    write_cache(data.iloc[:200], str(tmp_path))
+    append_cache(data.iloc[200:350], str(tmp_path))
+    append_cache(data.iloc[350:], str(tmp_path))
+    append_cache(data.iloc[:0], str(tmp_path)) # Nothing to append
+
+    meta = read_meta(str(tmp_path))
+    assert meta["segments"] == [200, 150, 150]
+    assert meta["last_timestamp"] == data.index[-1].value
+    assert_same(load_processed(folder=str(tmp_path)), data)
+    assert_same(load_processed(data.index[150], data.index[400], folder=str(tmp_path)), data.loc[data.index[150]:data.index[400]])
+
+
+def test_append_of_older_rows(tmp_path):
+    data = processed(500)
+    write_cache(data.iloc[100:], str(tmp_path))
+    with pytest.raises(ValueError):
+        append_cache(data.iloc[:100], str(tmp_path))
+
+    append_cache(data.iloc[:100], str(tmp_path), allow_overlap=True)
+    meta = read_meta(str(tmp_path))
+    assert meta["sorted"] is False
+    assert meta["last_timestamp"] == data.index[-1].value
+
+    compact_cache(str(tmp_path))
+    meta = read_meta(str(tmp_path))
+    assert meta["segments"] == [500] and "sorted" not in meta
+    assert_same(load_processed(folder=str(tmp_path)), data)
+    assert not os.path.exists(os.path.join(str(tmp_path), "timestamp.1.npy"))
+
+
+def test_compaction_caps_the_segments_and_keeps_meta(tmp_path):
+    data = processed(500)
+    write_cache(data.iloc[:100], str(tmp_path))
+    meta = read_meta(str(tmp_path))
+    meta["raw_offset"] = 1234
+    with open(os.path.join(str(tmp_path), "meta.json"), "w") as f:
+        json.dump(meta, f)
+    for start in range(100, 500, 100):
+        append_cache(data.iloc[start : start + 100], str(tmp_path))
+
+    compact_cache(str(tmp_path), max_segments=8) # Sorted and few segments - nothing to do
+    assert len(read_meta(str(tmp_path))["segments"]) == 5
+
+    compact_cache(str(tmp_path), max_segments=4)
+    meta = read_meta(str(tmp_path))
+    assert meta["segments"] == [500] and meta["raw_offset"] == 1234
+    assert_same(load_processed(folder=str(tmp_path)), data)
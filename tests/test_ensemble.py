@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from training.clustering import Clustering
+from training.isolation_forest import Isolation
+from training.ensemble import Ensemble, EnsemblePredictor
+from tests.test_streaming import FEATURES, readings, fitted
+
+
+pytestmark = pytest.mark.filterwarnings("ignore:X does not have valid feature names")
+
+
+class WindowModel:
+    """
+    Stand-in for a model scoring the raw last window (like MatrixProfiling) - fault when the mean of 'a' is above 1.5
+    """
+    window = 4
+
+    def predict(self, X):
+        if X.shape[0] < self.window:
+            return -1
+        return int(X["a"].values[-self.window:].mean() > 1.5)
+
+
+@pytest.fixture(scope="module")
+def models():
+    return {
+        "clustering": fitted(Clustering(rolling_window=5, method="sma", test_ratio=0.2)),
+        "clustering_ewm": fitted(Clustering(rolling_window=5, method="ewm", test_ratio=0.2)),
+        "isolation": fitted(Isolation(rolling_window=5, method="sma", test_ratio=0.2, contamination=0.2, max_features=1.0)),
+        "window": WindowModel(),
+    }
+
+
+def test_ensemble_predictor_matches_predict(models):
+    ensemble = Ensemble(models)
+    data = readings(120, seed=4)[FEATURES]
+    history = 30
+    predictor = EnsemblePredictor(ensemble, history=history, features=FEATURES)
+    for i in range(data.shape[0]):
+        combined, outputs = ensemble.predict(data.iloc[max(0, i + 1 - history) : i + 1])
+        assert predictor.update(data.iloc[i]) == combined
+        assert predictor.outputs == outputs
+
+
+def test_ensemble_matches_the_models(models):
+    ensemble = Ensemble(models)
+    queue = readings(60, seed=5)[FEATURES]
+    _, outputs = ensemble.predict(queue)
+    assert outputs == {name: model.predict(queue) for name, model in models.items()}
+
+
+def test_combine():
+    ensemble = Ensemble({"a": None, "b": None, "c": None}, voting="majority")
+    assert ensemble.combine({"a": 1, "b": 1, "c": 0}) == 1
+    assert ensemble.combine({"a": 1, "b": 0, "c": -1}) == 0 # Models without data do not vote
+    assert ensemble.combine({"a": -1, "b": -1, "c": -1}) == -1
+    assert Ensemble({"a": None, "b": None}, voting="any").combine({"a": 1, "b": 0}) == 1
+    assert Ensemble({"a": None, "b": None}, voting="all").combine({"a": 1, "b": 0}) == 0
+    weighted = Ensemble({"a": None, "b": None}, voting="weighted", weights={"a": 3.0, "b": 1.0}, threshold=0.7)
+    assert weighted.combine({"a": 1, "b": 0}) == 1
+    assert weighted.combine({"a": 0, "b": 1}) == 0
+    with pytest.raises(ValueError):
+        Ensemble({}, voting="unknown")
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+from serving.fleet import FleetBuffer
+
+
+@pytest.mark.parametrize("dtype", [np.float64, np.float32])
+def test_smoothed_matches_pandas_on_every_window(dtype):
+    rng = np.random.default_rng(0)
+    n_machines, window = 6, 20
+    buffer = FleetBuffer(n_machines, window, ["a", "b"], dtype=dtype)
+    history = [[] for _ in range(n_machines)]
+    for tick in range(120):
+        if tick == 30:
+            buffer.smoothed(4, "ewm") # Running state made from the windows in the middle of the stream
+        if tick == 70:
+            buffer.reset([2])
+            history[2] = []
+        machines = rng.choice(n_machines, size=rng.integers(1, n_machines + 1), replace=False)
+        values = rng.normal(size=(machines.shape[0], 2)).astype(dtype)
+        buffer.update(values, machines)
+        for machine, row in zip(machines, values):
+            history[machine].append(row)
+
+        for rolling_window, method in [(4, "ewm"), (5, "sma"), (9, "ewm")]:
+            smoothed = buffer.smoothed(rolling_window, method)
+            for machine in range(n_machines):
+                if len(history[machine]) < rolling_window:
+                    assert np.isnan(smoothed[machine]).all()
+                    continue
+                queue = pd.DataFrame(np.array(history[machine][-window:], dtype=np.float64))
+                smoothen = queue.rolling(rolling_window) if method == "sma" else queue.ewm(com=rolling_window)
+                assert np.allclose(smoothed[machine], smoothen.mean().values[-1])
@@ -0,0 +1,96 @@
+import numpy as np
+import pytest
+from ingestion.pipeline import IngestionPipeline, FleetSink
+from ingestion.sources import parse_rows
+from serving.api import FleetService
+
+
+class ThresholdModel:
+    """
+    Stand-in for a trained model - fault when the smoothened first feature is above 0.5
+    """
+    feature_names = ["a", "b"]
+    rolling_window = 2
+    method = "sma"
+
+    def predict_smoothed(self, X):
+        return (X[:, 0] > 0.5).astype(np.int64)
+
+    def score_smoothed(self, X):
+        return X[:, 0]
+
+
+def batch(machines):
+    machines = np.asarray(machines)
+    timestamps = np.arange(machines.shape[0]).astype("datetime64[s]").astype("datetime64[ns]")
+    return machines, np.ones((machines.shape[0], 2)), timestamps
+
+
+def queued(pipeline):
+    return [int(item[0][0]) for item in list(pipeline.queue.queue)]
+
+
+def test_drop_oldest_keeps_the_latest_batches():
+    pipeline = IngestionPipeline(lambda *batch: None, maxsize=2, policy="drop_oldest")
+    for machine in range(4):
+        pipeline.emit(*batch([machine, machine]))
+    assert queued(pipeline) == [2, 3]
+    assert pipeline.get_stats()["dropped"] == 4
+    assert pipeline.get_stats()["received"] == 8
+
+
+def test_drop_newest_keeps_the_first_batches():
+    pipeline = IngestionPipeline(lambda *batch: None, maxsize=2, policy="drop_newest")
+    for machine in range(4):
+        pipeline.emit(*batch([machine]))
+    assert queued(pipeline) == [0, 1]
+    assert pipeline.get_stats()["dropped"] == 2
+
+
+def test_block_loses_nothing():
+    seen = []
+    pipeline = IngestionPipeline(lambda machines, values, timestamps: seen.extend(machines.tolist()), maxsize=1, policy="block")
+    pipeline.start()
+    for machine in range(50):
+        pipeline.emit(*batch([machine]))
+    stats = pipeline.stop()
+    assert sorted(seen) == list(range(50))
+    assert stats["processed"] == 50 and stats["dropped"] == 0
+
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        IngestionPipeline(lambda *batch: None, policy="drop_all")
+
+
+def test_rejected_and_failed_readings_are_counted_once():
+    service = FleetService({"clustering": ThresholdModel()}, n_machines=3, window=10)
+    sink = FleetSink(service)
+    pipeline = IngestionPipeline(sink)
+
+    pipeline.start()
+    pipeline.emit(*batch([0, 1, 5, 9]))
+    pipeline.emit(*batch([7, 8])) # Every reading rejected
+    stats = pipeline.stop()
+    assert (stats["processed"], stats["errors"], stats["failed"]) == (2, 4, 0)
+
+    def fail(*args):
+        raise RuntimeError("scoring failed")
+    service.ingest = fail
+    pipeline.start()
+    pipeline.emit(*batch([0, 1, 5]))
+    stats = pipeline.stop()
+    assert (stats["processed"], stats["errors"], stats["failed"]) == (2, 5, 2)
+
+
+def test_fleet_sink_keeps_the_latest_label_of_every_machine():
+    service = FleetService({"clustering": ThresholdModel()}, n_machines=3, window=10)
+    sink = FleetSink(service)
+    sink(*batch([0, 0, 1]))
+    assert sink.labels.tolist() == [1, -1, -1] # Machine 1 has one reading, less than the rolling window
+
+
+def test_parse_rows_drops_bad_lines():
+    values, bad = parse_rows(["1,2", "3,x", "4", "", "5,6,7", " 8 , 9 "], 2)
+    assert values.tolist() == [[1.0, 2.0], [8.0, 9.0]]
+    assert bad == 3
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from training.clustering import Clustering
+from training.isolation_forest import Isolation
+from training.ensemble import Ensemble
+from training.streaming import StreamingPredictor
+from tests.test_streaming import FEATURES, readings, fitted
+
+
+pytestmark = pytest.mark.filterwarnings("ignore:X does not have valid feature names")
+
+
+@pytest.fixture(scope="module")
+def models():
+    return {
+        "clustering": fitted(Clustering(rolling_window=5, method="ewm", test_ratio=0.2)),
+        "isolation": fitted(Isolation(rolling_window=6, method="sma", test_ratio=0.2, contamination=0.2, max_features=1.0)),
+    }
+
+
+def test_batch_scores_match_the_stream(models):
+    data = readings(200, seed=6)[FEATURES]
+    for model in models.values():
+        scores = model.score(data)
+        assert scores.index.equals(data.index)
+        assert np.isnan(scores.values[: model.rolling_window - 1]).all()
+
+        predictor = StreamingPredictor(model)
+        streamed = []
+        for i in range(data.shape[0]):
+            predictor.update(data.iloc[i])
+            streamed.append(predictor.latest()[1])
+        assert np.allclose(scores.values, streamed, equal_nan=True)
+
+
+def test_scores_threshold_to_predictions(models):
+    data = readings(200, seed=7)[FEATURES]
+    thresholds = {"clustering": 0.5, "isolation": 0.0}
+    for name, model in models.items():
+        scores = model.score(data).values
+        for i in range(model.rolling_window - 1, data.shape[0]):
+            assert int(scores[i] > thresholds[name]) == model.predict(data.iloc[: i + 1])
+
+
+def test_ensemble_scores_match_the_models(models):
+    data = readings(200, seed=8)[FEATURES]
+    scores = Ensemble(models).score(data)
+    for name, model in models.items():
+        assert np.allclose(scores[name].values, model.score(data).values, equal_nan=True)
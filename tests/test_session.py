@@ -0,0 +1,97 @@
+import threading
+import numpy as np
+import pytest
+import serving.session as session_module
+from serving.session import SessionStore, RedisSessionStore, dumps, loads
+
+
+COLUMNS = ["a", "b"]
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(session_module.time, "monotonic", clock)
+    return clock
+
+
+def test_session_is_kept_between_calls(clock):
+    store = SessionStore(10, COLUMNS)
+    session = store.get("s1")
+    session.healthy_index = 42
+    store.save("s1", session)
+    assert store.get("s1").healthy_index == 42
+
+
+def test_expired_session_is_new_and_evicted(clock):
+    evicted = []
+    store = SessionStore(10, COLUMNS, ttl=60, on_evict=evicted.append)
+    store.get("s1").healthy_index = 42
+    store.get("s2")
+
+    clock.now += 30
+    store.get("s2") # s1 is still within the TTL
+    assert evicted == [] and len(store) == 2
+
+    clock.now += 40
+    assert store.get("s1").healthy_index != 42
+    assert evicted == ["s1"]
+
+    clock.now += 61
+    store.get("s3")
+    assert sorted(evicted) == ["s1", "s1", "s2"]
+    assert len(store) == 1
+
+
+def test_least_recently_used_sessions_are_evicted(clock):
+    evicted = []
+    store = SessionStore(10, COLUMNS, max_sessions=2, on_evict=evicted.append)
+    for key in ("s1", "s2"):
+        store.get(key)
+    store.save("s1", store.get("s1")) # s2 is now the least recently used
+    store.get("s3")
+    assert evicted == ["s2"]
+    assert len(store) == 2
+
+
+def test_remove_notifies(clock):
+    evicted = []
+    store = SessionStore(10, COLUMNS, on_evict=evicted.append)
+    store.get("s1")
+    store.remove("s1")
+    store.remove("unknown")
+    assert evicted == ["s1"] and len(store) == 0
+
+
+def test_pickled_fields_keep_shared_objects_and_make_new_locks():
+    model = object()
+    value = dict(model=model, lock=threading.Lock(), values=np.arange(3))
+    loaded = loads(dumps(value, {"clustering": model}), {"clustering": model})
+    assert loaded["model"] is model
+    assert isinstance(loaded["lock"], type(threading.Lock()))
+    assert loaded["values"].tolist() == [0, 1, 2]
+
+
+def test_redis_store_saves_and_loads_only_the_given_fields():
+    pytest.importorskip("redis")
+    fakeredis = pytest.importorskip("fakeredis")
+    store = RedisSessionStore(10, COLUMNS, "redis://localhost:6379/0", ttl=60)
+    store.client = fakeredis.FakeRedis()
+
+    session = store.get("s1")
+    session.healthy_index, session.fault_index = 5, 7
+    store.save("s1", session, "healthy_index")
+
+    loaded = store.get("s1", "healthy_index", "fault_index")
+    assert (loaded.healthy_index, loaded.fault_index) == (5, -1)
+    assert 0 < store.client.ttl("session:s1") <= 60
+    store.remove("s1")
+    assert len(store) == 0
@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+from training.clustering import Clustering
+from training.isolation_forest import Isolation
+from training.features import smoothen
+from training.streaming import RunningSmoother, StreamingPredictor
+
+
+FEATURES = ["a", "b", "c"]
+
+# Models are fitted on frames and scored on arrays of smoothened rows
+pytestmark = pytest.mark.filterwarnings("ignore:X does not have valid feature names")
+
+
+def readings(n, seed=0):
+    """
+    Healthy readings around 0 with faulty stretches shifted by 3, 'status' is 1 on the faulty rows
+    """
+    rng = np.random.default_rng(seed)
+    status = ((np.arange(n) // 50) % 5 == 4).astype(np.int64)
+    values = rng.normal(size=(n, len(FEATURES))) + 3 * status[:, np.newaxis]
+    index = pd.DatetimeIndex(pd.date_range("2024-01-01", periods=n, freq="s"), name="timestamp")
+    data = pd.DataFrame(values, index=index, columns=FEATURES)
+    data["status"] = status
+    return data
+
+
+def fitted(model):
+    X, y = smoothen(readings(2000), model.rolling_window, model.method)
+    model.fit_features(X, y)
+    return model
+
+
+@pytest.fixture(scope="module")
+def models():
+    return [
+        fitted(Clustering(rolling_window=5, method="sma", test_ratio=0.2)),
+        fitted(Clustering(rolling_window=8, method="ewm", test_ratio=0.2)),
+        fitted(Isolation(rolling_window=5, method="ewm", test_ratio=0.2, contamination=0.2, max_features=1.0)),
+    ]
+
+
+@pytest.mark.parametrize("method", ["sma", "ewm"])
+@pytest.mark.parametrize("history", [None, 40])
+def test_running_smoother_matches_batch_smoothing(method, history):
+    data = readings(300, seed=1)[FEATURES]
+    smoother = RunningSmoother(len(FEATURES), 6, method, history)
+    for i in range(data.shape[0]):
+        smoother.update(data.values[i])
+        window = data.iloc[: i + 1] if history is None else data.iloc[max(0, i + 1 - history) : i + 1]
+        expected = smoothen(window, 6, method, dropna=False)[0].values[-1]
+        if i + 1 < 6 and method == "sma":
+            assert np.isnan(smoother.value()).all()
+        else:
+            assert np.allclose(smoother.value(), expected)
+
+
+def test_streaming_predictor_matches_predict(models):
+    data = readings(250, seed=2)[FEATURES]
+    history = 50
+    for model in models:
+        predictor = StreamingPredictor(model, history=history)
+        for i in range(data.shape[0]):
+            queue = data.iloc[max(0, i + 1 - history) : i + 1]
+            assert predictor.update(data.iloc[i]) == model.predict(queue)
+
+
+def test_warm_up_matches_the_stream(models):
+    data = readings(150, seed=3)[FEATURES]
+    for model in models:
+        streamed = StreamingPredictor(model)
+        for i in range(data.shape[0]):
+            last = streamed.update(data.iloc[i])
+        assert StreamingPredictor(model).warm_up(data) == last
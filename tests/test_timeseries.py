@@ -0,0 +1,144 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import storage.timeseries as timeseries
+from storage.timeseries import TimeSeriesStore
+
+
+FEATURES = ["a", "b"]
+
+
+def readings(n, start="2024-01-01", seed=0):
+    rng = np.random.default_rng(seed)
+    timestamps = pd.date_range(start, periods=n, freq="s").values.astype("datetime64[ns]")
+    return timestamps, rng.normal(size=(n, len(FEATURES))).astype(np.float32)
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # Small segments and index blocks so that a few thousand readings cross their boundaries
+    monkeypatch.setattr(timeseries, "SEGMENT_RECORDS", 1000)
+    monkeypatch.setattr(timeseries, "INDEX_EVERY", 64)
+    return TimeSeriesStore(str(tmp_path / "store"), FEATURES, flush_records=10**9, flush_seconds=10**9)
+
+
+def test_append_flush_read_round_trip(store):
+    timestamps, raw = readings(2500)
+    store.append("m1", timestamps, raw, labels=np.zeros(2500, dtype=np.int64), scores=np.arange(2500))
+    store.flush()
+
+    records = store.read("m1")
+    assert np.array_equal(records["timestamp"], timestamps.astype(np.int64))
+    assert np.array_equal(records["raw"], raw)
+    assert np.array_equal(records["score"], np.arange(2500, dtype=np.float32))
+    assert [segment["records"] for segment in store.read_manifest("m1")["segments"]] == [1000, 1000, 500]
+
+
+def test_pending_records_are_read_before_flush(store):
+    timestamps, raw = readings(10)
+    store.append("m1", timestamps, raw)
+    assert store.read("m1").shape[0] == 10
+    assert store.read_manifest("m1")["segments"] == []
+
+
+def test_range_query_with_lags(store):
+    timestamps, raw = readings(2500)
+    store.append("m1", timestamps, raw)
+    store.flush()
+
+    start, end = pd.Timestamp(timestamps[1234]), pd.Timestamp(timestamps[2100])
+    frame = store.query("m1", start, end)
+    assert frame.index[0] == start and frame.index[-1] == end # Both ends inclusive
+    assert frame.shape[0] == 2100 - 1234 + 1
+    assert np.array_equal(frame[FEATURES].values, raw[1234:2101])
+
+    lagged = store.read("m1", start, end, lags=300)
+    assert lagged["timestamp"][0] == timestamps[934].astype(np.int64)
+    assert store.read("m1", start, end, lags=5000).shape[0] == 2101
+
+
+def test_empty_batches(store):
+    store.append_many(np.array([], dtype=np.int64), np.array([], dtype="datetime64[ns]"), np.zeros((0, 2)))
+    store.flush()
+    assert store.machines() == []
+    assert store.read("m1").shape[0] == 0
+    assert store.last_timestamp("m1") is None
+
+
+def test_append_many_splits_by_machine(store):
+    timestamps, raw = readings(6)
+    store.append_many(np.array([1, 2, 1, 3, 2, 1]), timestamps, raw)
+    store.flush()
+    assert store.machines() == ["1", "2", "3"]
+    assert np.array_equal(store.read(1)["raw"], raw[[0, 2, 5]])
+    assert np.array_equal(store.read(2)["raw"], raw[[1, 4]])
+
+
+def test_out_of_order_records_are_read_sorted_and_compacted(store):
+    timestamps, raw = readings(1500)
+    store.append("m1", timestamps[500:], raw[500:])
+    store.flush()
+    store.append("m1", timestamps[:500], raw[:500]) # Older than the last written record
+    store.flush()
+
+    segments = store.read_manifest("m1")["segments"]
+    assert store.needs_compaction(segments)
+    assert np.array_equal(store.read("m1")["raw"], raw)
+    assert np.array_equal(store.read("m1", timestamps[400], timestamps[600], lags=10)["raw"], raw[390:601])
+
+    store.compact("m1")
+    segments = store.read_manifest("m1")["segments"]
+    assert [segment["records"] for segment in segments] == [1000, 500]
+    assert not store.needs_compaction(segments)
+    assert np.array_equal(store.read("m1")["raw"], raw)
+    assert sorted(name for name in os.listdir(store.machine_folder("m1")) if name.endswith(".bin")) == \
+        sorted(segment["name"] + ".bin" for segment in segments)
+
+
+def test_compaction_is_skipped_for_sorted_segments(store):
+    timestamps, raw = readings(1500)
+    store.append("m1", timestamps, raw)
+    store.flush()
+    before = store.read_manifest("m1")
+    store.compact("m1")
+    assert store.read_manifest("m1") == before
+
+
+def test_compaction_drops_records_out_of_retention(store):
+    timestamps, raw = readings(1500)
+    store.append("m1", timestamps, raw)
+    store.flush()
+    store.compact("m1", retention=pd.Timedelta(seconds=99))
+    records = store.read("m1")
+    assert records.shape[0] == 100
+    assert np.array_equal(records["raw"], raw[-100:])
+
+
+def test_compact_all_removes_stale_machines(store):
+    old_timestamps, raw = readings(10, start="2000-01-01")
+    new_timestamps, _ = readings(10, start=pd.Timestamp.now().floor("s"))
+    store.append("stale", old_timestamps, raw)
+    store.append("live", new_timestamps, raw)
+    store.append(timeseries.DATASET_MACHINE, old_timestamps, raw)
+    store.flush()
+
+    store.compact_all(retention=pd.Timedelta(days=1))
+    assert store.machines() == sorted(["live", timeseries.DATASET_MACHINE])
+    assert store.read(timeseries.DATASET_MACHINE).shape[0] == 10 # Retention is not applied to the training data
+
+
+def test_remove_machine(store):
+    timestamps, raw = readings(10)
+    store.append("m1", timestamps, raw)
+    store.flush()
+    store.remove("m1")
+    assert store.machines() == []
+    assert store.read("m1").shape[0] == 0
+
+
+def test_features_are_read_from_an_existing_store(store):
+    reopened = TimeSeriesStore(store.folder)
+    assert reopened.features == FEATURES
+    with pytest.raises(ValueError):
+        TimeSeriesStore(store.folder, ["x"])
@@ -0,0 +1,305 @@
+import threading
+import pickle
+import numpy as np
+import pandas as pd
+import time
+from training.features import smoothen, score_series
+from training.matrix_profile import MatrixProfiling
+from metrics.metrics import MODEL_LOAD_SECONDS
+
+
+SCHEMA_VERSION = 1
+
+
+def average_path_length(n_samples):
+    """
+    Average path length of an unsuccessful search in a binary tree of n_samples (same as sklearn IsolationForest)
+    """
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    length = np.zeros(n_samples.shape)
+    length[n_samples == 2] = 1.0
+    more = n_samples > 2
+    length[more] = 2.0 * (np.log(n_samples[more] - 1.0) + np.euler_gamma) - 2.0 * (n_samples[more] - 1.0) / n_samples[more]
+    return length
+
+
+def save_artifact(model, path):
+    """
+    Parameters:
+    model - trained Clustering, Isolation or MatrixProfiling model
+    path(str) - path of the .npz file
+    Description:
+    Save only the state needed for inference as plain NumPy arrays with the schema version and feature list -
+    1. Clustering - scaler mean and scale, cluster centres
+    2. Isolation - all trees flattened in one set of node arrays
+    3. MatrixProfiling - cutoffs and the fault reference series
+    """
+    arrays = dict(schema_version=np.array(SCHEMA_VERSION))
+    if getattr(model, 'trained_until', None) is not None:
+        arrays.update(trained_until=np.array(model.trained_until, dtype=np.int64)) # Training watermark
+
+    if isinstance(model, MatrixProfiling):
+        features = list(model.profile_cutoffs.keys())
+        arrays.update(
+            kind=np.array("profile"),
+            features=np.array(features),
+            window=np.array(model.window),
+            cutoffs=np.array([model.profile_cutoffs[feature] for feature in features], dtype=np.float64),
+            faulty=model.faulty[features].values.astype(np.float64),
+        )
+
+    elif hasattr(model, 'cluster'):
+        arrays.update(
+            kind=np.array("clustering"),
+            features=np.array(model.feature_names),
+            rolling_window=np.array(model.rolling_window),
+            method=np.array(model.method),
+            mean=model.scaler.mean_,
+            scale=model.scaler.scale_,
+            centers=model.cluster.cluster_centers_,
+            invert_label=np.array(model.invert_label),
+        )
+
+    else:
+        forest = model.model
+        roots, left, right, feature, threshold, n_samples = [], [], [], [], [], []
+        offset = 0
+        for tree, features in zip(forest.estimators_, forest.estimators_features_):
+            nodes = tree.tree_
+            is_leaf = nodes.children_left == -1
+            roots.append(offset)
+            left.append(np.where(is_leaf, -1, nodes.children_left + offset))
+            right.append(np.where(is_leaf, -1, nodes.children_right + offset))
+            feature.append(np.where(is_leaf, 0, np.asarray(features)[np.maximum(nodes.feature, 0)]))
+            threshold.append(nodes.threshold)
+            n_samples.append(nodes.n_node_samples)
+            offset += nodes.node_count
+
+        arrays.update(
+            kind=np.array("isolation"),
+            features=np.array(model.feature_names),
+            rolling_window=np.array(model.rolling_window),
+            method=np.array(model.method),
+            roots=np.array(roots, dtype=np.int64),
+            left=np.concatenate(left).astype(np.int64),
+            right=np.concatenate(right).astype(np.int64),
+            feature=np.concatenate(feature).astype(np.int64),
+            threshold=np.concatenate(threshold),
+            n_samples=np.concatenate(n_samples).astype(np.int64),
+            max_depth=np.array(max(tree.tree_.max_depth for tree in forest.estimators_)),
+            max_samples=np.array(forest.max_samples_),
+            offset=np.array(forest.offset_),
+        )
+
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+
+class ClusteringArtifact:
+    """
+    Inference only version of Clustering loaded from an artifact
+    """
+    def __init__(self, arrays):
+        self.features = [str(feature) for feature in arrays['features']]
+        self.rolling_window = int(arrays['rolling_window'])
+        self.method = str(arrays['method'])
+        self.mean = arrays['mean']
+        self.scale = arrays['scale']
+        self.centers = arrays['centers']
+        self.invert_label = bool(arrays['invert_label'])
+        self.trained_until = int(arrays['trained_until']) if 'trained_until' in arrays else None
+
+    @property
+    def feature_names(self):
+        return self.features
+
+    def predict(self, X):
+        """
+        Same as Clustering.predict
+        """
+        if X.shape[0] < self.rolling_window:
+            return -1
+        X, _ = smoothen(X[self.features], self.rolling_window, self.method)
+        return int(self.predict_smoothed(X.iloc[-1:].values)[0])
+
+    def predict_smoothed(self, X):
+        """
+        Same as Clustering.predict_smoothed
+        """
+        X = (np.asarray(X, dtype=float) - self.mean) / self.scale
+        distances = ((X[:, np.newaxis, :] - self.centers[np.newaxis, :, :])**2).sum(axis=2)
+        prediction = distances.argmin(axis=1)
+        return 1 - prediction if self.invert_label else prediction
+
+    def score_smoothed(self, X):
+        """
+        Same as Clustering.score_smoothed
+        """
+        X = (np.asarray(X, dtype=float) - self.mean) / self.scale
+        distances = np.sqrt(((X[:, np.newaxis, :] - self.centers[np.newaxis, :, :])**2).sum(axis=2))
+        healthy = 1 if self.invert_label else 0
+        return distances[:, healthy] / (distances[:, healthy] + distances[:, 1-healthy])
+
+    def score(self, X):
+        """
+        Same as Clustering.score
+        """
+        return score_series(self, X)
+
+
+class IsolationArtifact:
+    """
+    Inference only version of Isolation loaded from an artifact.
+    All trees are walked together level by level on the flattened node arrays.
+    """
+    def __init__(self, arrays):
+        self.features = [str(feature) for feature in arrays['features']]
+        self.rolling_window = int(arrays['rolling_window'])
+        self.method = str(arrays['method'])
+        self.roots = arrays['roots']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.n_samples = arrays['n_samples']
+        self.max_depth = int(arrays['max_depth'])
+        self.max_samples = int(arrays['max_samples'])
+        self.offset = float(arrays['offset'])
+        self.trained_until = int(arrays['trained_until']) if 'trained_until' in arrays else None
+
+    @property
+    def feature_names(self):
+        return self.features
+
+    def decision_function(self, X):
+        """
+        Same as IsolationForest.decision_function - negative for outliers
+        """
+        X = np.asarray(X, dtype=np.float32) # Trees compare float32 features like sklearn
+        rows = np.arange(X.shape[0])[:, np.newaxis]
+        nodes = np.repeat(self.roots[np.newaxis, :], X.shape[0], axis=0) # (samples x trees)
+        depths = np.zeros(nodes.shape)
+
+        for _ in range(self.max_depth):
+            inner = self.left[nodes] != -1
+            go_left = X[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(inner, np.where(go_left, self.left[nodes], self.right[nodes]), nodes)
+            depths += inner
+
+        depths = (depths + average_path_length(self.n_samples[nodes])).sum(axis=1)
+        scores = 2 ** (-depths / (self.roots.shape[0] * average_path_length([self.max_samples])[0]))
+        return -scores - self.offset
+
+    def predict(self, X):
+        """
+        Same as Isolation.predict
+        """
+        if X.shape[0] < self.rolling_window:
+            return -1
+        X, _ = smoothen(X[self.features], self.rolling_window, self.method)
+        return int(self.predict_smoothed(X.iloc[-1:].values)[0])
+
+    def predict_smoothed(self, X):
+        """
+        Same as Isolation.predict_smoothed
+        """
+        return np.where(self.decision_function(X) < 0, 1, 0) # Outlier pt - faulty data
+
+    def score_smoothed(self, X):
+        """
+        Same as Isolation.score_smoothed
+        """
+        return -self.decision_function(X)
+
+    def score(self, X):
+        """
+        Same as Isolation.score
+        """
+        return score_series(self, X)
+
+
+def load_artifact(path):
+    """
+    Load an artifact saved by save_artifact and return the inference model
+    """
+    with np.load(path, allow_pickle=False) as arrays:
+        if int(arrays['schema_version']) != SCHEMA_VERSION:
+            raise ValueError(f"Artifact {path} has schema version {int(arrays['schema_version'])}, expected {SCHEMA_VERSION}")
+        kind = str(arrays['kind'])
+
+        if kind == "clustering":
+            return ClusteringArtifact(arrays)
+        if kind == "isolation":
+            return IsolationArtifact(arrays)
+
+        model = MatrixProfiling()
+        model.window = int(arrays['window'])
+        features = [str(feature) for feature in arrays['features']]
+        model.profile_cutoffs = dict(zip(features, arrays['cutoffs'].tolist()))
+        model.faulty = pd.DataFrame(arrays['faulty'], columns=features)
+        return model
+
+
+def load_model(artifact_path, pickle_path):
+    """
+    Load the artifact if it is available, else the pickled model
+    """
+    try:
+        return load_artifact(artifact_path)
+    except FileNotFoundError:
+        with open(pickle_path, 'rb') as f:
+            return pickle.load(f)
+
+
+class LazyModel:
+    """
+    Model which is loaded only on first use, so that startup does not wait for all the models.
+    Every attribute is passed to the loaded model.
+    """
+    def __init__(self, loader, name="model"):
+        """
+        Parameters:
+        loader - function which returns the model
+        name(str) - name of the model in the load time metric
+        """
+        self._loader = loader
+        self._name = name
+        self._model = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    start = time.perf_counter()
+                    self._model = self._loader()
+                    MODEL_LOAD_SECONDS.labels(self._name).set(time.perf_counter() - start)
+        return self._model
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+
+def preload_models(models):
+    """
+    Parameter: models - list of LazyModel (or loaded models)
+    Description:
+    Load the models now and build the precomputed state which is else made on first prediction
+    (fault reference of MatrixProfiling). Called in the gunicorn master before the workers are forked,
+    so all workers share the model arrays copy-on-write instead of loading their own copies.
+    """
+    for model in models:
+        model = model.get() if isinstance(model, LazyModel) else model
+        if isinstance(model, MatrixProfiling) and getattr(model, 'reference', None) is None:
+            model.prepare_reference()
+
+
+if __name__ == "__main__":
+    # Convert the saved pickled models to artifacts
+    from path.path import CLUSTERING_MODEL, ISOLATION_MODEL, PROFILE_MODEL, CLUSTERING_ARTIFACT, ISOLATION_ARTIFACT, PROFILE_ARTIFACT
+
+    for pickle_path, artifact_path in [(CLUSTERING_MODEL, CLUSTERING_ARTIFACT), (ISOLATION_MODEL, ISOLATION_ARTIFACT), (PROFILE_MODEL, PROFILE_ARTIFACT)]:
+        with open(pickle_path, 'rb') as f:
+            save_artifact(pickle.load(f), artifact_path)
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from training.feature_store import FEATURE_STORE
+
+
+def predict_chunk(model, X):
+    """
+    This is the job method of ProcessPool of Backtest
+    Return model.predict_smoothed on one chunk of smoothened rows
+    """
+    return model.predict_smoothed(X)
+
+
+class Backtest:
+    """
+    Turns any model (Clustering, Isolation or MatrixProfiling) into a full prediction series over a date range.
+
+    1. Prediction of a timestamp uses the readings up to and including that timestamp - same as the dashboard
+    2. Clustering / Isolation - moving average of the whole range is taken once (so there is no chunk border
+       to overlap), then the smoothened rows are predicted in chunks in parallel processes.
+       ewm uses the full history of the range instead of the last DATA_WINDOW rows, the difference is of the order of
+       (com/(com+1))**DATA_WINDOW and negligible.
+    3. MatrixProfiling - one AB-join per feature gives the least distance of every window in the range
+    4. Timestamps which do not have enough past readings get prediction -1 and are left out of TP, TN, FP, FN
+    """
+    def __init__(self, model, chunk=100000, max_workers=None, store=FEATURE_STORE):
+        """
+        Parameters:
+        model - trained Clustering, Isolation or MatrixProfiling model
+        chunk(int) - no. of rows predicted by one process
+        max_workers(int) - no. of processes, None for no. of CPUs
+        store - FeatureStore of the smoothened features
+        """
+        self.model = model
+        self.store = store
+        self.chunk = chunk
+        self.max_workers = max_workers
+        self.predictions = None
+        self.TP = 0
+        self.TN = 0
+        self.FP = 0
+        self.FN = 0
+
+    def predict_smoothed_series(self, X):
+        """
+        Return array of predictions of every row of X for Clustering / Isolation
+        """
+        predictions = np.full(X.shape[0], -1, dtype=np.int64)
+        smoothed, _ = self.store.get(X, self.model.rolling_window, self.model.method, dropna=False)
+        ready = smoothed.notna().all(axis=1).values.copy()
+        ready[:self.model.rolling_window-1] = False # Same check as X.shape[0] < rolling_window of predict
+        positions = np.flatnonzero(ready)
+        values = smoothed.values[positions]
+
+        if values.shape[0] <= self.chunk:
+            predictions[positions] = self.model.predict_smoothed(values)
+            return predictions
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            starts = range(0, values.shape[0], self.chunk)
+            jobs = [executor.submit(predict_chunk, self.model, values[start : start+self.chunk]) for start in starts]
+            for start, job in zip(starts, jobs):
+                predictions[positions[start : start+self.chunk]] = job.result()
+        return predictions
+
+    def predict_profile_series(self, X):
+        """
+        Return array of predictions of every row of X for MatrixProfiling
+        """
+        predictions = np.full(X.shape[0], -1, dtype=np.int64)
+        window = self.model.window
+        if X.shape[0] < window:
+            return predictions
+
+        scores = self.model.rolling_distance_scores(X) # (windows x features), window ending at row window-1+i
+        cutoffs = np.array([self.model.profile_cutoffs[feature] for feature in self.model.profile_cutoffs.keys()])
+        no_of_faulty_params = (scores < cutoffs).sum(axis=1)
+        predictions[window-1:] = np.where(no_of_faulty_params > 3, 1, 0)
+        return predictions
+
+    def run(self, data):
+        """
+        Parameter: data - pd dataframe of the date range with the features and 'status'
+        Description:
+        1. Find the prediction of every timestamp in one sliding pass
+        2. Save the predictions as pd series in self.predictions
+        3. Count TP, TN, FP, FN over the timestamps having a prediction
+        """
+        X = data.drop(['status'], axis=1)
+        if hasattr(self.model, 'predict_smoothed'):
+            predictions = self.predict_smoothed_series(X)
+        else:
+            predictions = self.predict_profile_series(X)
+
+        self.predictions = pd.Series(predictions, index=data.index, name='prediction')
+
+        predicted = predictions != -1
+        true, predictions = data['status'].values[predicted], predictions[predicted]
+        self.TP = int(np.count_nonzero((predictions == 1) & (true == 1)))
+        self.TN = int(np.count_nonzero((predictions == 0) & (true == 0)))
+        self.FP = int(np.count_nonzero((predictions == 1) & (true == 0)))
+        self.FN = int(np.count_nonzero((predictions == 0) & (true == 1)))
+        return self
@@ -2,6 +2,8 @@ import numpy as np
 from sklearn.preprocessing import StandardScaler
 from sklearn.cluster import KMeans
 from sklearn.metrics import confusion_matrix, precision_score, recall_score, f1_score
+from training.features import smoothen, score_series
+from training.feature_store import FEATURE_STORE
 
 
 class Clustering:
@@ -30,20 +32,16 @@ class Clustering:
         Parameter:
         data - the pd dataframe of the training data
         """
-        y = data['status']
-        X = data.drop(['status'], axis=1)
-        
-        if self.method == 'sma':
-            X = X.rolling(window=self.rolling_window).mean()
-        elif self.method == 'ewm':
-            X = X.ewm(com=self.rolling_window).mean()
-        
-        # Drop na vallues from X and corresponding indices of y also
-        not_na_idx = X[X.iloc[:,0].notna()].index
-        X = X.dropna()
-        y = y[not_na_idx]
-        
+        X, y = FEATURE_STORE.get(data, self.rolling_window, self.method) # Shared with the other models of the same window
+        self.fit_features(X, y)
 
+    def fit_features(self, X, y):
+        """
+        Parameters:
+        X - pd dataframe of the smoothened features (nan values dropped)
+        y - status of the rows of X
+        Description: Split, train and save the test score - used directly when smoothened features are precomputed
+        """
         # Train test split
         total_size = X.shape[0]
         test_size = int(total_size*self.test_ratio)
@@ -91,18 +89,81 @@ class Clustering:
             return -1
         
         # Moving average and drop nan
-        if self.method == 'sma':
-            X = X.rolling(window=self.rolling_window).mean()
-        elif self.method == 'ewm':
-            X = X.ewm(com=self.rolling_window).mean()
-        X = X.dropna()
+        X, _ = smoothen(X, self.rolling_window, self.method)
         
         query_pt = X.iloc[-1].values.reshape(1,-1) # Last point
-        query_pt = self.scaler.transform(query_pt)
-        prediction = self.cluster.predict(query_pt)[0]
-        
+        return int(self.predict_smoothed(query_pt)[0])
+
+    def predict_smoothed(self, X):
+        """
+        Parameter: X is a 2D array of rows which are already smoothened by the moving average
+        Description:
+        1. Scale the rows with the saved scaler mean and scale
+        2. Assign every row to the nearest cluster centre (same rule as KMeans.predict)
+        3. Return the class levels (1 - Fault, 0 - Healthy) for all rows as an array
+        """
+        X = (np.asarray(X, dtype=float) - self.scaler.mean_) / self.scaler.scale_
+        centers = self.cluster.cluster_centers_
+        distances = ((X[:, np.newaxis, :] - centers[np.newaxis, :, :])**2).sum(axis=2)
+        prediction = distances.argmin(axis=1)
+
         if self.invert_label:
             prediction = 1 - prediction
-        
+
         return prediction
+
+    def score_smoothed(self, X):
+        """
+        Parameter: X is a 2D array of rows which are already smoothened by the moving average
+        Description:
+        Return severity of every row - distance to healthy centre / (distance to healthy centre + distance to faulty centre).
+        It is between 0 and 1, above 0.5 the row is nearer to the faulty cluster (prediction 1).
+        """
+        X = (np.asarray(X, dtype=float) - self.scaler.mean_) / self.scaler.scale_
+        centers = self.cluster.cluster_centers_
+        distances = np.sqrt(((X[:, np.newaxis, :] - centers[np.newaxis, :, :])**2).sum(axis=2))
+        healthy = 1 if self.invert_label else 0 # Index of the cluster of healthy points
+        return distances[:, healthy] / (distances[:, healthy] + distances[:, 1-healthy])
+
+    def score(self, X):
+        """
+        Parameter: X is a pd data frame of readings - a batch of windows, every row with rolling_window past readings is scored
+        Description: Return pd series of the severity (score_smoothed) of every row, nan if there are not enough past readings
+        """
+        return score_series(self, X)
+
+    def partial_fit(self, X):
+        """
+        Parameter: X - pd dataframe of new smoothened rows (warm start from the fitted model)
+        Description:
+        1. Update the scaler mean and variance with the new rows, the centres are moved to the new scale
+           so that they stay at the same place in the original units
+        2. Assign every new row to the nearest centre and move each centre to the running mean of all
+           the rows assigned to it till now (same update as MiniBatchKMeans)
+        """
+        X = X[self.feature_names]
+        if not hasattr(self, 'cluster_counts'):
+            # No. of training rows of every cluster (labels_ are saved as class levels)
+            clusters = 1 - self.cluster.labels_ if self.invert_label else self.cluster.labels_
+            self.cluster_counts = np.bincount(clusters, minlength=2).astype(float)
+
+        centers = self.cluster.cluster_centers_ * self.scaler.scale_ + self.scaler.mean_
+        self.scaler.partial_fit(X)
+        centers = (centers - self.scaler.mean_) / self.scaler.scale_
+
+        X_scaled = self.scaler.transform(X)
+        nearest = ((X_scaled[:, np.newaxis, :] - centers[np.newaxis, :, :])**2).sum(axis=2).argmin(axis=1)
+        for cluster in range(centers.shape[0]):
+            points = X_scaled[nearest == cluster]
+            if points.shape[0]:
+                self.cluster_counts[cluster] += points.shape[0]
+                centers[cluster] += (points.sum(axis=0) - points.shape[0] * centers[cluster]) / self.cluster_counts[cluster]
+        self.cluster.cluster_centers_ = centers
+
+    @property
+    def feature_names(self):
+        """
+        Names of the features (in order) on which the model is trained
+        """
+        return list(self.scaler.feature_names_in_)
         
\ No newline at end of file
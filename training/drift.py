@@ -0,0 +1,91 @@
+import numpy as np
+import pandas as pd
+from storage.timeseries import load_dataset
+from training.features import smoothen
+
+
+# Shift of the mean of any feature (in training standard deviations) above which the data has drifted
+DRIFT_THRESHOLD = 1.0
+
+# Drop of recall on the new faulty rows (from the test recall of the model) above which the data has drifted
+RECALL_TOLERANCE = 0.2
+
+# Lags read before the watermark for smoothening, in multiples of the rolling window (ewm weight of older lags is < e^-10)
+CONTEXT_WINDOWS = 10
+
+
+def training_reference(data):
+    """
+    Parameter: data - preprocessed pd dataframe the model is trained on
+    Description: Return mean and standard deviation of every feature over the healthy rows - reference for drift detection
+    """
+    healthy = data[data['status'] == 0].drop(['status'], axis=1)
+    return dict(
+        features=list(healthy.columns),
+        mean=healthy.mean().values.astype(float).tolist(),
+        std=healthy.std().values.astype(float).tolist(),
+    )
+
+
+def set_watermark(model, data):
+    """
+    Save the last timestamp of the training data and the drift reference in the model
+    """
+    model.trained_until = int(data.index[-1].value)
+    model.drift_reference = training_reference(data) # Not reference, which is the fault reference of MatrixProfiling
+
+
+def drift_score(reference, data):
+    """
+    Parameters:
+    reference(dict) - from training_reference
+    data - new preprocessed rows
+    Description: Return the largest shift of the mean of a feature over the healthy rows, in training standard deviations
+    """
+    healthy = data[data['status'] == 0] if 'status' in data.columns else data
+    if healthy.shape[0] == 0:
+        return 0.0
+    mean = healthy[reference["features"]].mean().values
+    std = np.maximum(np.array(reference["std"]), 1e-12)
+    return float(np.max(np.abs(mean - np.array(reference["mean"])) / std))
+
+
+def load_new_rows(model):
+    """
+    Parameter: model - fitted Clustering or Isolation model with trained_until
+    Description:
+    Return (data, X, y) - raw rows newer than the watermark, their smoothened features and status.
+    Only the rows after the watermark and the lags needed for smoothening are read from the time-series store.
+    """
+    context = CONTEXT_WINDOWS * model.rolling_window
+    data = load_dataset(pd.Timestamp(model.trained_until + 1), lags=context)
+    if not (data.index.values.astype('datetime64[ns]').astype(np.int64) > model.trained_until).any():
+        return None, None, None
+
+    X, y = smoothen(data, model.rolling_window, model.method)
+
+    new = X.index.values.astype('datetime64[ns]').astype(np.int64) > model.trained_until
+    return data[data.index.values.astype('datetime64[ns]').astype(np.int64) > model.trained_until], X[new], y[new]
+
+
+def has_drifted(model, data, X, y, threshold=DRIFT_THRESHOLD, tolerance=RECALL_TOLERANCE):
+    """
+    Parameters:
+    model - fitted model with drift_reference and test_recall
+    data - new raw rows, X, y - their smoothened features and status
+    Description:
+    Return (drifted, reason) -
+    1. Mean of a feature of the healthy rows has moved by more than threshold training standard deviations
+    2. New data has faulty rows and recall on them is less than test recall of the model - tolerance
+    """
+    score = drift_score(model.drift_reference, data)
+    if score > threshold:
+        return True, f"feature shift {score:0.3f} > {threshold}"
+
+    if y.sum() > 0:
+        prediction = model.predict_smoothed(X[model.feature_names].values)
+        recall = float((prediction[y.values == 1] == 1).mean())
+        if recall < model.test_recall - tolerance:
+            return True, f"recall on new faults {recall:0.3f} < {model.test_recall:0.3f} - {tolerance}"
+
+    return False, f"feature shift {score:0.3f}"
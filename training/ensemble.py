@@ -0,0 +1,219 @@
+import numpy as np
+import pandas as pd
+from training.feature_store import FEATURE_STORE
+from training.features import score_series
+from training.streaming import RunningSmoother
+
+
+VOTING = ("majority", "any", "all", "weighted")
+
+
+class Ensemble:
+    """
+    Scores Clustering, Isolation and MatrixProfiling models together in one shared pass.
+
+    1. Models with a rolling window are grouped by (rolling_window, method) - smoothened features
+       are found only once per group and given to predict_smoothed of every model of the group
+    2. MatrixProfiling models score the raw last window of readings
+    3. Class levels of the models are combined by voting, models without enough data (-1) do not vote -
+       "majority" - fault if more than half of the models say fault
+       "any" - fault if any model says fault
+       "all" - fault if all the models say fault
+       "weighted" - fault if weighted mean of the class levels is at least threshold
+    """
+    def __init__(self, models, voting="majority", weights=None, threshold=0.5, store=FEATURE_STORE):
+        """
+        Parameters:
+        models(dict) - name -> trained Clustering, Isolation or MatrixProfiling model
+        voting(str) - "majority", "any", "all" or "weighted"
+        weights(dict) - name -> weight of the model for "weighted" voting, 1 for every model if None
+        threshold(float) - min. weighted mean of class levels for a fault in "weighted" voting
+        store - FeatureStore of the smoothened features
+        """
+        if voting not in VOTING:
+            raise ValueError(f"Unknown voting - {voting}")
+        self.models = models
+        self.voting = voting
+        self.weights = {name: 1.0 for name in models} if weights is None else weights
+        self.threshold = threshold
+        self.store = store
+
+    def groups(self):
+        """
+        Return {(rolling_window, method): [names]} of the models using smoothened features
+        and list of names of the models using the raw window
+        """
+        groups, raw = {}, []
+        for name, model in self.models.items():
+            if hasattr(model, 'rolling_window'):
+                groups.setdefault((model.rolling_window, model.method), []).append(name)
+            else:
+                raw.append(name)
+        return groups, raw
+
+    def combine(self, outputs):
+        """
+        Parameter: outputs(dict) - name -> class level (1 - Fault, 0 - Healthy, -1 - Not enough data)
+        Description: Return the combined class level, -1 if no model has enough data
+        """
+        votes = {name: label for name, label in outputs.items() if label != -1}
+        if not votes:
+            return -1
+        faults = [name for name, label in votes.items() if label == 1]
+
+        if self.voting == "any":
+            return int(len(faults) > 0)
+        if self.voting == "all":
+            return int(len(faults) == len(votes))
+        if self.voting == "majority":
+            return int(len(faults) * 2 > len(votes))
+
+        total = sum(self.weights.get(name, 0.0) for name in votes)
+        if total <= 0:
+            return -1
+        return int(sum(self.weights.get(name, 0.0) for name in faults) / total >= self.threshold)
+
+    def predict(self, X):
+        """
+        Parameter: X - pd dataframe of the readings (e.g. data queue), only the features
+        Description: Return (combined class level, dict of class level of every model) of the last reading
+        """
+        groups, raw = self.groups()
+        outputs = {}
+        for (rolling_window, method), names in groups.items():
+            if X.shape[0] < rolling_window:
+                outputs.update({name: -1 for name in names})
+                continue
+            # Only the last rolling_window rows affect the last sma value, ewm needs all the rows
+            rows = X.iloc[-rolling_window:] if method == "sma" else X
+            last = self.store.get(rows, rolling_window, method, dropna=False)[0].iloc[-1:]
+            for name in names:
+                model = self.models[name]
+                outputs[name] = int(model.predict_smoothed(last[model.feature_names].values)[0])
+        for name in raw:
+            outputs[name] = self.models[name].predict(X)
+        return self.combine(outputs), outputs
+
+    def score(self, X):
+        """
+        Parameter: X - pd dataframe of the readings (a batch of windows), only the features
+        Description:
+        Return dict name -> severity of every row of X (same as model.score) - smoothened features
+        are found once per (rolling_window, method) and shared by the models of the group
+        """
+        groups, raw = self.groups()
+        scores = {}
+        for (rolling_window, method), names in groups.items():
+            smoothed, _ = self.store.get(X, rolling_window, method, dropna=False)
+            for name in names:
+                scores[name] = score_series(self.models[name], X, smoothed)
+        for name in raw:
+            scores[name] = self.models[name].score(X)
+        return scores
+
+
+class EnsemblePredictor:
+    """
+    Streaming version of Ensemble.predict for a live stream of readings (like StreamingPredictor).
+
+    1. One RunningSmoother per (rolling_window, method) is updated once per reading and shared by its models
+    2. Last readings are kept for the models scoring the raw window (MatrixProfiling) in a circular array -
+       a reading is written over the oldest one in place, the window is read in order only when a model is run
+    3. update returns the combined class level, class levels of the models are kept in self.outputs
+    """
+    def __init__(self, ensemble, history=None, features=None):
+        """
+        Parameters:
+        ensemble - Ensemble
+        history(int) - no. of latest rows the batch path would see, None for no limit
+        features(list) - order of the features in the readings, default is feature_names of the first smoothing model
+        """
+        self.ensemble = ensemble
+        self.groups, self.raw = ensemble.groups()
+        if features is None:
+            features = ensemble.models[next(iter(self.groups.values()))[0]].feature_names
+        self.features = list(features)
+        self.smoothers = {
+            (rolling_window, method): RunningSmoother(len(self.features), rolling_window, method, history)
+            for rolling_window, method in self.groups
+        }
+        self.orders = {
+            name: [self.features.index(feature) for feature in ensemble.models[name].feature_names]
+            for names in self.groups.values() for name in names
+        }
+        self.window = max([ensemble.models[name].window for name in self.raw], default=0)
+        self.reset()
+
+    def reset(self):
+        for smoother in self.smoothers.values():
+            smoother.reset()
+        self.recent = np.zeros((self.window, len(self.features)))
+        self.count = 0
+        self.outputs = {}
+
+    def get_values(self, row):
+        """
+        Return the values of a reading (pd Series, dict or array) in the order of self.features
+        """
+        if isinstance(row, pd.Series):
+            return row[self.features].values.astype(float)
+        if isinstance(row, dict):
+            return np.array([row[feature] for feature in self.features], dtype=float)
+        return np.asarray(row, dtype=float)
+
+    def absorb(self, values):
+        for smoother in self.smoothers.values():
+            smoother.update(values)
+        if self.window:
+            self.recent[self.count % self.window] = values
+        self.count += 1
+
+    def last_rows(self, n):
+        """
+        Return the last n readings (n <= self.window), oldest first
+        """
+        return self.recent[np.arange(self.count - n, self.count) % self.window]
+
+    def evaluate(self):
+        """
+        Return the combined class level of the latest reading and save the class level of every model in self.outputs
+        """
+        outputs = {}
+        for (rolling_window, method), names in self.groups.items():
+            smoother = self.smoothers[(rolling_window, method)]
+            if smoother.count < rolling_window:
+                outputs.update({name: -1 for name in names})
+                continue
+            value = smoother.value()
+            for name in names:
+                model = self.ensemble.models[name]
+                outputs[name] = int(model.predict_smoothed(value[self.orders[name]].reshape(1, -1))[0])
+
+        for name in self.raw:
+            model = self.ensemble.models[name]
+            if self.count < model.window:
+                outputs[name] = -1
+            else:
+                outputs[name] = model.predict(pd.DataFrame(self.last_rows(model.window), columns=self.features))
+
+        self.outputs = outputs
+        return self.ensemble.combine(outputs)
+
+    def update(self, row):
+        """
+        Parameter: row - a single reading
+        Description: Absorb the reading and return the combined class level (1 - Fault, 0 - Healthy, -1 - Not enough data)
+        """
+        self.absorb(self.get_values(row))
+        return self.evaluate()
+
+    def warm_up(self, X):
+        """
+        Parameter: X - pd dataframe (or 2D array) of past readings, oldest first
+        Description: Rebuild the state from past readings and return the combined class level of the last one
+        """
+        self.reset()
+        values = X[self.features].values if isinstance(X, pd.DataFrame) else np.asarray(X)
+        for row in values:
+            self.absorb(row)
+        return self.evaluate() if values.shape[0] else -1
@@ -0,0 +1,167 @@
+import os
+import hashlib
+import weakref
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from training.features import smoothen
+from path.path import FEATURE_STORE_SPILL
+
+
+# Max. bytes of smoothened features kept in memory
+MAX_BYTES = int(os.environ.get("FEATURE_STORE_BYTES", 512 * 1024 * 1024))
+
+
+def data_version(data):
+    """
+    Parameter: data - pd dataframe of the readings
+    Description:
+    Return a fingerprint of the data - columns and the hash of every row (index and values, pd.util.hash_pandas_object).
+    Any change of a row, a label or the range gives a new version.
+    """
+    digest = hashlib.sha1()
+    digest.update(repr(list(data.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def frame_bytes(X, y):
+    size = X.values.nbytes + X.index.values.nbytes
+    return size if y is None else size + y.values.nbytes
+
+
+class FeatureStore:
+    """
+    Smoothened features keyed by (data version, rolling window, method, date range, dropna).
+
+    1. Features of a key are computed with smoothen only once, later reads of the same key get the cached (X, y)
+    2. Memory is bounded by max_bytes - least recently used entries are evicted first
+    3. If spill_folder is given evicted entries are saved as .npz files and read back instead of smoothening again
+    4. Version of a data frame is found once per frame object and kept while the frame is alive, so later reads
+       of the same frame do not hash all its rows again
+    Cached frames are shared - callers must not change them in place, nor change a data frame in place after reading it.
+    """
+    def __init__(self, max_bytes=MAX_BYTES, spill_folder=None):
+        """
+        Parameters:
+        max_bytes(int) - max. bytes of the features kept in memory
+        spill_folder(str) - folder for evicted entries, None to drop them
+        """
+        self.max_bytes = max_bytes
+        self.spill_folder = spill_folder
+        self.entries = OrderedDict() # key -> (X, y, bytes), oldest first
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.versions = {} # id of a data frame -> (weak reference to the frame, data_version)
+        self.lock = threading.Lock()
+
+    def version(self, data):
+        """
+        Return data_version of the frame, hashed only on the first read of the frame
+        """
+        key = id(data)
+        with self.lock:
+            entry = self.versions.get(key)
+            if entry is not None and entry[0]() is data:
+                return entry[1]
+
+        version = data_version(data)
+        def forget(reference):
+            # No lock - called by the garbage collector, which may run while this thread holds it
+            if self.versions.get(key, (None,))[0] is reference:
+                self.versions.pop(key, None)
+        with self.lock:
+            self.versions[key] = (weakref.ref(data, forget), version)
+        return version
+
+    def key(self, data, rolling_window, method, dropna, version=None):
+        version = self.version(data) if version is None else version
+        start, end = (str(data.index[0]), str(data.index[-1])) if data.shape[0] else (None, None)
+        return (version, int(rolling_window), method, start, end, bool(dropna))
+
+    def spill_path(self, key):
+        name = hashlib.sha1(repr(key).encode()).hexdigest()
+        return os.path.join(self.spill_folder, f"{name}.npz")
+
+    def get(self, data, rolling_window, method, dropna=True, version=None):
+        """
+        Parameters:
+        data - pd dataframe of the features, may also have the 'status' column
+        rolling_window(int), method(str), dropna(bool) - same as smoothen
+        version(str) - version of data (e.g. from the cache meta), None to find it with data_version
+        Description: Return (X, y) of smoothen(data, rolling_window, method, dropna) from the cache if available
+        """
+        key = self.key(data, rolling_window, method, dropna, version)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                X, y, _ = self.entries[key]
+                return X, y
+
+        X, y = self.load_spilled(key)
+        if X is None:
+            X, y = smoothen(data, rolling_window, method, dropna)
+        with self.lock:
+            self.misses += 1
+            self.put(key, X, y)
+        return X, y
+
+    def put(self, key, X, y):
+        """
+        Add an entry and evict the least recently used ones while over max_bytes (lock must be held)
+        """
+        size = frame_bytes(X, y)
+        if size > self.max_bytes:
+            self.spill(key, X, y) # Never kept in memory, spilled only
+            return
+        if key in self.entries:
+            self.bytes -= self.entries.pop(key)[2]
+        self.entries[key] = (X, y, size)
+        self.bytes += size
+
+        while self.bytes > self.max_bytes:
+            old_key, (old_X, old_y, old_size) = self.entries.popitem(last=False)
+            self.bytes -= old_size
+            self.spill(old_key, old_X, old_y)
+
+    def spill(self, key, X, y):
+        if self.spill_folder is None:
+            return
+        os.makedirs(self.spill_folder, exist_ok=True)
+        path = self.spill_path(key)
+        if os.path.exists(path):
+            return
+        arrays = dict(X=X.values, index=X.index.values, columns=np.array(X.columns, dtype=str))
+        if y is not None:
+            arrays.update(y=y.values, y_name=np.array([str(y.name)]))
+        with open(path + ".tmp", 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + ".tmp", path)
+
+    def load_spilled(self, key):
+        """
+        Return (X, y) of a spilled entry, (None, None) if it is not on disk
+        """
+        if self.spill_folder is None or not os.path.exists(self.spill_path(key)):
+            return None, None
+        with np.load(self.spill_path(key), allow_pickle=False) as saved:
+            index = pd.Index(saved["index"], name='timestamp') if saved["index"].dtype.kind == 'M' else pd.Index(saved["index"])
+            X = pd.DataFrame(saved["X"], index=index, columns=list(saved["columns"]))
+            y = pd.Series(saved["y"], index=index, name=str(saved["y_name"][0])) if "y" in saved else None
+        return X, y
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            return dict(entries=len(self.entries), bytes=self.bytes, hits=self.hits, misses=self.misses)
+
+
+# Store shared by training, backtests and the ensemble - evicted entries are spilled to disk if FEATURE_STORE_SPILL=1
+FEATURE_STORE = FeatureStore(MAX_BYTES, FEATURE_STORE_SPILL if os.environ.get("FEATURE_STORE_SPILL") == "1" else None)
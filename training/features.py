@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+
+
+def smoothen(data, rolling_window, method, dropna=True):
+    """
+    Parameters:
+    data - pd dataframe of the features, may also have the 'status' column
+    rolling_window(int) - no. of lags to smoothen the data
+    method(str) - "sma" for simple moving average and "ewm" for exponential moving average
+    dropna(bool) - False to keep the rows (nan) which do not have enough lags
+    Description:
+    1. Take the moving average of the features
+    2. Drop the nan values from X and corresponding indices of y also
+    3. Return (X, y) - y is None if data has no 'status' column
+    """
+    y = data['status'] if 'status' in data.columns else None
+    X = data.drop(['status'], axis=1) if y is not None else data
+
+    if method == 'sma':
+        X = X.rolling(window=rolling_window).mean()
+    elif method == 'ewm':
+        X = X.ewm(com=rolling_window).mean()
+
+    if not dropna:
+        return X, y
+
+    not_na = X.notna().all(axis=1).values
+    X = X[not_na]
+    if y is not None:
+        y = y[not_na]
+    return X, y
+
+
+def score_series(model, X, smoothed=None):
+    """
+    Parameters:
+    model - Clustering or Isolation model (or its artifact) having score_smoothed
+    X - pd dataframe of readings, oldest first
+    smoothed - smoothened X (smoothen with dropna=False) if already computed
+    Description:
+    1. Take the moving average of the whole batch once
+    2. Score all the rows having rolling_window past readings in one score_smoothed call
+    3. Return pd series of the severity of every row of X, nan for the rows without enough past readings
+    """
+    scores = np.full(X.shape[0], np.nan)
+    if smoothed is None:
+        smoothed, _ = smoothen(X[model.feature_names], model.rolling_window, model.method, dropna=False)
+    ready = smoothed.notna().all(axis=1).values.copy()
+    ready[:model.rolling_window-1] = False # Same check as X.shape[0] < rolling_window of predict
+    if ready.any():
+        scores[ready] = model.score_smoothed(smoothed[model.feature_names].values[ready])
+    return pd.Series(scores, index=X.index, name='score')
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from training.feature_store import FEATURE_STORE
+
+
+def fit_shared(model, X_path, y_path, columns):
+    """
+    This is the job method of ProcessPool of grid_search
+
+    Description:
+    1. Memory-map the precomputed smoothened features and status (read only, no copy per job)
+    2. Fit the model on them and return the fitted model
+    """
+    X = pd.DataFrame(np.load(X_path, mmap_mode='r'), columns=columns)
+    y = pd.Series(np.load(y_path, mmap_mode='r'))
+    model.fit_features(X, y)
+    return model
+
+
+def grid_search(data, models, on_result=None, max_workers=None, store=FEATURE_STORE):
+    """
+    Parameters:
+    data - the pd dataframe of the training data
+    models - list of unfitted Clustering or Isolation models (one per grid point)
+    on_result - function called with every fitted model as soon as it finishes
+    max_workers(int) - no. of processes, None for no. of CPUs
+    store - FeatureStore of the smoothened features
+    Description:
+    1. Group the models by (rolling_window, method)
+    2. Smoothened features of each group are read from the feature store (computed only once) and saved as .npy files in a temporary folder
+    3. Models of all groups are fitted in parallel in a ProcessPool, workers memory-map the shared features
+    4. Return the fitted models in the same order as models
+    """
+    groups = {}
+    for idx, model in enumerate(models):
+        groups.setdefault((model.rolling_window, model.method), []).append(idx)
+
+    fitted = [None] * len(models)
+
+    with tempfile.TemporaryDirectory() as folder:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            jobs = {}
+            for (rolling_window, method), group in groups.items():
+                X, y = store.get(data, rolling_window, method)
+
+                X_path = os.path.join(folder, f"X_{method}_{rolling_window}.npy")
+                y_path = os.path.join(folder, f"y_{method}_{rolling_window}.npy")
+                np.save(X_path, X.values)
+                np.save(y_path, y.values)
+
+                # Workers can start on this group while features of the next group are computed
+                for idx in group:
+                    job = executor.submit(fit_shared, models[idx], X_path, y_path, list(X.columns))
+                    jobs[job] = idx
+
+            for job in as_completed(jobs):
+                model = job.result()
+                fitted[jobs[job]] = model
+                if on_result is not None:
+                    on_result(model)
+
+    return fitted
@@ -1,7 +1,15 @@
+import numpy as np
 from sklearn.metrics import confusion_matrix, precision_score, recall_score, f1_score
+from training.features import smoothen, score_series
+from training.feature_store import FEATURE_STORE
 from sklearn.ensemble import IsolationForest
 
 
+# Attributes of the fitted IsolationForest with one entry per tree, trimmed together by add_trees
+# (_seeds only keeps the seeds of the last warm start fit, so it is not one of them)
+PER_TREE_ATTRIBUTES = ['estimators_', 'estimators_features_', '_average_path_length_per_tree', '_decision_path_lengths']
+
+
 class Isolation:
     """
     1. Take the rolling average
@@ -29,20 +37,16 @@ class Isolation:
         Parameter:
         data - the pd dataframe of the training data
         """
-        y = data['status']
-        X = data.drop(['status'], axis=1)
-        
-        if self.method == 'sma':
-            X = X.rolling(window=self.rolling_window).mean()
-        elif self.method == 'ewm':
-            X = X.ewm(com=self.rolling_window).mean()
-        
-        # Drop na vallues from X and corresponding indices of y also
-        not_na_idx = X[X.iloc[:,0].notna()].index
-        X = X.dropna()
-        y = y[not_na_idx]
-        
+        X, y = FEATURE_STORE.get(data, self.rolling_window, self.method) # Shared with the other models of the same window
+        self.fit_features(X, y)
 
+    def fit_features(self, X, y):
+        """
+        Parameters:
+        X - pd dataframe of the smoothened features (nan values dropped)
+        y - status of the rows of X
+        Description: Split, train and save the test score - used directly when smoothened features are precomputed
+        """
         # Train test split
         total_size = X.shape[0]
         test_size = int(total_size*self.test_ratio)
@@ -83,16 +87,84 @@ class Isolation:
             return -1
         
         # Moving average and drop nan
-        if self.method == 'sma':
-            X = X.rolling(window=self.rolling_window).mean()
-        elif self.method == 'ewm':
-            X = X.ewm(com=self.rolling_window).mean()
-        X = X.dropna()
+        X, _ = smoothen(X, self.rolling_window, self.method)
         
         query_pt = X.iloc[-1].values.reshape(1,-1) # Last point
-        prediction = self.model.predict(query_pt)
-        
-        if prediction == -1:
-            return 1 # Outlier pt - faulty data
-        else:
-            return 0 # Healthy data
\ No newline at end of file
+        return int(self.predict_smoothed(query_pt)[0])
+
+    def predict_smoothed(self, X):
+        """
+        Parameter: X is a 2D array of rows which are already smoothened by the moving average
+        Description:
+        Return the class levels (1 - Fault, 0 - Healthy) for all rows as an array
+        """
+        prediction = self.model.predict(np.asarray(X, dtype=float))
+        return np.where(prediction == -1, 1, 0) # Outlier pt - faulty data
+
+    def score_smoothed(self, X):
+        """
+        Parameter: X is a 2D array of rows which are already smoothened by the moving average
+        Description: Return severity of every row - negative of decision_function, above 0 the row is an outlier (prediction 1)
+        """
+        return -self.model.decision_function(np.asarray(X, dtype=float))
+
+    def score(self, X):
+        """
+        Parameter: X is a pd data frame of readings - a batch of windows, every row with rolling_window past readings is scored
+        Description: Return pd series of the severity (score_smoothed) of every row, nan if there are not enough past readings
+        """
+        return score_series(self, X)
+
+    def add_trees(self, X, n_trees=None):
+        """
+        Parameters:
+        X - pd dataframe of new smoothened rows (at least max_samples rows)
+        n_trees(int) - no. of trees to add, 10% of the forest if None
+        Description:
+        1. Fit n_trees new trees on the new rows with warm_start, the old trees are kept as they are
+        2. Drop the n_trees oldest trees so that the size of the forest (and predict time) does not grow
+        3. Find the outlier threshold (offset_) again on the new rows as per contamination
+        """
+        forest = self.model
+        size = len(forest.estimators_)
+        n_trees = n_trees or max(1, size // 10)
+
+        forest.set_params(warm_start=True, n_estimators=size + n_trees)
+        forest.fit(X[self.feature_names])
+        forest.set_params(warm_start=False, n_estimators=size)
+
+        for name in PER_TREE_ATTRIBUTES:
+            trees = getattr(forest, name, None)
+            if trees is not None and len(trees) == size + n_trees:
+                setattr(forest, name, trees[n_trees:])
+        self.check_forest(size, size + n_trees)
+
+        if forest.contamination != "auto":
+            forest.offset_ = np.percentile(forest.score_samples(X[self.feature_names]), 100.0 * forest.contamination)
+
+    def check_forest(self, size, fitted):
+        """
+        Parameters:
+        size(int) - no. of trees the forest must have
+        fitted(int) - no. of trees before the oldest ones were dropped
+        Description:
+        Raise ValueError if a per-tree attribute of the forest does not have size entries - e.g. a new sklearn
+        version keeps the trees in an attribute which is not in PER_TREE_ATTRIBUTES
+        """
+        forest = self.model
+        for name, value in vars(forest).items():
+            if name == 'feature_names_in_' or not isinstance(value, (list, np.ndarray)):
+                continue
+            if name in PER_TREE_ATTRIBUTES and len(value) != size:
+                raise ValueError(f"Forest has {len(value)} {name} for {size} trees")
+            if name not in PER_TREE_ATTRIBUTES and len(value) == fitted:
+                raise ValueError(f"Unknown per-tree attribute {name} of the forest is not trimmed")
+        if len(forest.estimators_) != size:
+            raise ValueError(f"Forest has {len(forest.estimators_)} trees instead of {size}")
+
+    @property
+    def feature_names(self):
+        """
+        Names of the features (in order) on which the model is trained
+        """
+        return list(self.model.feature_names_in_)
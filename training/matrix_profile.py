@@ -1,7 +1,9 @@
 import stumpy
-from concurrent.futures import ProcessPoolExecutor
 import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
 from sklearn.metrics import confusion_matrix
+from training.backtest import Backtest
 from log.logging import LOGGER
 import logging
 
@@ -15,43 +17,27 @@ class MatrixProfiling:
         self.FP = 0
         self.FN = 0
         self.faulty = None
+        self.reference = None
         
 
-    def find_distance_profile(self,fault_query, fault_t, start_id, end_id, column):
-        """
-        This is the job method of ProcessPool of find_cutoffs
-
-        Description:
-        1. Take slice of data from start index to end index
-        2. Query one set data of window size=130 on other set and save the least distance
-        3. Store least distances in a list and return the list and column name
-        """
-        try:
-            distances = []
-            for i in range(start_id, end_id - self.window):
-                matches = stumpy.match(Q=fault_query[i:i+self.window][column], T=fault_t[column])
-                distance = matches[0][0]
-                distances.append(distance)
-            return (distances, column)
-        except Exception as e:
-            return ([], None)
-        
-    def callback_update_profiles(self,future):
+    def find_distance_profile(self, fault_query, fault_t):
         """
         Description:
-        Callback function of ThreadPool of find_cutoffs
+        1. AB-join of the two series of one feature - for every subsequence of window size=130 in
+           fault_query find the least z-normalised distance to any subsequence of fault_t
+        2. One stumpy.stump call does this for all the subsequences together instead of one
+           stumpy.match (full search) per subsequence
+        3. Return the least distances as a 1D array
         """
-        distance, column = future.result()
-        # print(len(distance), column)
-        if column is not None:
-            self.profile_cutoffs[column].extend(distance)
+        profile = stumpy.stump(T_A=fault_query, m=self.window, T_B=fault_t, ignore_trivial=False)
+        return profile[:, 0].astype(np.float64)
 
     def find_cutoffs(self, data):
         """
         1. Separate faulty data and save fault data for future
         2. Split the faulty data in two part of 50% split size
         3. Query one set data of window size=130 on other set and save the least distance
-        4. Calculate the distances for each feature
+        4. Calculate the distances for each feature - one AB-join per feature on the float arrays of that feature only
         5. Take upper fence value (q3 + 1.5*IQR) as cutoff
         """
         try:
@@ -64,28 +50,11 @@ class MatrixProfiling:
 
             for column in data.columns:
                 if column != 'status':
-                    self.profile_cutoffs[column] = []
-
-
-            with ProcessPoolExecutor() as executor:
-                query_N = fault_query.shape[0]
-                chunk = 2000
-                start_idx = 0
-                end_idx = chunk
-
-                while True:
-                    if end_idx > query_N:
-                        end_idx = query_N
-                    if start_idx == end_idx:
-                        break
-
-                    for column in self.profile_cutoffs.keys():
-                        job = executor.submit(self.find_distance_profile, fault_query.copy(), fault_t.copy(), start_idx, end_idx, column)
-                        job.add_done_callback(self.callback_update_profiles)
-                    start_idx, end_idx = end_idx, end_idx + chunk
-            
-                executor.shutdown()
-
+                    # stumpy runs the join in parallel on all cores, so the arrays are never copied to other processes
+                    self.profile_cutoffs[column] = self.find_distance_profile(
+                        fault_query[column].values.astype(np.float64),
+                        fault_t[column].values.astype(np.float64)
+                    )
         
             for column in self.profile_cutoffs.keys():
                 q1 = np.quantile(self.profile_cutoffs[column], 0.25)
@@ -93,6 +62,8 @@ class MatrixProfiling:
                 IQR = q3 - q1
                 upper_fence = q3 + 1.5*IQR
                 self.profile_cutoffs[column] = q3
+
+            self.prepare_reference()
             
             LOGGER.log_profiling(f"Successfully done profiling and found cut offs for features", logging.INFO)
 
@@ -100,6 +71,62 @@ class MatrixProfiling:
             LOGGER.log_profiling(f"Error in finding profile cutoffs - {e}", logging.ERROR)
 
 
+    def prepare_reference(self):
+        """
+        Description:
+        Precompute everything about self.faulty that the distance profile needs, as it never changes -
+        1. Rolling mean, standard deviation and constant flag of every subsequence of window size for all features
+        2. FFT of the reference series (zero padded) for the sliding dot product
+        """
+        features = list(self.profile_cutoffs.keys())
+        T = self.faulty[features].values.astype(np.float64)
+        subsequences = sliding_window_view(T, self.window, axis=0) # (n-m+1, features, m) view, no copy
+        nfft = 1 << int(np.ceil(np.log2(T.shape[0] + self.window - 1)))
+
+        self.reference = dict(
+            features=features,
+            length=T.shape[0],
+            nfft=nfft,
+            mean=subsequences.mean(axis=2),
+            std=subsequences.std(axis=2),
+            isconstant=np.ptp(subsequences, axis=2) == 0,
+            fft=np.fft.rfft(T, n=nfft, axis=0),
+            cutoffs=np.array([self.profile_cutoffs[feature] for feature in features]),
+        )
+
+    def distance_scores(self, X_slice):
+        """
+        Parameter: X_slice - pd dataframe of the last window size readings
+        Description:
+        1. Only the query side terms (mean, standard deviation, FFT) are computed, for all features in one batch
+        2. Sliding dot product with the precomputed reference FFT gives the distance profile of every feature
+        3. Return the least z-normalised distance of every feature (same as stumpy.match(...)[0][0])
+        """
+        if getattr(self, 'reference', None) is None:
+            self.prepare_reference() # Models saved before the reference was precomputed
+        reference = self.reference
+        m = self.window
+
+        Q = X_slice[reference['features']].values.astype(np.float64)
+        mean_Q = Q.mean(axis=0)
+        std_Q = Q.std(axis=0)
+        Q_isconstant = np.ptp(Q, axis=0) == 0
+
+        # Sliding dot product of Q with every subsequence of the reference
+        Q_fft = np.fft.rfft(Q[::-1], n=reference['nfft'], axis=0)
+        QT = np.fft.irfft(Q_fft * reference['fft'], n=reference['nfft'], axis=0)[m-1 : reference['length']]
+
+        denom = np.maximum(m * std_Q * reference['std'], 1e-14)
+        corr = np.minimum((QT - m * mean_Q * reference['mean']) / denom, 1.0)
+        D_squared = np.abs(2 * m * (1.0 - corr))
+
+        # Same convention as stumpy for constant subsequences
+        T_isconstant = reference['isconstant']
+        D_squared = np.where(Q_isconstant | T_isconstant, m, D_squared)
+        D_squared = np.where(Q_isconstant & T_isconstant, 0, D_squared)
+
+        return np.sqrt(D_squared.min(axis=0))
+
     def predict(self, X):
         """
         Description:
@@ -116,17 +143,8 @@ class MatrixProfiling:
             return -1
         try:
             X_slice = X[-1-self.window+1 : ]
-            no_of_faulty_params  = 0
-            no_of_healthy_params = 0
-
-            for feature in self.profile_cutoffs.keys():
-                matches = stumpy.match(Q=X_slice[feature], T=self.faulty[feature])
-                score = matches[0][0]
-
-                if score < self.profile_cutoffs[feature]:
-                    no_of_faulty_params += 1
-                else:
-                    no_of_healthy_params += 1
+            scores = self.distance_scores(X_slice)
+            no_of_faulty_params = np.count_nonzero(scores < self.reference['cutoffs'])
 
             if no_of_faulty_params > 3:
                 return 1 # Faulty
@@ -137,69 +155,46 @@ class MatrixProfiling:
             return -1
 
 
-    def calculate_f1(self, data_slice):
-        
-        true = []
-        predictions = []
-
-        for i in range(data_slice.shape[0]):
-            try:
-                status = data_slice.iloc[i]['status']
-                prediction = self.predict(data_slice.iloc[:i])
-
-                if prediction != -1:
-                    predictions.append(prediction)
-                    true.append(status)
-                    
-            except Exception as e:
-                pass
-        return (predictions, true)
-    
-    def callback_update_f1(self, future):
-        try:
-            predictions, true = future.result()
-
-            for i in range(len(predictions)):
-                if predictions[i] == true[i]:
-                    if true[i] == 1:
-                        self.TP += 1
-                    else:
-                        self.TN += 1
-                else:
-                    if true[i] == 1:
-                        self.FN += 1
-                    else:
-                        self.FP += 1 
-        except Exception as e:
-            pass
-
-
+    def score(self, X):
+        """
+        Parameter: X - pd dataframe of readings - a batch of windows, every row with window-1 past readings ends a window
+        Description:
+        1. Least distance of every window from the fault reference - one AB-join per feature for the whole batch
+           (a single window uses distance_scores)
+        2. Return pd dataframe (index of X, one column per feature) of distance / cutoff of the feature -
+           below 1 the feature is anomalous, prediction is 1 when more than 3 features are below 1.
+           Rows without enough past readings are nan.
+        """
+        features = list(self.profile_cutoffs.keys())
+        ratios = np.full((X.shape[0], len(features)), np.nan)
+        if X.shape[0] >= self.window:
+            if X.shape[0] == self.window:
+                scores = self.distance_scores(X)[np.newaxis, :]
+            else:
+                scores = self.rolling_distance_scores(X)
+            cutoffs = np.array([self.profile_cutoffs[feature] for feature in features])
+            ratios[self.window-1:] = scores / np.maximum(cutoffs, 1e-12)
+        return pd.DataFrame(ratios, index=X.index, columns=features)
 
+    def rolling_distance_scores(self, X):
+        """
+        Parameter: X - pd dataframe of readings
+        Description:
+        1. AB-join of every feature of X with the same feature of self.faulty
+        2. Return (no. of windows x features) array - row i is the least distance of the window X[i : i+self.window]
+        """
+        scores = [
+            self.find_distance_profile(X[feature].values.astype(np.float64), self.faulty[feature].values.astype(np.float64))
+            for feature in self.profile_cutoffs.keys()
+        ]
+        return np.column_stack(scores)
 
     def check_performance(self, data):
         """
         This method calculates the TP, TN, FP, FN scores on the parameter - data
-        1. Divides the data in chunks
-        2. Start a new process with each chunk for calculation
-        """
-        with ProcessPoolExecutor() as executor:
-            query_N = data.shape[0]
-            chunk = 500
-            start_idx = 0
-            end_idx = chunk
-
-            while True:
-                if end_idx > query_N:
-                    end_idx = query_N
-                if start_idx == end_idx:
-                    break
-                
-                job = executor.submit(self.calculate_f1, data.iloc[start_idx : end_idx])
-                job.add_done_callback(self.callback_update_f1)
-
-                start_idx, end_idx = end_idx, end_idx + chunk
-            
-            executor.shutdown()
-
-        
-
+        1. Find the prediction of every timestamp of data in one sliding pass with Backtest
+        2. Save the prediction series in self.predictions
+        """
+        backtest = Backtest(self).run(data)
+        self.predictions = backtest.predictions
+        self.TP, self.TN, self.FP, self.FN = backtest.TP, backtest.TN, backtest.FP, backtest.FN
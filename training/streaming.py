@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+
+
+class RunningSmoother:
+    """
+    Keeps the moving average of every feature as a running state so that each new
+    reading is absorbed in O(1), no matter how large the rolling window is.
+
+    1. "sma" - running sum of the last rolling_window rows
+    2. "ewm" - running weighted sum and sum of weights (same as pandas ewm(com=rolling_window) with adjust=True)
+    3. If history is given, only the last history rows take part in the average - same as
+       calling the batch smoothing on a queue which holds the last history rows
+    """
+    def __init__(self, n_features, rolling_window, method, history=None):
+        """
+        Parameters:
+        n_features(int) - no. of features in every reading
+        rolling_window(int) - no. of lags to smoothen the data
+        method(str) - "sma" for simple moving average and "ewm" for exponential moving average
+        history(int) - no. of latest rows seen by the batch path (e.g. DATA_WINDOW), None for no limit
+        """
+        if method not in ("sma", "ewm"):
+            raise ValueError(f"Unknown smoothing method - {method}")
+
+        self.n_features = n_features
+        self.rolling_window = rolling_window
+        self.method = method
+        self.history = history
+
+        if method == "sma":
+            self.size = rolling_window
+        else:
+            self.size = history
+            self.decay = rolling_window / (rolling_window + 1) # 1 - alpha, alpha = 1/(1+com)
+            if history is not None:
+                self.weights = self.decay ** np.arange(history)[::-1] # Oldest row gets the smallest weight
+                self.decay_out = self.decay ** history
+
+        self.reset()
+
+    def reset(self):
+        """
+        Forget all the readings seen till now
+        """
+        self.count = 0
+        self.position = 0
+        self.total = np.zeros(self.n_features)
+        self.weight = 0.0
+        self.buffer = None if self.size is None else np.zeros((self.size, self.n_features))
+
+    def update(self, values):
+        """
+        Parameter: values - 1D array of one reading for all features
+        Description: Add the reading to the running state
+        """
+        values = np.asarray(values, dtype=float)
+
+        if self.method == "sma":
+            self.total += values - self.buffer[self.position]
+        else:
+            self.total = self.decay * self.total + values
+            if self.buffer is not None and self.count >= self.size:
+                self.total -= self.decay_out * self.buffer[self.position] # Reading leaving the history
+            else:
+                self.weight = self.decay * self.weight + 1
+
+        self.count += 1
+        if self.buffer is not None:
+            self.buffer[self.position] = values
+            self.position = (self.position + 1) % self.size
+
+            # Rebuild the sums from the buffer once in a while so that round off errors do not pile up
+            if self.position == 0:
+                self.resync()
+
+    def resync(self):
+        """
+        Recalculate the running sums from the buffered readings
+        """
+        n = min(self.count, self.size)
+        rows = np.roll(self.buffer, -self.position, axis=0)[self.size - n:] # Oldest to latest
+        if self.method == "sma":
+            self.total = rows.sum(axis=0)
+        else:
+            weights = self.weights[self.size - n:]
+            self.total = weights @ rows
+            self.weight = weights.sum()
+
+    def value(self):
+        """
+        Return the smoothened value of the latest reading, all nan if not enough readings are seen
+        """
+        if self.count == 0 or (self.method == "sma" and self.count < self.rolling_window):
+            return np.full(self.n_features, np.nan)
+        if self.method == "sma":
+            return self.total / self.rolling_window
+        return self.total / self.weight
+
+
+class StreamingPredictor:
+    """
+    Stateful version of model.predict(data_queue) for a live stream of readings.
+
+    1. Keep a RunningSmoother with the rolling window and method of the model
+    2. For every new reading update the smoother and predict on the smoothened value
+    3. Return -1 till rolling_window readings are seen - same as model.predict
+    """
+    def __init__(self, model, history=None, features=None):
+        """
+        Parameters:
+        model - trained Clustering or Isolation model
+        history(int) - no. of latest rows the batch path would see, None for no limit
+        features(list) - order of the features in the readings, default is model.feature_names
+        """
+        self.model = model
+        self.features = list(features) if features is not None else model.feature_names
+        self.smoother = RunningSmoother(len(self.features), model.rolling_window, model.method, history)
+
+    def get_values(self, row):
+        """
+        Return the values of a reading (pd Series, dict or array) in the order of self.features
+        """
+        if isinstance(row, pd.Series):
+            return row[self.features].values.astype(float)
+        if isinstance(row, dict):
+            return np.array([row[feature] for feature in self.features], dtype=float)
+        return np.asarray(row, dtype=float)
+
+    def update(self, row):
+        """
+        Parameter: row - a single reading
+        Description: Absorb the reading and return the predicted class level (1 - Fault, 0 - Healthy, -1 - Not enough data)
+        """
+        self.smoother.update(self.get_values(row))
+        if self.smoother.count < self.model.rolling_window:
+            return -1
+        return int(self.model.predict_smoothed(self.smoother.value().reshape(1, -1))[0])
+
+    def latest(self):
+        """
+        Return (smoothened value, severity from model.score_smoothed) of the latest reading, severity is nan if not enough readings are seen
+        """
+        value = self.smoother.value()
+        if self.smoother.count < self.model.rolling_window:
+            return value, np.nan
+        return value, float(self.model.score_smoothed(value.reshape(1, -1))[0])
+
+    def warm_up(self, X):
+        """
+        Parameter: X - pd dataframe (or 2D array) of past readings, oldest first
+        Description: Rebuild the state from past readings and return the prediction of the last one
+        """
+        self.smoother.reset()
+        prediction = -1
+        values = X[self.features].values if isinstance(X, pd.DataFrame) else np.asarray(X)
+        for row in values:
+            self.smoother.update(row)
+        if self.smoother.count >= self.model.rolling_window:
+            prediction = int(self.model.predict_smoothed(self.smoother.value().reshape(1, -1))[0])
+        return prediction
@@ -1,44 +1,63 @@
 from training.clustering import Clustering
 from training.isolation_forest import Isolation
 from training.matrix_profile import MatrixProfiling
+from training.grid_search import grid_search
 import pandas as pd
-from path.path import PROCESSED_DATA, CLUSTERING_MODEL, PROFILE_MODEL, ISOLATION_MODEL
+from preprocessing.cache import load_processed
+from storage.timeseries import load_dataset
+from path.path import CLUSTERING_MODEL, PROFILE_MODEL, ISOLATION_MODEL, CLUSTERING_ARTIFACT, PROFILE_ARTIFACT, ISOLATION_ARTIFACT
+from training.artifacts import save_artifact
+from training.drift import set_watermark, load_new_rows, has_drifted
 import pickle
+import os
 from log.logging import LOGGER
+from metrics.metrics import TRAINING_GRID_MODELS, TRAINING_GRID_FITTED, TRAINING_BEST_SCORE
 import logging
 from datetime import datetime
 
 
+# Min. no. of new rows to update a model incrementally (isolation forest trees need max_samples rows)
+MIN_NEW_ROWS = 256
+
+
 def train_clustering():
     """
     1. First try clustering model with "ewm" and "sma" and different values of rolling_window
     """
 
     try:
-        preprocessed =  pd.read_csv(PROCESSED_DATA, index_col='timestamp')
-        preprocessed.index = pd.to_datetime(preprocessed.index) # Convert index to datetime
+        preprocessed = load_processed() # Memory-mapped columnar cache
 
         best_recall_score = 0
         best_model = None
 
         LOGGER.log_clustering(message="Start of training of clustering", level=logging.INFO)
 
-        for rolling_window in [50,100,150,200,250]:
-            for method in ["ewm", "sma"]:
-                model = Clustering(rolling_window, method, 0.5)
-                model.fit(preprocessed)
-
-                LOGGER.log_clustering(f"Rolling window - {rolling_window}, method - {method}, test recall - {model.test_recall : 0.3f}, test precision - {model.test_precision : 0.3f}, test f1 - {model.test_f1 : 0.3f} ", logging.INFO)
-
-                if model.test_recall > best_recall_score:
-                    best_model = model
-                    best_recall_score = model.test_recall
+        models = [Clustering(rolling_window, method, 0.5) for rolling_window in [50,100,150,200,250] for method in ["ewm", "sma"]]
+        TRAINING_GRID_MODELS.labels("clustering").set(len(models))
+        TRAINING_GRID_FITTED.labels("clustering").set(0)
+        grid_scores = []
+
+        def log_result(model):
+            # Progress of the grid for /metrics
+            grid_scores.append(model.test_recall)
+            TRAINING_GRID_FITTED.labels("clustering").set(len(grid_scores))
+            TRAINING_BEST_SCORE.labels("clustering").set(max(grid_scores))
+            LOGGER.log_clustering(f"Rolling window - {model.rolling_window}, method - {model.method}, test recall - {model.test_recall : 0.3f}, test precision - {model.test_precision : 0.3f}, test f1 - {model.test_f1 : 0.3f} ", logging.INFO)
+
+        # Fit all the models in parallel, smoothened features are computed once per (window, method)
+        for model in grid_search(preprocessed, models, on_result=log_result):
+            if model.test_recall > best_recall_score:
+                best_model = model
+                best_recall_score = model.test_recall
         
         if best_model is not None:
+            set_watermark(best_model, preprocessed) # For incremental retraining
             # Save the model
             with open(CLUSTERING_MODEL, 'wb') as f:
                 pickle.dump(best_model, f)
                 f.close()
+            save_artifact(best_model, CLUSTERING_ARTIFACT) # Compact version for serving
             LOGGER.log_clustering(f"Best model rolling window - {best_model.rolling_window}, method - {best_model.method}, test recall - {best_model.test_recall : 0.3f}, test precision  - {best_model.test_precision:0.3f}, test f1 - {best_model.test_f1 : 0.3f}", logging.INFO)
             LOGGER.log_clustering(message="Successful end of clustering\n\n", level=logging.INFO)
     
@@ -51,31 +70,42 @@ def train_isolation():
     1. Try Isolation forest with different values of rolling window, contamination and max_features
     """
     try:
-        preprocessed =  pd.read_csv(PROCESSED_DATA, index_col='timestamp')
-        preprocessed.index = pd.to_datetime(preprocessed.index) # Convert index to datetime
+        preprocessed = load_processed() # Memory-mapped columnar cache
 
         best_f1_score = 0
         best_model = None
 
         LOGGER.log_isolation(message="Start of training of isolation forest", level=logging.INFO)
 
-        for rolling_window in [100,150,200]:
-            for method in ["ewm", "sma"]:
-                for contamination in [0.05, 0.07, 0.09, 0.1]:
-                    for max_feature in [0.5,0.7,0.9]:
-                        model = Isolation(rolling_window, method, 0.5, contamination, max_feature)
-                        model.fit(preprocessed)
-                        LOGGER.log_isolation(f"Rolling window - {rolling_window}, method - {method}, contamination - {contamination}, max_feature - {max_feature}, test recall - {model.test_recall : 0.3f}, test precision {model.test_precision : 0.3f}, test f1 {model.test_f1 : 0.3f}", logging.INFO)
-
-                        if model.test_f1 > best_f1_score:
-                            best_model = model
-                            best_f1_score = model.test_f1
+        models = [Isolation(rolling_window, method, 0.5, contamination, max_feature)
+                  for rolling_window in [100,150,200]
+                  for method in ["ewm", "sma"]
+                  for contamination in [0.05, 0.07, 0.09, 0.1]
+                  for max_feature in [0.5,0.7,0.9]]
+        TRAINING_GRID_MODELS.labels("isolation").set(len(models))
+        TRAINING_GRID_FITTED.labels("isolation").set(0)
+        grid_scores = []
+
+        def log_result(model):
+            # Progress of the grid for /metrics
+            grid_scores.append(model.test_f1)
+            TRAINING_GRID_FITTED.labels("isolation").set(len(grid_scores))
+            TRAINING_BEST_SCORE.labels("isolation").set(max(grid_scores))
+            LOGGER.log_isolation(f"Rolling window - {model.rolling_window}, method - {model.method}, contamination - {model.contamination}, max_feature - {model.max_features}, test recall - {model.test_recall : 0.3f}, test precision {model.test_precision : 0.3f}, test f1 {model.test_f1 : 0.3f}", logging.INFO)
+
+        # Fit all the models in parallel, smoothened features are computed once per (window, method)
+        for model in grid_search(preprocessed, models, on_result=log_result):
+            if model.test_f1 > best_f1_score:
+                best_model = model
+                best_f1_score = model.test_f1
         
         if best_model is not None:
+            set_watermark(best_model, preprocessed) # For incremental retraining
             # Save the model
             with open(ISOLATION_MODEL, 'wb') as f:
                 pickle.dump(best_model, f)
                 f.close()
+            save_artifact(best_model, ISOLATION_ARTIFACT) # Compact version for serving
             LOGGER.log_isolation(f"""Best model rolling window - {best_model.rolling_window}, method - {best_model.method}, contamination - {best_model.contamination}, max_features - {best_model.max_features}, test recall - {best_model.test_recall : 0.3f}, test precision- {best_model.test_precision : 0.3f}, test f1 - {best_model.test_f1 : 0.3f}""", logging.INFO)
             LOGGER.log_isolation(message="Successful end of isolation forest\n\n", level=logging.INFO)
     
@@ -83,13 +113,75 @@ def train_isolation():
         LOGGER.log_isolation(f"Error in training isolation forest model {e}\n\n", logging.ERROR)
 
 
+def update_model(model_path, artifact_path, update, full_retrain, log):
+    """
+    Parameters:
+    model_path(str), artifact_path(str) - saved pickle and artifact of the model
+    update - function which updates the model with the new smoothened rows
+    full_retrain - function running the full grid search of the model
+    log - logging function of the model
+    Description:
+    1. Load the saved model, run the full grid search if there is no saved model or it has no training watermark
+    2. Read only the rows after the watermark, nothing is done if there are too few of them
+    3. Run the full grid search if the new data has drifted, else update the model and save it with the new watermark
+    """
+    if not os.path.exists(model_path):
+        log(f"No saved model at {model_path}, running full grid search", logging.INFO)
+        full_retrain()
+        return
+
+    with open(model_path, 'rb') as f:
+        model = pickle.load(f)
+
+    if getattr(model, 'trained_until', None) is None or getattr(model, 'drift_reference', None) is None:
+        log("Model has no training watermark, running full grid search", logging.INFO)
+        full_retrain()
+        return
+
+    data, X, y = load_new_rows(model)
+    if data is None or X.shape[0] < MIN_NEW_ROWS:
+        log(f"Only {0 if X is None else X.shape[0]} new rows after {pd.Timestamp(model.trained_until)}, model not updated", logging.INFO)
+        return
+
+    drifted, reason = has_drifted(model, data, X, y)
+    if drifted:
+        log(f"Drift detected ({reason}), running full grid search", logging.INFO)
+        full_retrain()
+        return
+
+    update(model, X)
+    model.trained_until = int(data.index[-1].value)
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    save_artifact(model, artifact_path)
+    log(f"Model updated with {X.shape[0]} new rows till {pd.Timestamp(model.trained_until)}, no drift ({reason})", logging.INFO)
+
+
+def incremental_retrain():
+    """
+    1. Update the saved clustering model with the rows after its watermark (centroid update)
+    2. Update the saved isolation forest with the rows after its watermark (new trees with warm start)
+    Full grid search of a model runs only when drift is detected or it has no watermark
+    """
+    try:
+        update_model(CLUSTERING_MODEL, CLUSTERING_ARTIFACT, lambda model, X: model.partial_fit(X), train_clustering, LOGGER.log_clustering)
+    except Exception as e:
+        LOGGER.log_clustering(f"Error in incremental training of clustering model {e}\n\n", logging.ERROR)
+
+    try:
+        update_model(ISOLATION_MODEL, ISOLATION_ARTIFACT, lambda model, X: model.add_trees(X), train_isolation, LOGGER.log_isolation)
+    except Exception as e:
+        LOGGER.log_isolation(f"Error in incremental training of isolation forest model {e}\n\n", logging.ERROR)
+
+
+
+
 
 
 
 def do_matrix_profiling():
     try:
-        data =  pd.read_csv(PROCESSED_DATA, index_col='timestamp')
-        data.index = pd.to_datetime(data.index) # Convert index to datetime
+        data = load_processed() # Memory-mapped columnar cache
 
         mat_profile = MatrixProfiling()
         mat_profile.find_cutoffs(data)
@@ -97,6 +189,7 @@ def do_matrix_profiling():
         with open(PROFILE_MODEL, 'wb') as f:
             pickle.dump(mat_profile, f)
             f.close()
+        save_artifact(mat_profile, PROFILE_ARTIFACT) # Compact version for serving
 
         LOGGER.log_profiling(f"Profiling done successfully and model saved", logging.INFO)
         LOGGER.log_profiling(mat_profile.profile_cutoffs, logging.INFO)
@@ -107,11 +200,8 @@ def do_matrix_profiling():
     
 def do_sample_prediction_profiling(start_date, end_date):
     try:
-        data =  pd.read_csv(PROCESSED_DATA, index_col='timestamp')
-        data.index = pd.to_datetime(data.index) # Convert index to datetime
-
         LOGGER.log_profiling(f"Doing prediction on data from  {start_date} to {end_date}", logging.INFO)
-        test_data = data.loc[start_date : end_date]
+        test_data = load_dataset(start_date, end_date) # Only the date range is read from the time-series store
         
 
         with open(PROFILE_MODEL, 'rb') as f:
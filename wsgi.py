@@ -1,4 +1,7 @@
 from main import app
 
+# Flask server of the Dash app for gunicorn - gunicorn -c gunicorn.conf.py
+server = app.server
+
 if __name__=="__main__":
-    app.run_server(host='0.0.0.0', debug=False)
\ No newline at end of file
+    app.run_server(host='0.0.0.0', debug=False)